@@ -0,0 +1,70 @@
+"""
+Compares the time taken by twod_materials.utils.get_convergence with
+a full pymatgen Vasprun parse, on a vasprun.xml made artificially
+large by repeating the ionic steps of the BiTeCl test calculation.
+
+usage: python benchmarks/convergence.py [n_ionic_steps]
+"""
+
+import os
+
+import sys
+
+import shutil
+
+import tempfile
+
+import time
+
+from pymatgen.io.vasp.outputs import Vasprun
+
+import twod_materials
+from twod_materials.utils import get_convergence, CACHE_FILENAME
+
+
+TEST_DIR = os.path.join(os.path.dirname(twod_materials.__file__),
+                        'stability/tests/BiTeCl')
+
+
+def make_large_vasprun(directory, n_ionic_steps):
+    """
+    Writes a vasprun.xml with n_ionic_steps copies of the first
+    ionic step of the test calculation.
+    """
+
+    text = open(os.path.join(TEST_DIR, 'vasprun.xml')).read()
+    start = text.index('<calculation>')
+    end = text.index('</calculation>') + len('</calculation>\n')
+    last = text.rindex('</calculation>') + len('</calculation>\n')
+    with open(os.path.join(directory, 'vasprun.xml'), 'w') as vasprun:
+        vasprun.write(text[:start])
+        for i in range(n_ionic_steps):
+            vasprun.write(text[start:end])
+        vasprun.write(text[last:])
+
+
+if __name__ == '__main__':
+
+    n_ionic_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    directory = tempfile.mkdtemp()
+    make_large_vasprun(directory, n_ionic_steps)
+    size = os.path.getsize(os.path.join(directory, 'vasprun.xml'))
+    print('vasprun.xml: {} ionic steps, {:.1f} MB'.format(
+        n_ionic_steps, size / 1e6))
+
+    start = time.time()
+    full = Vasprun(os.path.join(directory, 'vasprun.xml')).converged
+    print('Vasprun(...).converged: {:.3f} s'.format(time.time() - start))
+
+    start = time.time()
+    streamed = get_convergence(directory)
+    print('get_convergence: {:.3f} s {}'.format(time.time() - start,
+                                                streamed))
+
+    start = time.time()
+    get_convergence(directory)
+    print('get_convergence (cached): {:.4f} s'.format(time.time() - start))
+
+    assert full == streamed[0]
+    os.remove(os.path.join(directory, CACHE_FILENAME))
+    shutil.rmtree(directory)
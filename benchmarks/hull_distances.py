@@ -0,0 +1,64 @@
+"""
+Compares building one phase diagram per 2D material (with the material
+added to the reference entries) against building the Bi-Te-Cl hull
+once and evaluating every material against it, for a few hundred
+made-up BiTeCl-like entries. Needs no Materials Project access.
+
+usage: python benchmarks/hull_distances.py [n_entries]
+"""
+
+import sys
+
+import random
+
+import time
+
+from pymatgen.phasediagram.pdanalyzer import PDAnalyzer
+from pymatgen.phasediagram.pdmaker import PhaseDiagram
+from pymatgen.entries.computed_entries import ComputedEntry
+
+from twod_materials.stability.analysis import get_decomps_and_e_above_hull
+
+
+# (formula, energy per atom) of the made-up reference phases.
+REFERENCES = [('Bi', -3.9), ('Bi', -3.8), ('Te', -3.1), ('Te', -3.0),
+              ('Cl', -1.8), ('BiCl3', -3.0), ('Bi2Te3', -3.9),
+              ('Bi2Te3', -3.85), ('TeCl4', -2.4), ('BiTe', -3.7),
+              ('Bi4Te3', -3.8), ('BiTeCl', -3.35), ('BiTeCl', -3.3)]
+
+FORMULAS = ['BiTeCl', 'Bi2TeCl', 'BiTe2Cl', 'BiTeCl2', 'Bi2Te2Cl']
+
+
+def make_entry(formula, energy_per_atom):
+    entry = ComputedEntry(formula, 0)
+    n_atoms = entry.composition.num_atoms
+    return ComputedEntry(formula, energy_per_atom * n_atoms)
+
+
+if __name__ == '__main__':
+
+    n_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    random.seed(0)
+    references = [make_entry(formula, energy)
+                  for formula, energy in REFERENCES]
+    entries = [make_entry(random.choice(FORMULAS), random.uniform(-3.6, -3.0))
+               for i in range(n_entries)]
+
+    start = time.time()
+    one_per_entry = []
+    for entry in entries:
+        pda = PDAnalyzer(PhaseDiagram(references + [entry]))
+        one_per_entry.append(
+            pda.get_decomp_and_e_above_hull(entry, allow_negative=True)[1])
+    print('one hull per entry ({} hulls): {:.3f} s'.format(
+        n_entries, time.time() - start))
+
+    start = time.time()
+    shared = [e_above_hull for decomp, e_above_hull in
+              get_decomps_and_e_above_hull(entries, references)]
+    print('one shared hull: {:.3f} s'.format(time.time() - start))
+
+    # Entries on or below the hull come out as 0 when they're part of
+    # their own phase diagram, and negative against the shared one.
+    for old, new in zip(one_per_entry, shared):
+        assert abs(old - max(new, 0)) < 1e-8, (old, new)
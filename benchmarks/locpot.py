@@ -0,0 +1,100 @@
+"""
+Compares the time and peak memory of the planar-averaged local
+potential from Locpot.from_file(...).get_average_along_axis with
+read_planar_average, on a made-up LOCPOT of BiTeCl with an
+n_x x n_y x n_z grid. Each reader runs in its own interpreter so that
+their peak memory can be told apart.
+
+usage: python benchmarks/locpot.py [n_x n_y n_z]
+"""
+
+import os
+
+import sys
+
+import shutil
+
+import resource
+
+import subprocess
+
+import tempfile
+
+import time
+
+import numpy as np
+
+from pymatgen.io.vasp.inputs import Poscar
+from pymatgen.io.vasp.outputs import Locpot
+
+import twod_materials
+from twod_materials.electronic_structure.analysis import read_planar_average
+
+
+TEST_DIR = os.path.join(os.path.dirname(twod_materials.__file__),
+                        'stability/tests/BiTeCl')
+
+
+def write_locpot(filename, dim):
+    """
+    Writes a LOCPOT in VASP's layout (x fastest, 5 values per line)
+    without building the whole grid in memory.
+    """
+
+    poscar = Poscar.from_file(os.path.join(TEST_DIR, 'POSCAR'))
+    with open(filename, 'w') as locpot:
+        locpot.write(str(poscar) + '\n')
+        locpot.write('{} {} {}\n'.format(*dim))
+        values = []
+        for z in range(dim[2]):
+            values.extend(np.sin(z * 0.1) + np.random.uniform(
+                -1, 1, dim[0] * dim[1]))
+            n_lines = len(values) // 5
+            if n_lines:
+                locpot.write('\n'.join(' '.join('%0.11e' % value for value
+                                                in values[5 * i:5 * i + 5])
+                                       for i in range(n_lines)) + '\n')
+                values = values[5 * n_lines:]
+        if values:
+            locpot.write(' '.join('%0.11e' % value for value in values) + '\n')
+
+
+def get_peak_memory():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def read(reader, filename):
+    baseline = get_peak_memory()
+    start = time.time()
+    if reader == 'pymatgen':
+        profile = Locpot.from_file(filename).get_average_along_axis(2)
+    else:
+        profile = read_planar_average(filename, 2)
+    np.save(filename + '.' + reader + '.npy', profile)
+    print('{}: {:.3f} s, peak memory {} MB above the {} MB after imports'
+          .format(reader, time.time() - start,
+                  get_peak_memory() - baseline, baseline))
+
+
+if __name__ == '__main__':
+
+    if sys.argv[1:2] == ['--read']:
+        read(sys.argv[2], sys.argv[3])
+        sys.exit()
+
+    dim = [int(n) for n in sys.argv[1:4]] if len(sys.argv) > 3 \
+        else [96, 96, 600]
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'LOCPOT')
+    np.random.seed(0)
+    write_locpot(filename, dim)
+    print('{}x{}x{} grid, {} MB LOCPOT'.format(
+        dim[0], dim[1], dim[2], os.path.getsize(filename) // 1024**2))
+
+    for reader in ['pymatgen', 'streaming']:
+        subprocess.check_call([sys.executable, __file__, '--read', reader,
+                               filename])
+
+    assert np.allclose(np.load(filename + '.pymatgen.npy'),
+                       np.load(filename + '.streaming.npy'))
+    shutil.rmtree(directory)
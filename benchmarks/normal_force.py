@@ -0,0 +1,58 @@
+"""
+Compares fitting the energy vs. interlayer spacing curve the way
+plot_normal_force, plot_mu_vs_F_N and get_mu_vs_F_N each used to (a
+spline evaluated on a 0.001 Angstrom grid, and its slope at the
+spacings) against one memoized NormalEnergyCurve shared by all three,
+for many made-up materials.
+
+usage: python benchmarks/normal_force.py [n_materials]
+"""
+
+import sys
+
+import time
+
+import numpy as np
+
+from scipy import interpolate
+
+from twod_materials.friction.analysis import NormalEnergyCurve
+
+
+SPACINGS = np.arange(1.5, 4.25, 0.25)
+
+
+def dense_grid_forces(spacings, energies):
+    spline = interpolate.splrep(spacings, energies, s=0)
+    xnew = np.arange(spacings[0], spacings[-1], 0.001)
+    ynew = interpolate.splev(xnew, spline, der=0)
+    return xnew, ynew, -interpolate.splev(spacings, spline, der=1)
+
+
+if __name__ == '__main__':
+
+    n_materials = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    np.random.seed(0)
+    materials = [np.random.uniform(1, 10) * np.exp(-2 * SPACINGS)
+                 - np.random.uniform(0, 1) * SPACINGS**-6
+                 for i in range(n_materials)]
+
+    start = time.time()
+    old = []
+    for energies in materials:
+        # Once for each of the three functions.
+        for i in range(3):
+            forces = dense_grid_forces(SPACINGS, energies)[2]
+        old.append(forces)
+    print('dense grid, refit 3 times: {:.3f} s'.format(time.time() - start))
+
+    start = time.time()
+    new = []
+    for energies in materials:
+        curve = NormalEnergyCurve(SPACINGS, energies)
+        for i in range(3):
+            forces = curve.get_force()
+        new.append(forces)
+    print('one NormalEnergyCurve: {:.3f} s'.format(time.time() - start))
+
+    assert np.allclose(old, new)
@@ -0,0 +1,73 @@
+"""
+Times writing the POTCARs for a gamma-surface-sized grid of BiTeCl
+directories, once with a full copy in each directory and once with
+hardlinks, against a made-up potentials directory with full-sized
+POTCARs.
+
+usage: python benchmarks/potcar.py [n_directories]
+"""
+
+import os
+
+import sys
+
+import shutil
+
+import tempfile
+
+import time
+
+import twod_materials
+from twod_materials.utils import write_potcar
+
+
+TEST_DIR = os.path.join(os.path.dirname(twod_materials.__file__),
+                        'stability/tests/BiTeCl')
+
+# Roughly the size of a real POTCAR, in lines.
+N_POTCAR_LINES = 3000
+
+
+def make_potentials(pot_path):
+    """
+    Writes made-up POTCARs for Bi, Te, Cl and a few other potentials
+    into pot_path.
+    """
+
+    for symbol in ['Bi', 'Bi_d', 'Te', 'Cl', 'Mo_pv', 'S', 'W_pv', 'Se']:
+        os.mkdir(os.path.join(pot_path, symbol))
+        with open(os.path.join(pot_path, symbol, 'POTCAR'), 'w') as potcar:
+            for i in range(N_POTCAR_LINES):
+                potcar.write('  {} {:.8f} {:.8f} {:.8f}\n'.format(
+                    symbol, i * 0.1, i * 0.2, i * 0.3))
+
+
+def make_grid(directory, n_directories):
+    grid_dirs = []
+    for i in range(n_directories):
+        grid_dir = os.path.join(directory, '{}x{}'.format(i // 20, i % 20))
+        os.mkdir(grid_dir)
+        shutil.copy(os.path.join(TEST_DIR, 'POSCAR'), grid_dir)
+        grid_dirs.append(grid_dir)
+    return grid_dirs
+
+
+if __name__ == '__main__':
+
+    n_directories = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    pot_path = tempfile.mkdtemp()
+    make_potentials(pot_path)
+
+    for link in [False, True]:
+        directory = tempfile.mkdtemp()
+        grid_dirs = make_grid(directory, n_directories)
+        start = time.time()
+        for grid_dir in grid_dirs:
+            write_potcar(pot_path, directory=grid_dir, link=link)
+        print('{} POTCARs (link={}): {:.3f} s'.format(
+            n_directories, link, time.time() - start))
+        assert len(set(open(os.path.join(grid_dir, 'POTCAR')).read()
+                       for grid_dir in grid_dirs[::50])) == 1
+        shutil.rmtree(directory)
+
+    shutil.rmtree(pot_path)
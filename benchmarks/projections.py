@@ -0,0 +1,175 @@
+"""
+Compares the time and peak memory of reading the element-projected
+band structure of a made-up n x n BiTeCl supercell (n_kpoints from
+Gamma to X, n_bands bands, random projections on 9 orbitals) with
+BSVasprun(parse_projected_eigen=True) and with the streaming
+read_projected_bands. Each reader runs in its own interpreter so that
+their peak memory can be told apart.
+
+usage: python benchmarks/projections.py [n n_kpoints n_bands]
+"""
+
+import os
+
+import sys
+
+import shutil
+
+import resource
+
+import subprocess
+
+import tempfile
+
+import time
+
+import numpy as np
+
+from pymatgen.core.structure import Structure
+from pymatgen.io.vasp.outputs import BSVasprun
+from pymatgen.electronic_structure.core import Spin
+
+import twod_materials
+from twod_materials.electronic_structure.analysis import read_projected_bands
+
+
+TEST_DIR = os.path.join(os.path.dirname(twod_materials.__file__),
+                        'stability/tests/BiTeCl')
+
+# The fields of vasprun.xml's projected array with LORBIT = 11.
+PROJECTED_FIELDS = ['s', 'py', 'pz', 'px', 'dxy', 'dyz', 'dz2', 'dxz',
+                    'x2-y2']
+
+
+def write_varray(f, name, rows):
+    f.write('  <varray name="{}" >\n'.format(name))
+    for row in rows:
+        f.write('   <v>{}</v>\n'.format(
+            ' '.join('%16.8f' % value for value in row)))
+    f.write('  </varray>\n')
+
+
+def write_vasprun(directory, n, n_kpoints, n_bands):
+    """
+    Writes a vasprun.xml (with the BiTeCl run's incar and parameters)
+    and a line-mode KPOINTS to directory, one band at a time.
+    """
+
+    structure = Structure.from_file(os.path.join(TEST_DIR, 'POSCAR'))
+    structure.make_supercell([n, n, 1])
+    symbols = [str(site.specie) for site in structure]
+    elements = sorted(set(symbols), key=symbols.index)
+    kpoints = np.column_stack([np.linspace(0, 0.5, n_kpoints),
+                               np.zeros((n_kpoints, 2))])
+
+    with open(os.path.join(TEST_DIR, 'vasprun.xml')) as f:
+        template = f.read()
+    header = template[:template.index('<kpoints>')]
+    parameters = template[template.index('<parameters>'):
+                          template.index('<atominfo>')]
+
+    with open(os.path.join(directory, 'vasprun.xml'), 'w') as f:
+        f.write(header + '<kpoints>\n')
+        write_varray(f, 'kpointlist', kpoints)
+        write_varray(f, 'weights', [[1.0 / n_kpoints]] * n_kpoints)
+        f.write(' </kpoints>\n ' + parameters)
+
+        f.write('<atominfo>\n  <array name="atoms" >\n   <set>\n')
+        for symbol in symbols:
+            f.write('    <rc><c>{}</c><c>{}</c></rc>\n'.format(
+                symbol, elements.index(symbol) + 1))
+        f.write('   </set>\n  </array>\n  <array name="atomtypes" >\n'
+                '   <set>\n')
+        for element in elements:
+            f.write('    <rc><c>{}</c><c>{}</c><c>1</c><c>1</c>'
+                    '<c>PAW_PBE {} 08Apr2002</c></rc>\n'.format(
+                        symbols.count(element), element, element))
+        f.write('   </set>\n  </array>\n </atominfo>\n')
+
+        f.write(' <calculation>\n  <eigenvalues>\n   <array>\n    <set>\n'
+                '     <set comment="spin 1">\n')
+        energies = (np.linspace(-10, 10, n_bands)[np.newaxis]
+                    + 0.5 * np.sin(10 * kpoints[:, :1]))
+        for k in range(n_kpoints):
+            f.write('      <set comment="kpoint {}">\n'.format(k + 1))
+            for energy in energies[k]:
+                f.write('       <r> {:.4f} {:.4f} </r>\n'.format(
+                    energy, float(energy < 0)))
+            f.write('      </set>\n')
+        f.write('     </set>\n    </set>\n   </array>\n  </eigenvalues>\n')
+
+        f.write('  <projected>\n   <array>\n')
+        for field in PROJECTED_FIELDS:
+            f.write('    <field>{}</field>\n'.format(field))
+        f.write('    <set>\n     <set comment="spin1">\n')
+        for k in range(n_kpoints):
+            f.write('      <set comment="kpoint {}">\n'.format(k + 1))
+            for b in range(n_bands):
+                f.write('       <set comment="band {}">\n'.format(b + 1))
+                for row in np.random.uniform(0, 0.1, (len(symbols), 9)):
+                    f.write('        <r>{}</r>\n'.format(
+                        ' '.join('%6.4f' % value for value in row)))
+                f.write('       </set>\n')
+            f.write('      </set>\n')
+        f.write('     </set>\n    </set>\n   </array>\n  </projected>\n')
+        f.write('  <dos>\n   <i name="efermi">     0.00000000 </i>\n'
+                '  </dos>\n </calculation>\n')
+
+        f.write(' <structure name="finalpos" >\n  <crystal>\n')
+        write_varray(f, 'basis', structure.lattice.matrix)
+        f.write('  </crystal>\n')
+        write_varray(f, 'positions', structure.frac_coords)
+        f.write(' </structure>\n</modeling>\n')
+
+    with open(os.path.join(directory, 'KPOINTS'), 'w') as f:
+        f.write('Gamma to X\n{}\nLine_mode\nReciprocal\n'
+                '0 0 0 ! \\Gamma\n0.5 0 0 ! X\n'.format(n_kpoints))
+
+
+def get_peak_memory():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def read(reader, directory):
+    vasprun = os.path.join(directory, 'vasprun.xml')
+    kpoints = os.path.join(directory, 'KPOINTS')
+    baseline = get_peak_memory()
+    start = time.time()
+    if reader == 'pymatgen':
+        band_structure = BSVasprun(vasprun, parse_projected_eigen=True) \
+            .get_band_structure(kpoints, line_mode=True)
+    else:
+        band_structure = read_projected_bands(vasprun, kpoints)
+    projections = band_structure.get_projection_on_elements()[Spin.up]
+    elements = sorted(projections[0][0])
+    np.save(os.path.join(directory, reader + '.npy'),
+            [[[kpoint[element] for element in elements] for kpoint in band]
+             for band in projections])
+    print('{}: {:.3f} s, peak memory {} MB above the {} MB after imports'
+          .format(reader, time.time() - start,
+                  get_peak_memory() - baseline, baseline))
+
+
+if __name__ == '__main__':
+
+    if sys.argv[1:2] == ['--read']:
+        read(sys.argv[2], sys.argv[3])
+        sys.exit()
+
+    n, n_kpoints, n_bands = [int(arg) for arg in sys.argv[1:4]] \
+        if len(sys.argv) > 3 else [3, 60, 108]
+    directory = tempfile.mkdtemp()
+    np.random.seed(0)
+    write_vasprun(directory, n, n_kpoints, n_bands)
+    print('{}x{} supercell, {} k-points, {} bands: {} MB vasprun.xml'.format(
+        n, n, n_kpoints, n_bands,
+        os.path.getsize(os.path.join(directory, 'vasprun.xml')) // 1024**2))
+
+    for reader in ['pymatgen', 'streaming']:
+        subprocess.check_call([sys.executable, __file__, '--read', reader,
+                               directory])
+
+    assert np.allclose(np.load(os.path.join(directory, 'pymatgen.npy')),
+                       np.load(os.path.join(directory, 'streaming.npy')),
+                       atol=1e-5)
+    shutil.rmtree(directory)
@@ -0,0 +1,89 @@
+"""
+Times a serial is_converged/Vasprun sweep against
+twod_materials.utils.scan_directories on a synthetic tree of run
+directories, each holding a link to the BiTeCl test vasprun.xml
+(every tenth one has no vasprun.xml, as if its job were still queued).
+
+usage: python benchmarks/scan_directories.py [n_directories] [n_workers]
+
+Threads only pay off when file access latency dominates (e.g. Lustre);
+on a local disk the processes=True pool is the one to watch.
+"""
+
+import os
+
+import sys
+
+import shutil
+
+import tempfile
+
+import time
+
+from pymatgen.io.vasp.outputs import Vasprun
+
+import twod_materials
+from twod_materials.utils import scan_directories, CACHE_FILENAME
+
+
+TEST_VASPRUN = os.path.join(os.path.dirname(twod_materials.__file__),
+                            'stability/tests/BiTeCl/vasprun.xml')
+
+
+def make_tree(root, n_directories):
+    directories = []
+    for i in range(n_directories):
+        directory = os.path.join(root, 'run_{}'.format(i))
+        os.mkdir(directory)
+        if i % 10:
+            os.symlink(TEST_VASPRUN, os.path.join(directory, 'vasprun.xml'))
+        directories.append(directory)
+    return directories
+
+
+def serial_sweep(directories):
+    results = {}
+    for directory in directories:
+        try:
+            vasprun = Vasprun(os.path.join(directory, 'vasprun.xml'))
+            results[directory] = (vasprun.converged,
+                                  float(vasprun.final_energy))
+        except:
+            results[directory] = (False, None)
+    return results
+
+
+if __name__ == '__main__':
+
+    n_directories = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    root = tempfile.mkdtemp()
+    directories = make_tree(root, n_directories)
+
+    start = time.time()
+    serial = serial_sweep(directories)
+    print('serial Vasprun sweep: {:.2f} s'.format(time.time() - start))
+
+    start = time.time()
+    scan = scan_directories(directories, n_workers)
+    print('scan_directories ({} threads, cold): {:.2f} s'.format(
+        n_workers, time.time() - start))
+
+    start = time.time()
+    scan_directories(directories, n_workers)
+    print('scan_directories ({} threads, cached): {:.2f} s'.format(
+        n_workers, time.time() - start))
+
+    for directory in directories:
+        if os.path.exists(os.path.join(directory, CACHE_FILENAME)):
+            os.remove(os.path.join(directory, CACHE_FILENAME))
+    start = time.time()
+    scan_directories(directories, n_workers, processes=True)
+    print('scan_directories ({} processes, cold): {:.2f} s'.format(
+        n_workers, time.time() - start))
+
+    for directory in directories:
+        assert serial[directory] == (scan[directory]['converged'],
+                                     scan[directory]['final_energy']), \
+            (directory, serial[directory], scan[directory])
+    shutil.rmtree(root)
@@ -0,0 +1,56 @@
+"""
+Times padding a large BiTeCl supercell to 20 Angstroms of vacuum, both
+through the POSCAR (set_vacuum: one read, one write) and entirely in
+memory (set_structure_vacuum), and checks the two agree.
+
+usage: python benchmarks/vacuum.py [supercell_size]
+"""
+
+import os
+
+import sys
+
+import shutil
+
+import tempfile
+
+import time
+
+import numpy as np
+
+from pymatgen.core.structure import Structure
+
+import twod_materials
+from twod_materials.utils import (get_spacing, get_structure_spacing,
+                                  set_vacuum, set_structure_vacuum)
+
+
+TEST_DIR = os.path.join(os.path.dirname(twod_materials.__file__),
+                        'stability/tests/BiTeCl')
+
+
+if __name__ == '__main__':
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    structure = Structure.from_file(os.path.join(TEST_DIR, 'POSCAR'))
+    structure.make_supercell([size, size, 1])
+    print('{}x{} supercell: {} atoms'.format(size, size, structure.num_sites))
+
+    directory = tempfile.mkdtemp()
+    poscar = os.path.join(directory, 'POSCAR')
+    structure.to('POSCAR', poscar)
+
+    start = time.time()
+    set_vacuum(20, 0.9, poscar)
+    print('set_vacuum (POSCAR): {:.3f} s'.format(time.time() - start))
+
+    start = time.time()
+    padded = set_structure_vacuum(structure, 20, 0.9)
+    print('set_structure_vacuum (in memory): {:.3f} s'.format(
+        time.time() - start))
+
+    assert abs(get_spacing(poscar) - 20) < 1e-6
+    assert abs(get_structure_spacing(padded) - 20) < 1e-6
+    assert np.allclose(Structure.from_file(poscar).frac_coords,
+                       padded.frac_coords, atol=1e-6)
+    shutil.rmtree(directory)
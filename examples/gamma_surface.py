@@ -1,11 +1,9 @@
-from twod_materials.friction.startup import run_friction_calculations
+from twod_materials.friction.startup import run_gamma_calculations
 from twod_materials.friction.analysis import plot_gamma_surface
 
 import os
 
-import time
-
-from twod_materials.utils import is_converged
+from twod_materials.monitor import CampaignMonitor
 
 
 INTERVAL = 360  # Seconds between convergence checks
@@ -13,38 +11,24 @@ INTERVAL = 360  # Seconds between convergence checks
 directories = [dir for dir in os.listdir(os.getcwd()) if os.path.isdir(dir)
                and dir not in ['all_competitors']]
 
-if __name__ == '__main__':
-
-    converged = {}
 
-    for directory in directories:
-        os.chdir(directory)
-        converged[directory] = False
-        run_friction_calculations()
-        os.chdir('../')
+def plot(directory):
+    print '>> Plotting gamma surface for {}'.format(directory)
+    plot_gamma_surface(directory=directory)
 
-    loop = True
 
-    while loop:
-        time.sleep(INTERVAL)
-
-        loop = False
+if __name__ == '__main__':
 
-        for directory in directories:
-            os.chdir(directory)
-            converged[directory] = True
-            for subdirectory in [
-                    dir for dir in os.listdir(os.getcwd())
-                    if os.path.isdir(dir)]:
-                if not is_converged(subdirectory):
-                    converged[directory] = False
-                    break
+    monitor = CampaignMonitor(INTERVAL)
 
-            if not converged[directory]:
-                print '>> Not all directories converged'
-                loop = True
+    for directory in directories:
+        run_gamma_calculations(directory=directory)
 
-            print '>> Plotting gamma surface for {}'.format(directory)
-            plot_gamma_surface()
+        lateral = os.path.join(directory, 'friction/lateral')
+        monitor.add_stage(
+            directory, [os.path.join(lateral, dir)
+                        for dir in os.listdir(lateral)
+                        if os.path.isdir(os.path.join(lateral, dir))],
+            lambda directory=directory: plot(directory))
 
-            os.chdir('../')
+    monitor.run()
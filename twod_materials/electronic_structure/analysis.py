@@ -1,20 +1,154 @@
 import os
 
+import itertools
+
+import json
+
+import collections
+
+import xml.etree.cElementTree as ET
+
+from multiprocessing import Pool
+
 import numpy as np
 
+import matplotlib as mpl
+mpl.use('Agg')
+import matplotlib.pyplot as plt
+
 from pymatgen.core.structure import Structure
-from pymatgen.io.vasp.outputs import BSVasprun, Locpot, VolumetricData
+from pymatgen.core.lattice import Lattice
+from pymatgen.io.vasp.inputs import Kpoints
+from pymatgen.io.vasp.outputs import BSVasprun
+from pymatgen.electronic_structure.bandstructure import BandStructureSymmLine
 from pymatgen.electronic_structure.plotter import BSPlotter, BSPlotterProjected
 from pymatgen.electronic_structure.core import Spin
 
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
+from twod_materials.utils import (is_converged, get_cached_result,
+                                  get_fingerprint)
+
+
+def read_planar_average(filename='LOCPOT', axis=2):
+    """
+    Returns the average of the volumetric data in a LOCPOT (or CHGCAR)
+    over each plane perpendicular to axis, the same as
+    Locpot.from_file(filename).get_average_along_axis(axis). The grid is
+    read and reduced one slab (a plane of constant z, which is
+    contiguous in the file) at a time, so the whole grid is never held
+    in memory.
+    """
+
+    with open(filename) as locpot:
+        # The structure ends at the first blank line after the comment,
+        # and the grid's dimensions come right after it.
+        locpot.readline()
+        for line in locpot:
+            if not line.strip():
+                break
+        for line in locpot:
+            if line.strip():
+                n_x, n_y, n_z = [int(n) for n in line.split()]
+                break
+
+        slab_size = n_x * n_y
+        profile = np.zeros([n_x, n_y, n_z][axis])
+        values = np.zeros(0)
+        for z in range(n_z):
+            while len(values) < slab_size:
+                # At least 5 values per line, as VASP writes them.
+                lines = list(itertools.islice(
+                    locpot, (slab_size - len(values)) // 5 + 1))
+                if not lines:
+                    raise ValueError('{} is truncated.'.format(filename))
+                values = np.concatenate(
+                    [values, np.fromstring(''.join(lines), sep=' ')])
+
+            slab = values[:slab_size].reshape(n_y, n_x)
+            values = values[slab_size:]
+            if axis == 0:
+                profile += slab.sum(axis=0)
+            elif axis == 1:
+                profile += slab.sum(axis=1)
+            else:
+                profile[z] = slab.sum()
+
+    return profile / (n_x * n_y * n_z / len(profile))
+
+
+def get_local_potential(directory='.', axis=2):
+    """
+    Returns the planar average of directory/LOCPOT along axis (see
+    read_planar_average), which is only read again if the LOCPOT has
+    changed since the last time.
+    """
+
+    return np.array(get_cached_result(
+        directory, 'LOCPOT', 'locpot_average_{}'.format(axis),
+        lambda filename: list(read_planar_average(filename, axis))))
+
+
+def _parse_band_edges(filename):
+    band_structure = BSVasprun(filename).get_band_structure()
+    band_gap = band_structure.get_band_gap()
+
+    if band_gap['transition'] is None:
+        return {'CBM': None, 'VBM': None, 'Direct': False, 'Metal': True,
+                'band_gap': 0.0}
 
-from twod_materials.utils import is_converged
+    transition = band_gap['transition'].split('-')
+    return {'CBM': float(band_structure.get_cbm()['energy']),
+            'VBM': float(band_structure.get_vbm()['energy']),
+            'Direct': transition[0] == transition[1], 'Metal': False,
+            'band_gap': float(band_gap['energy'])}
 
 
-def plot_band_alignments(directories, run_type='PBE', fmt='pdf'):
+def get_band_edges(directory='.'):
+    """
+    Returns the band edges of the band structure calculation in
+    directory, all from one band structure:
+
+    {'CBM': energy (eV) or None for metals, 'VBM': energy or None,
+     'Direct': bool, 'Metal': bool, 'band_gap': energy,
+     'E_vac': vacuum level (eV) from the LOCPOT}
+
+    Both the band edges and the vacuum level are cached in
+    directory/.twod_cache.json, so they're only parsed again if
+    vasprun.xml or LOCPOT change.
+    """
+
+    band_edges = dict(get_cached_result(directory, 'vasprun.xml',
+                                        'band_edges', _parse_band_edges))
+    band_edges['E_vac'] = get_local_potential(directory)[-5]
+    return band_edges
+
+
+def _get_converged_band_edges(directory):
+    if is_converged(directory):
+        return get_band_edges(directory)
+
+
+def get_all_band_edges(directories, n_workers=8):
+    """
+    Returns {directory: get_band_edges(directory)} for each of
+    directories whose calculation has converged, parsing them in a pool
+    of n_workers processes.
+    """
+
+    directories = list(directories)
+    n_workers = max(1, min(n_workers, len(directories)))
+    pool = Pool(n_workers)
+    try:
+        results = pool.map(_get_converged_band_edges, directories)
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict([(directory, band_edges) for directory, band_edges
+                 in zip(directories, results) if band_edges is not None])
+
+
+def plot_band_alignments(directories, run_type='PBE', fmt='pdf',
+                         n_workers=8):
     """
     Plot CBM's and VBM's of all compounds together, relative to the band
     edges of H2O.
@@ -22,6 +156,8 @@ def plot_band_alignments(directories, run_type='PBE', fmt='pdf'):
     args:
         run_type: 'PBE' or 'HSE', so that the function knows which
             subdirectory to go into.
+        n_workers: number of processes the band edges are parsed with
+            (see get_all_band_edges).
     """
 
     if run_type == 'HSE':
@@ -29,41 +165,12 @@ def plot_band_alignments(directories, run_type='PBE', fmt='pdf'):
     else:
         subdirectory = 'pbe_bands'
 
-    band_gaps = {}
-
-    for directory in directories:
-        if is_converged('{}/{}'.format(directory, subdirectory)):
-            os.chdir('{}/{}'.format(directory, subdirectory))
-            vasprun = BSVasprun('vasprun.xml')
-            band_gap = vasprun.get_band_structure().get_band_gap()
-
-            # Vacuum level energy from LOCPOT.
-            locpot = Locpot.from_file('LOCPOT')
-            evac = locpot.get_average_along_axis(2)[-5]
-
-            try:
-                transition = band_gap['transition'].split('-')
-
-                if transition[0] == transition[1]:
-                    is_direct = True
-                else:
-                    is_direct = False
-
-                is_metal = False
-                cbm = vasprun.get_band_structure().get_cbm()
-                vbm = vasprun.get_band_structure().get_vbm()
-
-            except AttributeError:
-                cbm = None
-                vbm = None
-                is_metal = True
-                is_direct = False
-
-            band_gaps[directory] = {'CBM': cbm, 'VBM': vbm,
-                                    'Direct': is_direct, 'Metal': is_metal,
-                                    'E_vac': evac}
-
-            os.chdir('../../')
+    bands_dirs = dict([(directory, os.path.join(directory, subdirectory))
+                       for directory in directories])
+    all_band_edges = get_all_band_edges(bands_dirs.values(), n_workers)
+    band_gaps = dict([(directory, all_band_edges[bands_dir])
+                      for directory, bands_dir in bands_dirs.items()
+                      if bands_dir in all_band_edges])
 
     ax = plt.figure(figsize=(16, 10)).gca()
 
@@ -96,8 +203,8 @@ def plot_band_alignments(directories, run_type='PBE', fmt='pdf'):
             cbm = -8
             vbm = -2
         else:
-            cbm = band_gaps[compound]['CBM']['energy'] - evac
-            vbm = band_gaps[compound]['VBM']['energy'] - evac
+            cbm = band_gaps[compound]['CBM'] - evac
+            vbm = band_gaps[compound]['VBM'] - evac
 
         # Add a box around direct gap compounds to distinguish them.
         if band_gaps[compound]['Direct']:
@@ -175,22 +282,20 @@ def plot_band_alignments(directories, run_type='PBE', fmt='pdf'):
     plt.savefig('band_alignments.{}'.format(fmt), transparent=True)
 
 
-def plot_local_potential(axis=2, fmt='pdf'):
+def plot_local_potential(axis=2, fmt='pdf', directory='.'):
     """
-    Plot data from the LOCPOT file along any of the 3 primary axes.
-    Useful for determining surface dipole moments and electric
-    potentials on the interior of the material.
+    Plot data from the LOCPOT file in directory along any of the 3
+    primary axes. Useful for determining surface dipole moments and
+    electric potentials on the interior of the material.
     """
 
     ax = plt.figure(figsize=(16, 10)).gca()
 
-    locpot = Locpot.from_file('LOCPOT')
-    structure = Structure.from_file('CONTCAR')
-    vd = VolumetricData(structure, locpot.data)
-    abs_potentials = vd.get_average_along_axis(axis)
+    structure = Structure.from_file(os.path.join(directory, 'CONTCAR'))
+    abs_potentials = get_local_potential(directory, axis)
     vacuum_level = max(abs_potentials)
 
-    vasprun = BSVasprun('vasprun.xml')
+    vasprun = BSVasprun(os.path.join(directory, 'vasprun.xml'))
     cbm = vasprun.get_band_structure().get_cbm()['energy'] - vacuum_level
     vbm = vasprun.get_band_structure().get_vbm()['energy'] - vacuum_level
 
@@ -215,49 +320,293 @@ def plot_local_potential(axis=2, fmt='pdf'):
     ax.fill_between(ax.get_xlim(), -20, vbm, facecolor=plt.cm.jet(0.7),
                     zorder=0, linewidth=0)
 
-    plt.savefig('locpot.{}'.format(fmt))
+    plt.savefig(os.path.join(directory, 'locpot.{}'.format(fmt)))
 
 
-def plot_band_structure(fmt='pdf'):
+def plot_band_structure(fmt='pdf', directory='.'):
     """
     Plot a standard band structure with no projections.
     """
 
-    vasprun = BSVasprun('vasprun.xml')
+    vasprun = BSVasprun(os.path.join(directory, 'vasprun.xml'))
 
-    if 'pbe_bands' in os.getcwd():
-        efermi = BSVasprun('../vasprun.xml').efermi
+    if 'pbe_bands' in os.path.abspath(directory):
+        efermi = BSVasprun(
+            os.path.join(directory, os.pardir, 'vasprun.xml')).efermi
     else:
         efermi = vasprun.efermi
-    bsp = BSPlotter(vasprun.get_band_structure('KPOINTS', line_mode=True,
-                                               efermi=efermi))
-    bsp.save_plot('band_structure.{}'.format(fmt), ylim=(-5, 5))
+    bsp = BSPlotter(vasprun.get_band_structure(
+        os.path.join(directory, 'KPOINTS'), line_mode=True, efermi=efermi))
+    bsp.save_plot(os.path.join(directory, 'band_structure.{}'.format(fmt)),
+                  ylim=(-5, 5))
+
+
+# Written next to vasprun.xml by write_projected_bands, and read by the
+# projected band structure plots instead of vasprun.xml.
+PROJECTED_BANDS_FILENAME = 'projected_bands.npz'
+
+# By default, the projections are summed over the orbitals of each of
+# these types.
+ORBITAL_TYPES = ['s', 'p', 'd', 'f']
+
+
+class ProjectedBandStructure(BandStructureSymmLine):
+
+    def __init__(self, kpoints, eigenvals, lattice, efermi, labels_dict,
+                 structure, elements, projections,
+                 orbital_types=ORBITAL_TYPES):
+        '''
+        A BandStructureSymmLine whose projections have already been
+        summed over the sites of each element and the orbitals of each
+        type, which is all that BSPlotterProjected needs:
+
+        projections: {spin: (n_bands, n_kpoints, len(elements),
+                             len(orbital_types)) array}
+
+        Use read_projected_bands or get_projected_bands to get one.
+        '''
+
+        super(ProjectedBandStructure, self).__init__(
+            kpoints, eigenvals, lattice, efermi, labels_dict,
+            structure=structure, projections=projections)
+        self._elements = list(elements)
+        self._orbital_types = list(orbital_types)
+
+    def get_projection_on_elements(self):
+        '''
+        Same as BandStructure.get_projection_on_elements.
+        '''
+
+        result = {}
+        for spin, projections in self._projections.items():
+            totals = projections.sum(axis=3)
+            result[spin] = [[collections.defaultdict(
+                float, zip(self._elements, totals[i, j]))
+                for j in range(totals.shape[1])]
+                for i in range(totals.shape[0])]
+        return result
+
+    def get_projections_on_elts_and_orbitals(self, dictio):
+        '''
+        Same as BandStructure.get_projections_on_elts_and_orbitals.
+        '''
+
+        indices = dict([(str(element), (
+            self._elements.index(str(element)),
+            [(orbital, self._orbital_types.index(orbital))
+             for orbital in orbitals if orbital in self._orbital_types]))
+            for element, orbitals in dictio.items()
+            if str(element) in self._elements])
+
+        result = {}
+        for spin, projections in self._projections.items():
+            result[spin] = [[dict(
+                [(str(element), collections.defaultdict(float))
+                 for element in dictio])
+                for j in range(projections.shape[1])]
+                for i in range(projections.shape[0])]
+            for element, (e, orbitals) in indices.items():
+                for orbital, o in orbitals:
+                    values = projections[:, :, e, o]
+                    for i, j in zip(*np.where(values)):
+                        result[spin][i][j][element][orbital] = values[i, j]
+        return result
+
+
+def _get_orbital_type(field):
+    """
+    Returns the type ('s', 'p', ...) of an orbital named as in the
+    fields of vasprun.xml's projected array, where d_x2-y2 is 'x2-y2'.
+    """
+
+    return 'd' if field.startswith('x2') else field[0]
+
+
+def read_projected_bands(filename='vasprun.xml', kpoints_filename='KPOINTS',
+                         elements=None, orbital_types=ORBITAL_TYPES,
+                         dtype=np.float32):
+    """
+    Returns the band structure along the lines in kpoints_filename from
+    a vasprun.xml as a ProjectedBandStructure, with its projections
+    summed over the sites of each of elements (all of them by default)
+    and the orbitals of each of orbital_types.
+
+    The file is read in one streaming pass, and the projections on each
+    band are reduced as soon as they're read and then dropped, so only
+    the reduced (n_bands, n_kpoints, len(elements), len(orbital_types))
+    arrays are ever held in memory, rather than every projection on
+    every site and orbital like BSVasprun(parse_projected_eigen=True).
+    Band structures from hybrid runs (LHFCALC) keep only their
+    zero-weight k-points, as in BSVasprun.get_band_structure.
+    """
+
+    path = []
+    hybrid = False
+    efermi = None
+    fields = []
+    projections = collections.defaultdict(list)
+    for event, elem in ET.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            if path[-3:] == ['projected', 'array', 'set']:
+                spin = Spin.up if len(projections) == 0 else Spin.down
+            path.append(elem.tag)
+            continue
+
+        path.pop()
+        tag = elem.tag
+        if tag == 'atominfo':
+            symbols = [rc.find('c').text.strip() for rc in
+                       elem.find("array[@name='atoms']").find('set')]
+            if elements is None:
+                elements = sorted(set(symbols), key=symbols.index)
+            site_elements = np.array([[symbol == element for element
+                                       in elements] for symbol in symbols],
+                                     dtype=float)
+        elif tag == 'varray' and path[-1:] == ['kpoints']:
+            values = np.array([v.text.split() for v in elem], dtype=float)
+            if elem.attrib['name'] == 'kpointlist':
+                kpoints = values
+            elif elem.attrib['name'] == 'weights':
+                weights = values[:, 0]
+        elif tag == 'i' and elem.attrib.get('name') == 'LHFCALC':
+            hybrid = elem.text.strip() == 'T'
+        elif tag == 'i' and elem.attrib.get('name') == 'efermi':
+            efermi = float(elem.text)
+        elif tag == 'eigenvalues' and path[-1:] == ['calculation']:
+            eigenvalues = [np.array([[r.text.split()[0] for r in kpoint]
+                                     for kpoint in spin_set], dtype=float).T
+                           for spin_set in elem.find('array').find('set')]
+        elif tag == 'field' and path[-2:] == ['projected', 'array']:
+            fields.append(_get_orbital_type(elem.text.strip()))
+            field_types = np.array([[field == orbital_type for orbital_type
+                                     in orbital_types] for field in fields],
+                                   dtype=float)
+        elif tag == 'set' and path[-5:] == ['projected', 'array', 'set',
+                                            'set', 'set']:
+            # One band at one k-point: a row of orbitals for each site.
+            rows = np.fromstring(' '.join(r.text for r in elem),
+                                 sep=' ').reshape(len(site_elements), -1)
+            projections[spin].append(
+                site_elements.T.dot(rows).dot(field_types).astype(dtype))
+            elem.clear()
+        elif tag == 'structure' and elem.attrib.get('name') == 'finalpos':
+            structure = Structure(
+                np.array([v.text.split() for v in elem.find('crystal').find(
+                    "varray[@name='basis']")], dtype=float),
+                symbols, np.array([v.text.split() for v in elem.find(
+                    "varray[@name='positions']")], dtype=float))
+
+        if path == ['modeling']:
+            elem.clear()
+
+    start = np.where(weights == 0)[0][0] if hybrid else 0
+    spins = [Spin.up, Spin.down][:len(eigenvalues)]
+    n_bands = min(values.shape[0] for values in eigenvalues)
+    projections = dict(
+        (spin, np.array(projections[spin]).reshape(
+            len(kpoints), -1, len(elements),
+            len(orbital_types))[start:, :n_bands].swapaxes(0, 1))
+        for spin in projections)
+
+    kpoints_file = Kpoints.from_file(kpoints_filename)
+    labels_dict = dict([(label, kpoint) for label, kpoint
+                        in zip(kpoints_file.labels, kpoints_file.kpts)
+                        if label])
+
+    return ProjectedBandStructure(
+        kpoints[start:], dict((spin, values[:n_bands, start:]) for spin,
+                              values in zip(spins, eigenvalues)),
+        structure.lattice.reciprocal_lattice, efermi, labels_dict, structure,
+        elements, projections, orbital_types)
+
+
+def write_projected_bands(directory='.', dtype=np.float32):
+    """
+    Read directory/vasprun.xml (and KPOINTS) with read_projected_bands,
+    the one slow parse that the projected band structure plots need,
+    and save the band structure and its reduced projections to
+    directory/projected_bands.npz. dtype=float64 keeps the projections
+    at full precision. Returns the ProjectedBandStructure.
+    """
 
+    vasprun_file = os.path.join(directory, 'vasprun.xml')
+    band_structure = read_projected_bands(
+        vasprun_file, os.path.join(directory, 'KPOINTS'), dtype=dtype)
+
+    spins = sorted(band_structure.bands, key=int, reverse=True)
+    labels = sorted(band_structure._labels_dict.items())
+    np.savez_compressed(
+        os.path.join(directory, PROJECTED_BANDS_FILENAME),
+        fingerprint=json.dumps(get_fingerprint(vasprun_file)),
+        dtype=np.dtype(dtype).str,
+        kpoints=[kpoint.frac_coords for kpoint in band_structure.kpoints],
+        reciprocal_matrix=band_structure.lattice.matrix,
+        efermi=band_structure.efermi,
+        labels=[label for label, kpoint in labels],
+        label_kpoints=np.array([kpoint.frac_coords for label, kpoint
+                                in labels]).reshape(-1, 3),
+        structure=json.dumps(band_structure.structure.as_dict()),
+        elements=band_structure._elements,
+        orbital_types=band_structure._orbital_types,
+        spins=[int(spin) for spin in spins],
+        eigenvalues=[band_structure.bands[spin] for spin in spins],
+        projections=[band_structure.projections[spin] for spin in spins])
+
+    return band_structure
+
+
+def get_projected_bands(directory='.', dtype=np.float32):
+    """
+    Returns the ProjectedBandStructure saved in
+    directory/projected_bands.npz, writing it first (see
+    write_projected_bands) if it's missing, vasprun.xml has changed
+    since or its projections weren't saved as dtype.
+    """
 
-def plot_color_projected_bands(fmt='pdf'):
+    filename = os.path.join(directory, PROJECTED_BANDS_FILENAME)
+    fingerprint = get_fingerprint(os.path.join(directory, 'vasprun.xml'))
+    if os.path.exists(filename):
+        with np.load(filename) as data:
+            if json.loads(str(data['fingerprint'])) == fingerprint and \
+                    'dtype' in data.files and \
+                    str(data['dtype']) == np.dtype(dtype).str:
+                spins = [Spin(int(spin)) for spin in data['spins']]
+                return ProjectedBandStructure(
+                    data['kpoints'], dict(zip(spins, data['eigenvalues'])),
+                    Lattice(data['reciprocal_matrix']),
+                    float(data['efermi']),
+                    dict(zip([str(label) for label in data['labels']],
+                             data['label_kpoints'])),
+                    Structure.from_dict(json.loads(str(data['structure']))),
+                    [str(element) for element in data['elements']],
+                    dict(zip(spins, data['projections'])),
+                    [str(orbital_type) for orbital_type
+                     in data['orbital_types']])
+
+    return write_projected_bands(directory, dtype)
+
+
+def plot_color_projected_bands(fmt='pdf', directory='.'):
     """
     Plot a single band structure where the color of the band indicates
     the elemental character of the eigenvalue.
     """
-    vasprun = BSVasprun('vasprun.xml', parse_projected_eigen=True)
-    bs = vasprun.get_band_structure('KPOINTS', line_mode=True)
-    bspp = BSPlotterProjected(bs)
+    bspp = BSPlotterProjected(get_projected_bands(directory))
     bspp.get_elt_projected_plots_color().savefig(
-        'color_projected_bands.{}'.format(fmt))
+        os.path.join(directory, 'color_projected_bands.{}'.format(fmt)))
 
 
-def plot_elt_projected_bands(fmt='pdf'):
+def plot_elt_projected_bands(fmt='pdf', directory='.'):
     """
     Plot separate band structures for each element where the size of the
     markers indicates the elemental character of the eigenvalue.
     """
-    vasprun = BSVasprun('vasprun.xml', parse_projected_eigen=True)
-    bs = vasprun.get_band_structure('KPOINTS', line_mode=True)
-    bspp = BSPlotterProjected(bs)
-    bspp.get_elt_projected_plots().savefig('elt_projected_bands.{}'.format(fmt))
+    bspp = BSPlotterProjected(get_projected_bands(directory))
+    bspp.get_elt_projected_plots().savefig(
+        os.path.join(directory, 'elt_projected_bands.{}'.format(fmt)))
 
 
-def plot_orb_projected_bands(orbitals, fmt='pdf'):
+def plot_orb_projected_bands(orbitals, fmt='pdf', directory='.'):
     """
     Plot a separate band structure for each orbital of each element in
     orbitals.
@@ -265,14 +614,205 @@ def plot_orb_projected_bands(orbitals, fmt='pdf'):
     orbitals (dict): {element: [orbitals]}
         e.g. {'Mo': ['s', 'p', 'd'], 'S': ['p']}
     """
-    vasprun = BSVasprun('vasprun.xml', parse_projected_eigen=True)
-    bs = vasprun.get_band_structure('KPOINTS', line_mode=True)
-    bspp = BSPlotterProjected(bs)
+    bspp = BSPlotterProjected(get_projected_bands(directory))
     bspp.get_projected_plots_dots(orbitals).savefig(
-        'orb_projected_bands.{}'.format(fmt))
+        os.path.join(directory, 'orb_projected_bands.{}'.format(fmt)))
 
 
-def get_effective_mass():
+# hbar^2 / m_0 in eV * Angstrom^2, so that an effective mass (in units of
+# m_0) is this divided by d^2E/dk^2 with k in 1/Angstrom.
+HBAR_SQUARED_OVER_M0 = 7.619964
+
+
+def get_line_masses(kpoints, energies, index, n_kpts=6):
+    """
+    Returns (left, right): the effective masses (in units of m_0) of
+    each band in energies, from parabolas fit to the extremum at
+    k-point index and up to n_kpts k-points on either side of it along
+    a line-mode path. The masses are hbar^2 / (d^2E/dk^2), so they're
+    negative for bands that curve down.
+
+    Each side stops at the ends of the path and where the path jumps
+    from one branch to the next. If the extremum is at the end of a
+    branch, the branch on the other side of it is used instead, and a
+    side with fewer than two k-points beyond the extremum gets NaN.
+
+    args:
+        kpoints: (n_kpoints, 3) array of cartesian k-points
+                 (1/Angstrom).
+        energies: (n_bands, n_kpoints) array of band energies (eV).
+    """
+
+    kpoints = np.asarray(kpoints, dtype=float)
+    energies = np.atleast_2d(energies)
+    steps = np.linalg.norm(np.diff(kpoints, axis=0), axis=1)
+    typical_step = np.median(steps[steps > 1e-8])
+    # A branch ends where the same k-point is repeated or where the
+    # path jumps somewhere else entirely.
+    repeats = steps < 1e-6 * typical_step
+    breaks = repeats | (steps > 5 * typical_step)
+
+    masses = []
+    for direction in [-1, 1]:
+        start = index
+        while 0 <= start + direction < len(kpoints) and \
+                repeats[min(start, start + direction)]:
+            start += direction
+
+        indices = [start]
+        while len(indices) <= n_kpts:
+            next_index = indices[-1] + direction
+            if not 0 <= next_index < len(kpoints) or \
+                    breaks[min(indices[-1], next_index)]:
+                break
+            indices.append(next_index)
+
+        if len(indices) < 3:
+            masses.append(np.nan * np.ones(len(energies)))
+            continue
+        distances = np.linalg.norm(kpoints[indices] - kpoints[index], axis=1)
+        curvatures = 2 * np.polyfit(distances, energies[:, indices].T, 2)[0]
+        masses.append(HBAR_SQUARED_OVER_M0 / curvatures)
+
+    return tuple(masses)
+
+
+def get_mass_tensors(frac_kpoints, reciprocal_matrix, energies, index,
+                     n_kpts=13):
+    """
+    Returns an (n_bands, 2, 2) array of the in-plane effective mass
+    tensors (in units of m_0) of each band in energies at k-point
+    index, from a least-squares fit of a 2D quadratic to the n_kpts
+    k-points closest to it (across the Brillouin zone's edges, too).
+    The k-points have to be a uniform mesh over the whole zone
+    (ISYM = 0), and the material's layers in the xy plane.
+
+    args:
+        frac_kpoints: (n_kpoints, 3) array of fractional k-points.
+        reciprocal_matrix: 3x3 array of the reciprocal lattice vectors
+                           (rows, 1/Angstrom).
+        energies: (n_bands, n_kpoints) array of band energies (eV).
+    """
+
+    frac_offsets = np.asarray(frac_kpoints) - frac_kpoints[index]
+    frac_offsets -= np.round(frac_offsets)
+    offsets = np.dot(frac_offsets, reciprocal_matrix)[:, :2]
+    nearest = np.argsort(np.hypot(*offsets.T))[:n_kpts]
+
+    x, y = offsets[nearest].T
+    coefficients = np.linalg.lstsq(
+        np.column_stack([np.ones(len(x)), x, y, x * x, x * y, y * y]),
+        np.atleast_2d(energies)[:, nearest].T, rcond=None)[0]
+
+    # E = ... + a_xx x^2 + a_xy x y + a_yy y^2 = ... + k.W.k / 2
+    inverse_masses = np.empty((coefficients.shape[1], 2, 2))
+    inverse_masses[:, 0, 0] = 2 * coefficients[3]
+    inverse_masses[:, 0, 1] = inverse_masses[:, 1, 0] = coefficients[4]
+    inverse_masses[:, 1, 1] = 2 * coefficients[5]
+    return HBAR_SQUARED_OVER_M0 * np.linalg.inv(inverse_masses)
+
+
+def _get_band_edge_indices(energies, efermi, window):
+    """
+    Returns {'electron': (band indices, k-point index), 'hole': ...}
+    for the bands within window (eV) of the CBM and VBM in energies,
+    at the k-point where the CBM or VBM is.
+    """
+
+    empty = energies > efermi
+    edges = {}
+    for carrier, band_energies, find in [
+            ('electron', np.where(empty, energies, np.inf), np.argmin),
+            ('hole', np.where(empty, -np.inf, energies), np.argmax)]:
+        band, kpoint = np.unravel_index(find(band_energies), energies.shape)
+        edge = band_energies[band, kpoint]
+        bands = np.where(np.abs(band_energies[:, kpoint] - edge)
+                         <= window)[0]
+        edges[carrier] = (bands, kpoint)
+    return edges
+
+
+def get_effective_masses(band_structure, mesh=False, window=0.1,
+                         n_kpts=None):
+    """
+    Returns the effective masses (in units of m_0) of every band within
+    window (eV) of the CBM (electrons) and VBM (holes) of a pymatgen
+    band structure, for each spin:
+
+    {'electron': {'up': {'bands': band indices, 'kpoint': k-point index,
+                         'left': masses, 'right': masses}, 'down': ...},
+     'hole': ...}
+
+    Hole masses are positive for bands that curve down. With
+    mesh=False the band structure should be along a line-mode path
+    and each band gets masses to the 'left' and 'right' of the
+    extremum (see get_line_masses). With mesh=True it should be a
+    uniform 2D mesh, and each band gets its in-plane mass 'tensor'
+    and that tensor's eigenvalues, the 'principal' masses (see
+    get_mass_tensors). n_kpts defaults to 6 and 13 respectively.
+    """
+
+    kpoints = band_structure.kpoints
+    masses = {'electron': {}, 'hole': {}}
+    for spin, energies in band_structure.bands.items():
+        energies = np.array(energies)
+        edges = _get_band_edge_indices(energies, band_structure.efermi,
+                                       window)
+        for carrier, (bands, kpoint) in edges.items():
+            sign = 1 if carrier == 'electron' else -1
+            result = {'bands': bands, 'kpoint': kpoint}
+            if mesh:
+                tensors = sign * get_mass_tensors(
+                    [k.frac_coords for k in kpoints],
+                    kpoints[0].lattice.matrix, energies[bands], kpoint,
+                    n_kpts or 13)
+                result['tensor'] = tensors
+                result['principal'] = np.linalg.eigvalsh(tensors)
+            else:
+                left, right = get_line_masses(
+                    [k.cart_coords for k in kpoints], energies[bands],
+                    kpoint, n_kpts or 6)
+                result['left'] = sign * left
+                result['right'] = sign * right
+            masses[carrier]['up' if spin == Spin.up else 'down'] = result
+
+    return masses
+
+
+def _get_effective_masses_or_error(args):
+    directory, mesh, window = args
+    try:
+        band_structure = BSVasprun(
+            os.path.join(directory, 'vasprun.xml')).get_band_structure()
+        return get_effective_masses(band_structure, mesh, window)
+    except Exception as error:
+        return {'error': '{}: {}'.format(type(error).__name__, error)}
+
+
+def get_all_effective_masses(directories, mesh=False, window=0.1,
+                             n_workers=8):
+    """
+    Returns {directory: get_effective_masses(...)} for the band
+    structure in each of directories, parsed in a pool of n_workers
+    processes. A directory that can't be analyzed gets
+    {'error': reason} instead of stopping the others.
+    """
+
+    directories = list(directories)
+    n_workers = max(1, min(n_workers, len(directories)))
+    pool = Pool(n_workers)
+    try:
+        results = pool.map(_get_effective_masses_or_error,
+                           [(directory, mesh, window)
+                            for directory in directories])
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict(zip(directories, results))
+
+
+def get_effective_mass(directory='.'):
     """
     Returns effective masses from a band structure, using parabolic
     fitting to determine the band curvature at the CBM
@@ -282,111 +822,25 @@ def get_effective_mass():
     To consider anisotropy, the k-space directions to the left and right
     of the CBM/VBM in the band diagram are returned separately.
 
-    *NOTE* Only works for semiconductors and linemode calculations (non-
-           spin polarized).
+    *NOTE* Only works for semiconductors and linemode calculations.
            >30 k-points per string recommended to obtain
-           reliable curvatures.
+           reliable curvatures. Only the spin up band edges are
+           returned; see get_effective_masses for both spins, the
+           other bands near the edges and full 2D mass tensors.
 
     *NOTE* The parabolic fit can be quite sensitive to the number of
-           k-points fit to, so it might be worthwhile adjusting N_KPTS
-           to obtain some sense of the error bar.
-
-    TODO: Warn user if CBM/VBM is at the edge of the diagram, and which
-          direction (either left or right) was not actually fit to.
-          Until fixed, this (most likely) explains any negative masses
-          returned.
-    """
-
-    H_BAR = 6.582119514e-16  # eV*s
-    M_0 = 9.10938356e-31  # kg
-    N_KPTS = 6  # Number of k-points included in the parabola.
-
-    spin_up = Spin(1)
-
-    band_structure = BSVasprun('vasprun.xml').get_band_structure()
-
-    # Locations of CBM and VBM in band_structure.bands
-    cbm_band_index = band_structure.get_cbm()['band_index'][spin_up][0]
-    cbm_kpoint_index = band_structure.get_cbm()['kpoint_index'][0]
-
-    vbm_band_index = band_structure.get_vbm()['band_index'][spin_up][0]
-    vbm_kpoint_index = band_structure.get_vbm()['kpoint_index'][0]
-
-    k = {'electron': {'left': [], 'right': []},
-         'hole': {'left': [], 'right': []}}
-    E = {'electron': {'left': [], 'right': []},
-         'hole': {'left': [], 'right': []}}
-
-    e_ref_coords = band_structure.kpoints[cbm_kpoint_index]._ccoords
-    h_ref_coords = band_structure.kpoints[vbm_kpoint_index]._ccoords
-
-    for n in range(-N_KPTS, 1):
-        e_coords = band_structure.kpoints[cbm_kpoint_index + n]._ccoords
-        h_coords = band_structure.kpoints[vbm_kpoint_index + n]._ccoords
-
-        k['electron']['left'].append(
-            ((e_coords[0] - e_ref_coords[0])**2 +
-             (e_coords[1] - e_ref_coords[1])**2 +
-             (e_coords[2] - e_ref_coords[2])**2)**0.5
-            )
-        k['hole']['left'].append(
-            ((h_coords[0] - h_ref_coords[0])**2 +
-             (h_coords[1] - h_ref_coords[1])**2 +
-             (h_coords[2] - h_ref_coords[2])**2)**0.5
-            )
-
-        e_energy = band_structure.bands[
-            spin_up][cbm_band_index][cbm_kpoint_index + n]
-        h_energy = band_structure.bands[
-            spin_up][vbm_band_index][vbm_kpoint_index + n]
-
-        E['electron']['left'].append(e_energy)
-        E['hole']['left'].append(h_energy)
-
-    for n in range(1, 1 + N_KPTS):
-        e_coords = band_structure.kpoints[cbm_kpoint_index + n]._ccoords
-        h_coords = band_structure.kpoints[vbm_kpoint_index + n]._ccoords
-
-        k['electron']['right'].append(
-            ((e_coords[0] - e_ref_coords[0])**2 +
-             (e_coords[1] - e_ref_coords[1])**2 +
-             (e_coords[2] - e_ref_coords[2])**2)**0.5
-            )
-        k['hole']['right'].append(
-            ((h_coords[0] - h_ref_coords[0])**2 +
-             (h_coords[1] - h_ref_coords[1])**2 +
-             (h_coords[2] - h_ref_coords[2])**2)**0.5
-            )
-
-        e_energy = band_structure.bands[
-            spin_up][cbm_band_index][cbm_kpoint_index + n]
-        h_energy = band_structure.bands[
-            spin_up][vbm_band_index][vbm_kpoint_index + n]
-
-        E['electron']['right'].append(e_energy)
-        E['hole']['right'].append(h_energy)
-
-    # 2nd order fits
-    e_l_fit = np.poly1d(
-        np.polyfit(k['electron']['left'], E['electron']['left'], 2))
-    e_r_fit = np.poly1d(
-        np.polyfit(k['electron']['right'], E['electron']['right'], 2))
-    h_l_fit = np.poly1d(
-        np.polyfit(k['hole']['left'], E['hole']['left'], 2))
-    h_r_fit = np.poly1d(
-        np.polyfit(k['hole']['right'], E['hole']['right'], 2))
-
-    # Curvatures
-    e_l_curvature = e_l_fit.deriv().deriv()[0]
-    e_r_curvature = e_r_fit.deriv().deriv()[0]
-    h_l_curvature = h_l_fit.deriv().deriv()[0]
-    h_r_curvature = h_r_fit.deriv().deriv()[0]
-
-    # Unit conversion
-    e_m_eff_l = 10 * ((H_BAR ** 2) / e_l_curvature) / M_0
-    e_m_eff_r = 10 * ((H_BAR ** 2) / e_r_curvature) / M_0
-    h_m_eff_l = -10 * ((H_BAR ** 2) / h_l_curvature) / M_0
-    h_m_eff_r = -10 * ((H_BAR ** 2) / h_r_curvature) / M_0
-
-    return {'electron': {'left': e_m_eff_l, 'right': e_m_eff_r},
-            'hole': {'left': h_m_eff_l, 'right': h_m_eff_r}}
+           k-points fit to, so it might be worthwhile adjusting n_kpts
+           in get_effective_masses to obtain some sense of the error
+           bar.
+
+    A direction that couldn't be fit to because the CBM/VBM is at the
+    edge of the diagram comes back as NaN.
+    """
+
+    band_structure = BSVasprun(
+        os.path.join(directory, 'vasprun.xml')).get_band_structure()
+    masses = get_effective_masses(band_structure, window=0)
+
+    return dict([(carrier, {'left': masses[carrier]['up']['left'][0],
+                            'right': masses[carrier]['up']['right'][0]})
+                 for carrier in ['electron', 'hole']])
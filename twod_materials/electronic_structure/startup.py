@@ -1,24 +1,21 @@
 import os
 
+import shutil
+
 from twod_materials.utils import (
     is_converged, write_pbs_runjob,
-    write_slurm_runjob)
+    write_slurm_runjob, submit_runjob, get_config_value)
 
 from pymatgen.io.vasp.inputs import Kpoints, Incar
 from pymatgen.symmetry.bandstructure import HighSymmKpath
 from pymatgen.core.structure import Structure
 
-from monty.serialization import loadfn
-
 
 if '/ufrc/' in os.getcwd():
     HIPERGATOR = 2
 elif '/scratch/' in os.getcwd():
     HIPERGATOR = 1
 
-VASP = loadfn(os.path.join(os.path.expanduser('~'),
-                           'config.yaml'))['normal_binary']
-
 
 def remove_z_kpoints(filename='KPOINTS'):
     """
@@ -42,10 +39,11 @@ def remove_z_kpoints(filename='KPOINTS'):
             i += 3
 
 
-def run_linemode_calculation(submit=True, force_overwrite=False):
+def run_linemode_calculation(submit=True, force_overwrite=False,
+                             directory='.'):
     """
     Setup and submit a normal PBE calculation for band structure along
-    high symmetry k-paths.
+    high symmetry k-paths, in directory/pbe_bands.
     """
 
     PBE_INCAR_DICT = {'EDIFF': 1e-6, 'IBRION': 2, 'ISIF': 3, 'ISMEAR': 1,
@@ -53,37 +51,42 @@ def run_linemode_calculation(submit=True, force_overwrite=False):
                       'LREAL': 'Auto', 'NPAR': 4, 'PREC': 'Accurate',
                       'LWAVE': True, 'SIGMA': 0.1, 'ENCUT': 500}
 
-    directory = os.getcwd().split('/')[-1]
-
-    if not os.path.isdir('pbe_bands'):
-        os.mkdir('pbe_bands')
-    if force_overwrite or not is_converged('pbe_bands'):
-        os.chdir('pbe_bands')
-        os.system('cp ../CONTCAR ./POSCAR')
-        os.system('cp ../POTCAR ./')
-        Incar.from_dict(PBE_INCAR_DICT).write_file('INCAR')
-        structure = Structure.from_file('POSCAR')
+    name = os.path.basename(os.path.abspath(directory))
+    bands_dir = os.path.join(directory, 'pbe_bands')
+
+    if not os.path.isdir(bands_dir):
+        os.mkdir(bands_dir)
+    if force_overwrite or not is_converged(bands_dir):
+        shutil.copy(os.path.join(directory, 'CONTCAR'),
+                    os.path.join(bands_dir, 'POSCAR'))
+        shutil.copy(os.path.join(directory, 'POTCAR'), bands_dir)
+        Incar.from_dict(PBE_INCAR_DICT).write_file(
+            os.path.join(bands_dir, 'INCAR'))
+        structure = Structure.from_file(os.path.join(bands_dir, 'POSCAR'))
         kpath = HighSymmKpath(structure)
-        Kpoints.automatic_linemode(20, kpath).write_file('KPOINTS')
-        remove_z_kpoints()
+        Kpoints.automatic_linemode(20, kpath).write_file(
+            os.path.join(bands_dir, 'KPOINTS'))
+        remove_z_kpoints(os.path.join(bands_dir, 'KPOINTS'))
+        vasp = get_config_value('normal_binary')
         if HIPERGATOR == 1:
-            write_pbs_runjob(directory, 1, 16, '800mb', '6:00:00', VASP)
+            write_pbs_runjob(name, 1, 16, '800mb', '6:00:00', vasp,
+                             bands_dir)
             submission_command = 'qsub runjob'
 
         elif HIPERGATOR == 2:
-            write_slurm_runjob(directory, 16, '800mb', '6:00:00', VASP)
+            write_slurm_runjob(name, 16, '800mb', '6:00:00', vasp, bands_dir)
             submission_command = 'sbatch runjob'
 
         if submit:
-            os.system(submission_command)
-
-        os.chdir('../')
+            submit_runjob(submission_command, bands_dir)
 
 
-def run_hse_calculation(submit=True, force_overwrite=False):
+def run_hse_calculation(submit=True, force_overwrite=False, directory='.'):
     """
-    Setup/submit an HSE06 calculation to get an accurate band structure.
-    Requires a previous WAVECAR and IBZKPT from a standard DFT run. See
+    Setup/submit an HSE06 calculation to get an accurate band structure,
+    in directory/hse_bands. Requires the CONTCAR, POTCAR and IBZKPT
+    from a standard DFT run in directory, whose WAVECAR and CHGCAR
+    are also copied if they exist. See
     http://cms.mpi.univie.ac.at/wiki/index.php/Si_bandstructure for more
     details.
     """
@@ -95,24 +98,33 @@ def run_hse_calculation(submit=True, force_overwrite=False):
                       'EDIFF': 1e-6, 'ENCUT': 500, 'ISMEAR': 1, 'SIGMA': 0.1,
                       'IBRION': 2, 'ISIF': 3}
 
-    if not os.path.isdir('hse_bands'):
-        os.mkdir('hse_bands')
-    if force_overwrite or not is_converged('hse_bands'):
-        os.chdir('hse_bands')
-        os.system('cp ../CONTCAR ./POSCAR')
-        os.system('cp ../POTCAR ./POTCAR')
-        os.system('cp ../WAVECAR ./')
-        os.system('cp ../CHGCAR ./')
-        Incar.from_dict(HSE_INCAR_DICT).write_file('INCAR')
+    name = os.path.basename(os.path.abspath(directory))
+    bands_dir = os.path.join(directory, 'hse_bands')
+
+    if not os.path.isdir(bands_dir):
+        os.mkdir(bands_dir)
+    if force_overwrite or not is_converged(bands_dir):
+        shutil.copy(os.path.join(directory, 'CONTCAR'),
+                    os.path.join(bands_dir, 'POSCAR'))
+        shutil.copy(os.path.join(directory, 'POTCAR'), bands_dir)
+        # Start from the standard DFT wavefunctions and charge density
+        # when they were kept.
+        for filename in ['WAVECAR', 'CHGCAR']:
+            if os.path.exists(os.path.join(directory, filename)):
+                shutil.copy(os.path.join(directory, filename), bands_dir)
+        Incar.from_dict(HSE_INCAR_DICT).write_file(
+            os.path.join(bands_dir, 'INCAR'))
 
         # Re-use the irreducible brillouin zone KPOINTS from a
         # previous standard DFT run.
-        ibz_lines = open('../IBZKPT').readlines()
+        ibz_lines = open(os.path.join(directory, 'IBZKPT')).readlines()
         n_ibz_kpts = int(ibz_lines[1].split()[0])
-        kpath = HighSymmKpath(Structure.from_file('POSCAR'))
-        Kpoints.automatic_linemode(20, kpath).write_file('linemode_KPOINTS')
-        remove_z_kpoints(filename='linemode_KPOINTS')
-        linemode_lines = open('linemode_KPOINTS').readlines()
+        kpath = HighSymmKpath(
+            Structure.from_file(os.path.join(bands_dir, 'POSCAR')))
+        linemode_kpoints = os.path.join(bands_dir, 'linemode_KPOINTS')
+        Kpoints.automatic_linemode(20, kpath).write_file(linemode_kpoints)
+        remove_z_kpoints(filename=linemode_kpoints)
+        linemode_lines = open(linemode_kpoints).readlines()
 
         abs_path = []
         i = 4
@@ -137,7 +149,7 @@ def run_hse_calculation(submit=True, force_overwrite=False):
 
         n_linemode_kpts = len(abs_path)
 
-        with open('KPOINTS', 'w') as kpts:
+        with open(os.path.join(bands_dir, 'KPOINTS'), 'w') as kpts:
             kpts.write('Automatically generated mesh\n')
             kpts.write('{}\n'.format(n_ibz_kpts + n_linemode_kpts))
             kpts.write('Reciprocal Lattice\n')
@@ -146,19 +158,18 @@ def run_hse_calculation(submit=True, force_overwrite=False):
             for point in abs_path:
                 kpts.write('{}\n'.format(' '.join(point)))
 
+        vasp = get_config_value('normal_binary')
         if HIPERGATOR == 1:
-            write_pbs_runjob('{}_hsebands'.format(
-                os.getcwd().split('/')[-2]), 2, 64, '1800mb', '50:00:00', VASP)
+            write_pbs_runjob('{}_hsebands'.format(name), 2, 64, '1800mb',
+                             '50:00:00', vasp, bands_dir)
             submission_command = 'qsub runjob'
 
         elif HIPERGATOR == 2:
-            write_slurm_runjob('{}_hsebands'.format(
-                os.getcwd().split('/')[-2]), 64, '1800mb', '50:00:00', VASP)
+            write_slurm_runjob('{}_hsebands'.format(name), 64, '1800mb',
+                               '50:00:00', vasp, bands_dir)
             submission_command = 'sbatch runjob'
 
         if submit:
-            os.system(submission_command)
-
-        os.system('rm linemode_KPOINTS')
+            submit_runjob(submission_command, bands_dir)
 
-        os.chdir('../')
+        os.remove(linemode_kpoints)
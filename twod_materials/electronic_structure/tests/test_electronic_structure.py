@@ -0,0 +1,258 @@
+import unittest
+
+import os
+
+import shutil
+
+import tempfile
+
+import json
+
+import numpy as np
+
+from pymatgen.io.vasp.inputs import Poscar
+from pymatgen.io.vasp.outputs import Locpot, BSVasprun
+from pymatgen.electronic_structure.core import Spin
+
+import twod_materials
+from twod_materials.utils import CACHE_FILENAME
+import twod_materials.electronic_structure.analysis as ea
+from twod_materials.electronic_structure.analysis import (read_planar_average,
+                                                          get_local_potential,
+                                                          get_all_band_edges,
+                                                          get_line_masses,
+                                                          get_mass_tensors,
+                                                          HBAR_SQUARED_OVER_M0,
+                                                          read_projected_bands,
+                                                          get_projected_bands,
+                                                          PROJECTED_BANDS_FILENAME)
+
+
+PACKAGE_PATH = os.path.dirname(twod_materials.__file__)
+
+
+class LocalPotentialTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        poscar = Poscar.from_file(os.path.join(
+            PACKAGE_PATH, 'stability/tests/BiTeCl/POSCAR'))
+        np.random.seed(0)
+        self.filename = os.path.join(self.directory, 'LOCPOT')
+        Locpot(poscar, {'total': np.random.uniform(
+            -20, 5, (6, 5, 7))}).write_file(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_planar_average_matches_locpot(self):
+        locpot = Locpot.from_file(self.filename)
+        for axis in range(3):
+            self.assertTrue(np.allclose(
+                read_planar_average(self.filename, axis),
+                locpot.get_average_along_axis(axis)))
+
+    def test_get_local_potential_is_cached(self):
+        profile = get_local_potential(self.directory)
+        self.assertEqual(len(profile), 7)
+        with open(os.path.join(self.directory, CACHE_FILENAME)) as cache:
+            self.assertTrue(np.allclose(
+                json.load(cache)['locpot_average_2']['data'], profile))
+
+    def test_get_all_band_edges_for_BiTeCl(self):
+        shutil.copy(os.path.join(PACKAGE_PATH,
+                                 'stability/tests/BiTeCl/vasprun.xml'),
+                    self.directory)
+        missing = os.path.join(self.directory, 'missing')
+        os.mkdir(missing)
+        all_band_edges = get_all_band_edges([self.directory, missing], 2)
+        self.assertEqual(list(all_band_edges), [self.directory])
+
+        band_edges = all_band_edges[self.directory]
+        self.assertEqual((band_edges['CBM'], band_edges['VBM']),
+                         (-1.6169, -3.4345))
+        self.assertTrue(band_edges['Direct'])
+        self.assertFalse(band_edges['Metal'])
+        self.assertAlmostEqual(band_edges['E_vac'],
+                               get_local_potential(self.directory)[-5])
+
+
+class EffectiveMassTest(unittest.TestCase):
+
+    def test_get_line_masses_across_branches(self):
+        # X-Gamma, then Gamma-Y with Gamma repeated, for a band with a
+        # mass of 0.5 along x and 2 along y.
+        steps = np.linspace(0, 0.2, 11)
+        kpoints = np.vstack([np.column_stack([0.2 - steps, 0 * steps,
+                                              0 * steps]),
+                             np.column_stack([0 * steps, steps, 0 * steps])])
+        energies = HBAR_SQUARED_OVER_M0 / 2 * (
+            kpoints[:, 0]**2 / 0.5 + kpoints[:, 1]**2 / 2)
+        left, right = get_line_masses(kpoints, [energies, -energies], 10)
+        self.assertTrue(np.allclose(left, [0.5, -0.5]))
+        self.assertTrue(np.allclose(right, [2, -2]))
+
+        # Nothing to fit to past the end of the path.
+        left, right = get_line_masses(kpoints, energies, 21)
+        self.assertTrue(np.isnan(right).all())
+        self.assertTrue(np.allclose(left, 2))
+
+    def test_get_mass_tensors_on_a_hexagonal_mesh(self):
+        reciprocal_matrix = np.array([[1.5, 0.866, 0], [0, 1.732, 0],
+                                      [0, 0, 0.3]])
+        frac_kpoints = np.column_stack([
+            np.mgrid[0:24, 0:24].reshape(2, -1).T / 24.0, np.zeros(576)])
+        offsets = frac_kpoints - [0.25, 0.5, 0]
+        offsets -= np.round(offsets)
+        k = np.dot(offsets, reciprocal_matrix)[:, :2]
+        masses = np.array([[0.4, 0.1], [0.1, 1.2]])
+        energies = HBAR_SQUARED_OVER_M0 / 2 * np.einsum(
+            'ki,ij,kj->k', k, np.linalg.inv(masses), k)
+        index = np.argmin(energies)
+        tensors = get_mass_tensors(frac_kpoints, reciprocal_matrix,
+                                   [energies, 3 * energies], index)
+        self.assertTrue(np.allclose(tensors[0], masses))
+        self.assertTrue(np.allclose(tensors[1], masses / 3))
+
+
+# The fields of vasprun.xml's projected array with LORBIT = 11.
+PROJECTED_FIELDS = ['s', 'py', 'pz', 'px', 'dxy', 'dyz', 'dz2', 'dxz',
+                    'x2-y2']
+
+
+def write_projected_vasprun(directory):
+    """
+    Writes the BiTeCl vasprun.xml with random projections on each of
+    its 3 sites, 20 k-points and 16 bands added to its last
+    calculation, and a line-mode KPOINTS from Gamma to X, to directory.
+    """
+
+    with open(os.path.join(PACKAGE_PATH,
+                           'stability/tests/BiTeCl/vasprun.xml')) as f:
+        vasprun = f.read()
+    calculation = vasprun.rindex('</calculation>')
+    eigenvalues = vasprun[vasprun.rindex('<eigenvalues>', 0, calculation):
+                          vasprun.rindex('</eigenvalues>', 0, calculation)
+                          + len('</eigenvalues>')]
+
+    np.random.seed(0)
+    projected = ['<projected>', eigenvalues, '<array>']
+    projected += ['<field>{}</field>'.format(field)
+                  for field in PROJECTED_FIELDS]
+    projected += ['<set>', '<set comment="spin1">']
+    for k in range(20):
+        projected.append('<set comment="kpoint {}">'.format(k + 1))
+        for b in range(16):
+            projected.append('<set comment="band {}">'.format(b + 1))
+            projected += ['<r>{}</r>'.format(' '.join(
+                '%.4f' % value for value in np.random.uniform(0, 0.2, 9)))
+                for site in range(3)]
+            projected.append('</set>')
+        projected.append('</set>')
+    projected += ['</set>', '</set>', '</array>', '</projected>', '']
+
+    with open(os.path.join(directory, 'vasprun.xml'), 'w') as f:
+        f.write(vasprun[:calculation] + '\n'.join(projected)
+                + vasprun[calculation:])
+    with open(os.path.join(directory, 'KPOINTS'), 'w') as f:
+        f.write('Gamma to X\n5\nLine_mode\nReciprocal\n'
+                '0 0 0 ! \\Gamma\n0.5 0 0 ! X\n')
+
+
+class ProjectedBandsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        write_projected_vasprun(self.directory)
+        self.vasprun = os.path.join(self.directory, 'vasprun.xml')
+        self.kpoints = os.path.join(self.directory, 'KPOINTS')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertProjectionsEqual(self, projections, expected):
+        for spin in expected:
+            for band, expected_band in zip(projections[spin],
+                                           expected[spin]):
+                for kpoint, expected_kpoint in zip(band, expected_band):
+                    self.assertEqual(sorted(kpoint), sorted(expected_kpoint))
+                    for key in expected_kpoint:
+                        if isinstance(expected_kpoint[key], dict):
+                            self.assertProjectionsEqual(
+                                {spin: [[kpoint[key]]]},
+                                {spin: [[expected_kpoint[key]]]})
+                        else:
+                            self.assertAlmostEqual(
+                                kpoint[key], expected_kpoint[key], 5)
+
+    def test_read_projected_bands_matches_BSVasprun(self):
+        expected = BSVasprun(self.vasprun, parse_projected_eigen=True) \
+            .get_band_structure(self.kpoints, line_mode=True)
+        projected = read_projected_bands(self.vasprun, self.kpoints)
+
+        self.assertEqual(projected.efermi, expected.efermi)
+        self.assertTrue(np.allclose(projected.bands[Spin.up],
+                                    expected.bands[Spin.up]))
+        self.assertEqual(
+            [(kpoint.label, list(kpoint.frac_coords))
+             for kpoint in projected.kpoints],
+            [(kpoint.label, list(kpoint.frac_coords))
+             for kpoint in expected.kpoints])
+        self.assertProjectionsEqual(
+            projected.get_projection_on_elements(),
+            expected.get_projection_on_elements())
+        orbitals = {'Bi': ['s', 'p', 'd'], 'Cl': ['p']}
+        self.assertProjectionsEqual(
+            projected.get_projections_on_elts_and_orbitals(orbitals),
+            expected.get_projections_on_elts_and_orbitals(orbitals))
+
+    def test_read_projected_bands_with_a_selection(self):
+        full = read_projected_bands(self.vasprun, self.kpoints,
+                                    dtype=np.float64)
+        selected = read_projected_bands(self.vasprun, self.kpoints,
+                                        elements=['Bi'],
+                                        orbital_types=['p'])
+        self.assertEqual(selected.projections[Spin.up].shape, (16, 20, 1, 1))
+        self.assertEqual(selected.projections[Spin.up].dtype, np.float32)
+        self.assertTrue(np.allclose(selected.projections[Spin.up][..., 0, 0],
+                                    full.projections[Spin.up][..., 2, 1]))
+
+    def test_get_projected_bands_reparses_only_a_changed_vasprun(self):
+        n_reads = []
+        read = ea.read_projected_bands
+
+        def read_projected_bands(*args, **kwargs):
+            n_reads.append(1)
+            return read(*args, **kwargs)
+
+        ea.read_projected_bands = read_projected_bands
+        try:
+            projected = get_projected_bands(self.directory)
+            get_projected_bands(self.directory)
+            self.assertEqual(len(n_reads), 1)
+            self.assertAlmostEqual(
+                get_projected_bands(self.directory).get_projection_on_elements(
+                    )[Spin.up][3][5]['Te'],
+                projected.get_projection_on_elements()[Spin.up][3][5]['Te'])
+
+            with open(self.vasprun, 'a') as f:
+                f.write('\n')
+            get_projected_bands(self.directory)
+            self.assertEqual(len(n_reads), 2)
+
+            for dtype in [np.float64, np.float64, np.float32]:
+                projected = get_projected_bands(self.directory, dtype)
+                self.assertEqual(projected.projections[Spin.up].dtype, dtype)
+            self.assertEqual(len(n_reads), 4)
+        finally:
+            ea.read_projected_bands = read
+
+        if os.path.isdir('/proc/self/fd'):
+            npz = os.path.join(self.directory, PROJECTED_BANDS_FILENAME)
+            open_files = [os.path.realpath(os.path.join('/proc/self/fd', fd))
+                          for fd in os.listdir('/proc/self/fd')]
+            self.assertNotIn(os.path.realpath(npz), open_files)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,177 +6,604 @@ from scipy import interpolate
 
 import math
 
+import json
+
+import csv
+
+from multiprocessing import Pool
+
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
 
-from pymatgen.io.vasp.outputs import Vasprun
 from pymatgen.core.structure import Structure
 
 import warnings
 
+from twod_materials.utils import scan_directories
+from twod_materials.friction.sliding import (FourierSurface, get_sliding_path,
+                                             get_path_profile,
+                                             get_max_lateral_force)
+
+
+# Written to friction/lateral by run_gamma_calculations(use_symmetry=True)
+# as {grid point: grid point that was actually calculated}.
+GAMMA_MAP_FILENAME = 'gamma_map.json'
+
+# Written to friction/lateral by refine_gamma_calculations() as a list
+# of [basin, peak, basin energy, peak energy, number of grid points
+# known], one per refinement.
+GAMMA_REFINEMENT_FILENAME = 'gamma_refinement.json'
+
+# Columns of the tables made by get_friction_table. Forces are in nN and
+# spacings in Angstroms.
+FRICTION_TABLE_COLUMNS = ['material', 'spacing', 'F_N', 'F_f', 'mu', 'error']
+
+
+def read_gamma_map(lateral_dir, n_divs_x, n_divs_y):
+    """
+    Returns {grid point: directory its energy was calculated in} for
+    the Gamma surface grid in lateral_dir. Every grid point is its own
+    directory unless run_gamma_calculations(use_symmetry=True) left a
+    gamma_map.json behind.
+    """
+
+    gamma_map_file = os.path.join(lateral_dir, GAMMA_MAP_FILENAME)
+    if os.path.exists(gamma_map_file):
+        with open(gamma_map_file) as f:
+            return json.load(f)
+
+    return dict([('{}x{}'.format(x, y), '{}x{}'.format(x, y))
+                 for x in range(n_divs_x) for y in range(n_divs_y)])
+
+
+def get_grid_indices(name):
+    """
+    Returns (x, y) for a grid point directory name 'XxY'.
+    """
+
+    return tuple(int(i) for i in name.split('x'))
+
+
+def interpolate_gamma_surface(energies, n_divs_x, n_divs_y, margin=0.25):
+    """
+    Returns an (n_divs_x, n_divs_y) array of the Gamma surface
+    interpolated from energies ({'XxY': energy}) at any subset of the
+    grid points (at least three, not all in a line). The surface is
+    periodic, so the known points within margin (in fractional
+    coordinates) of the cell's edges are repeated on its far sides
+    before a cubic interpolation, which passes exactly through them.
+    """
+
+    n_divs = np.array([n_divs_x, n_divs_y], dtype=float)
+    names = list(energies)
+    points = np.array([get_grid_indices(name) for name in names]) / n_divs
+    values = np.array([energies[name] for name in names])
+
+    images = np.array([[i, j] for i in (-1, 0, 1) for j in (-1, 0, 1)])
+    tiled_points = (points[np.newaxis] + images[:, np.newaxis]).reshape(-1, 2)
+    tiled_values = np.tile(values, len(images))
+    near = np.all((tiled_points > -margin) & (tiled_points < 1 + margin),
+                  axis=1)
+    grid = np.mgrid[0:n_divs_x, 0:n_divs_y].reshape(2, -1).T / n_divs
+
+    surface = interpolate.griddata(tiled_points[near], tiled_values[near],
+                                   grid, method='cubic')
+    return surface.reshape(n_divs_x, n_divs_y)
+
+
+def get_refinement_points(energies, n_divs_x, n_divs_y, radius=1,
+                          gradient_fraction=0.1):
+    """
+    Returns the names of the grid points that aren't in energies (see
+    interpolate_gamma_surface) but should be calculated next: those
+    within radius grid points of the minimum and maximum of the
+    interpolated surface, and those where its gradient is among the
+    steepest gradient_fraction of the grid.
+    """
+
+    surface = interpolate_gamma_surface(energies, n_divs_x, n_divs_y)
+
+    candidates = set()
+    for extremum in [np.nanargmin(surface), np.nanargmax(surface)]:
+        x, y = np.unravel_index(extremum, surface.shape)
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                candidates.add(((x + dx) % n_divs_x, (y + dy) % n_divs_y))
+
+    gradient = np.gradient(np.pad(surface, 1, mode='wrap'))
+    slope = np.hypot(*gradient)[1:-1, 1:-1]
+    threshold = np.nanpercentile(slope, 100 * (1 - gradient_fraction))
+    candidates.update(zip(*np.where(slope >= threshold)))
+
+    return sorted(['{}x{}'.format(x, y) for x, y in candidates
+                   if '{}x{}'.format(x, y) not in energies],
+                  key=get_grid_indices)
+
+
+def is_refinement_converged(history, tolerance=0.001):
+    """
+    True if the basin and peak energies in history (a list of
+    get_basin_and_peak() results, one per refinement) changed by less
+    than tolerance in the last refinement.
+    """
+
+    if len(history) < 2:
+        return False
+    return abs(history[-1][2] - history[-2][2]) < tolerance and \
+        abs(history[-1][3] - history[-2][3]) < tolerance
+
+
+def get_basin_and_peak(energies):
+    """
+    Returns [basin, peak, basin energy, peak energy, len(energies)]
+    for energies ({'XxY': energy}).
+    """
+
+    basin = min(energies, key=lambda name: energies[name])
+    peak = max(energies, key=lambda name: energies[name])
+    return [basin, peak, energies[basin], energies[peak], len(energies)]
+
+
+def sample_gamma_surface(energy_function, n_divs_x, n_divs_y, stride=2,
+                         tolerance=0.001, max_iterations=20):
+    """
+    Does offline what run_gamma_calculations(stride=stride) followed by
+    refine_gamma_calculations() until it's done would do on a cluster,
+    with energy_function(x, y) standing in for a VASP calculation at
+    the fractional shift (x, y). Returns ({'XxY': energy} for every
+    grid point that was calculated, the refinement history).
+    """
 
-def plot_gamma_surface(fmt='pdf'):
+    energies = {}
+    new_points = ['{}x{}'.format(x, y) for x in range(0, n_divs_x, stride)
+                  for y in range(0, n_divs_y, stride)]
+    history = []
+
+    for i in range(max_iterations):
+        for name in new_points:
+            x, y = get_grid_indices(name)
+            energies[name] = energy_function(float(x) / n_divs_x,
+                                             float(y) / n_divs_y)
+        history.append(get_basin_and_peak(energies))
+        if is_refinement_converged(history, tolerance):
+            break
+        new_points = get_refinement_points(energies, n_divs_x, n_divs_y)
+        if not new_points:
+            break
+
+    return energies, history
+
+
+class NormalEnergyCurve():
+
+    def __init__(self, spacings, energies):
+        '''
+        A cubic spline through the energies (eV) of one stacking at
+        each interlayer spacing (Angstroms), fit once. It's stored as
+        piecewise polynomials, so the energy and its derivatives are
+        evaluated exactly at whichever spacings they're needed without
+        sampling a dense grid.
+        '''
+
+        self.spacings = np.asarray(spacings, dtype=float)
+        self.energies = np.asarray(energies, dtype=float)
+        self._polynomials = {0: interpolate.PPoly.from_spline(
+            interpolate.splrep(self.spacings, self.energies, s=0))}
+        self._forces = None
+
+    def get_energy(self, spacings, der=0):
+        '''
+        Returns the der-th derivative of the energy at spacings.
+        '''
+
+        if der not in self._polynomials:
+            self._polynomials[der] = self._polynomials[0].derivative(der)
+        return self._polynomials[der](spacings)
+
+    def get_force(self, spacings=None):
+        '''
+        Returns the normal force (eV/Angstrom), -dE/dz, at spacings, or
+        at the fitted spacings (remembered after the first call) if
+        spacings is None.
+        '''
+
+        if spacings is not None:
+            return -self.get_energy(spacings, der=1)
+        if self._forces is None:
+            self._forces = -self.get_energy(self.spacings, der=1)
+        return self._forces
+
+
+class FrictionDataset():
+
+    def __init__(self, directory='.', n_workers=8):
+        '''
+        Everything the friction analysis needs from a material's
+        friction/lateral and friction/normal directories (whichever of
+        the two exist), read in a single scan_directories pass so that
+        each vasprun.xml is parsed once no matter how many plots and
+        numbers are made from it. Pass the same dataset to each of the
+        analysis functions in this module, e.g.
+
+            dataset = FrictionDataset(directory)
+            plot_gamma_surface(directory=directory, dataset=dataset)
+            basin, peak = get_basin_and_peak_locations(dataset=dataset)
+            plot_mu_vs_F_N(basin, directory=directory, dataset=dataset)
+
+        args:
+            directory: the material's directory (containing CONTCAR
+                       and friction/).
+            n_workers: passed on to scan_directories.
+        '''
+
+        self.directory = directory
+        self._sliding_path = None
+        self._normal_curves = {}
+        self.lateral_dir = os.path.join(directory, 'friction', 'lateral')
+        self.normal_dir = os.path.join(directory, 'friction', 'normal')
+
+        # Grid points whose energies were actually calculated.
+        self.representatives = []
+        self.gamma_map = {}
+        if os.path.isdir(self.lateral_dir):
+            lattice = Structure.from_file(
+                os.path.join(directory, 'CONTCAR')).lattice
+            self.matrix = lattice.matrix[:2, :2]
+            self.area = np.cross(lattice.matrix[0], lattice.matrix[1])[2]
+            self.n_divs = (int(math.ceil(lattice.a * 2.5)),
+                           int(math.ceil(lattice.b * 2.5)))
+            self.gamma_map = read_gamma_map(self.lateral_dir, *self.n_divs)
+            self.representatives = sorted(set(self.gamma_map.values()),
+                                          key=get_grid_indices)
+
+        # Interlayer spacings (the directory names in friction/normal)
+        # and the stacking configurations calculated at each of them.
+        self.spacings = []
+        self.stackings = []
+        if os.path.isdir(self.normal_dir):
+            self.spacings = sorted([
+                float(spc) for spc in os.listdir(self.normal_dir)
+                if os.path.isdir(os.path.join(self.normal_dir, spc))])
+            self.stackings = sorted(set([
+                dir for spacing in self.spacings
+                for dir in os.listdir(self._get_normal_path(spacing))
+                if os.path.isdir(self._get_normal_path(spacing, dir))]))
+
+        normal_paths = [self._get_normal_path(spacing, stacking)
+                        for spacing in self.spacings
+                        for stacking in self.stackings]
+        scan = scan_directories(
+            [os.path.join(self.lateral_dir, dir)
+             for dir in self.representatives] + normal_paths, n_workers)
+
+        self.lateral_energies = dict([
+            (dir, scan[os.path.join(self.lateral_dir, dir)]['final_energy'])
+            for dir in self.representatives])
+
+        # Energies (eV, NaN where missing) and the in-plane position of
+        # the top layer (the cartesian x, y of its last site) for each
+        # stacking, indexed like self.spacings.
+        self.normal_energies = {}
+        self.top_positions = {}
+        for stacking in self.stackings:
+            energies = []
+            positions = []
+            for spacing in self.spacings:
+                path = self._get_normal_path(spacing, stacking)
+                energy = scan[path]['final_energy']
+                energies.append(np.nan if energy is None else energy)
+                try:
+                    positions.append(Structure.from_file(os.path.join(
+                        path, 'POSCAR')).sites[-1].coords[:2])
+                except (IOError, OSError):
+                    positions.append([np.nan, np.nan])
+            self.normal_energies[stacking] = np.array(energies)
+            self.top_positions[stacking] = np.array(positions)
+
+    def _get_normal_path(self, spacing, stacking=''):
+        return os.path.join(self.normal_dir, str(spacing), stacking)
+
+    def get_gamma_energies(self):
+        '''
+        Returns an (n_divs_x, n_divs_y) masked array of the Gamma
+        surface energies (eV/Angstrom^2), with the grid points that
+        don't have an energy (yet) masked out.
+        '''
+
+        energies = np.ma.masked_all(self.n_divs)
+        for name, dir in self.gamma_map.items():
+            energy = self.lateral_energies[dir]
+            if energy is not None:
+                energies[get_grid_indices(name)] = energy / self.area
+
+        return energies
+
+    def get_basin_and_peak(self):
+        '''
+        Returns the calculated grid points (basin, peak) with the
+        lowest and highest energies. Ties go to the first grid point.
+        '''
+
+        known = [dir for dir in self.representatives
+                 if self.lateral_energies[dir] is not None]
+        if not known:
+            raise ValueError('No Gamma surface energies in {}.'.format(
+                self.lateral_dir))
+        return (min(known, key=lambda dir: self.lateral_energies[dir]),
+                max(known, key=lambda dir: self.lateral_energies[dir]))
+
+    def get_normal_energies(self, stacking):
+        '''
+        Returns the energies (eV) of stacking at each of self.spacings,
+        relative to the energy at the largest spacing.
+        '''
+
+        energies = self.normal_energies[stacking]
+        return energies - energies[-1]
+
+    def get_normal_curve(self, stacking):
+        '''
+        Returns the NormalEnergyCurve of get_normal_energies(stacking)
+        against self.spacings, fit the first time it's asked for.
+        '''
+
+        if stacking not in self._normal_curves:
+            self._normal_curves[stacking] = NormalEnergyCurve(
+                self.spacings, self.get_normal_energies(stacking))
+        return self._normal_curves[stacking]
+
+    def get_normal_force(self, stacking):
+        '''
+        Returns the normal force (eV/Angstrom) on stacking at each of
+        self.spacings.
+        '''
+
+        return self.get_normal_curve(stacking).get_force()
+
+    def get_sinusoids(self):
+        '''
+        Returns (amplitude, b), each indexed like self.spacings, of the
+        sinusoid E(x) = amplitude * (sin(b * x) + 1) between the two
+        stackings (basin and peak) as the top layer slides from one to
+        the other. amplitude is in eV and b in 1/Angstrom.
+        '''
+
+        start, end = self.stackings[:2]
+        amplitude = abs(self.normal_energies[start]
+                        - self.normal_energies[end]) / 2
+        dist = np.hypot(*(self.top_positions[start]
+                          - self.top_positions[end]).T)
+        return amplitude, (2 * np.pi) / (dist * 2)
+
+    def get_fourier_surface(self, n_harmonics=None):
+        '''
+        Returns a FourierSurface fit to the Gamma surface energies
+        (eV per cell, missing points filled in by fill_gamma_energies).
+        '''
+
+        energies = fill_gamma_energies(self.get_gamma_energies()) * self.area
+        return FourierSurface(energies, self.matrix, n_harmonics)
+
+    def get_sliding_path(self):
+        '''
+        Returns (surface, path): the FourierSurface of the Gamma
+        surface and the minimum energy path on it (an array of
+        fractional shifts) from the basin to its closest periodic
+        image, as found by friction.sliding.get_sliding_path.
+        '''
+
+        if self._sliding_path is None:
+            surface = self.get_fourier_surface()
+            basin = self.get_basin_and_peak()[0]
+            start = np.array(get_grid_indices(basin), dtype=float) / \
+                self.n_divs
+            self._sliding_path = (surface, get_sliding_path(surface, start))
+        return self._sliding_path
+
+    def get_lateral_forces(self):
+        '''
+        Returns the maximum lateral force (eV/Angstrom) along the
+        minimum energy sliding path at each of self.spacings. The
+        shape of the energy landscape comes from the Gamma surface, and
+        is scaled at each spacing by how much the energy difference
+        between its basin and peak (see get_basin_and_peak) in
+        friction/normal has changed from the Gamma surface's. Raises a
+        ValueError if the basin or peak wasn't calculated in
+        friction/normal, or if the Gamma surface is flat.
+        '''
+
+        basin, peak = self.get_basin_and_peak()
+        corrugation = abs(self.lateral_energies[basin]
+                          - self.lateral_energies[peak])
+        if np.isclose(corrugation, 0):
+            raise ValueError('The Gamma surface in {} is flat.'.format(
+                self.lateral_dir))
+        missing = [dir for dir in (basin, peak) if dir not in self.stackings]
+        if missing:
+            raise ValueError('No normal force calculations for {} in {}.'
+                             .format(' and '.join(missing), self.normal_dir))
+
+        surface, path = self.get_sliding_path()
+        max_force = get_max_lateral_force(surface, path)
+        return max_force * abs(self.normal_energies[basin]
+                               - self.normal_energies[peak]) / corrugation
+
+    def get_mu_vs_F_N(self, basin_dir, model='sinusoid'):
+        '''
+        Returns {'F_N': F_N, 'F_f': F_f, 'mu': mu}, one of each per
+        spacing. The forces are in units of nN.
+
+        args:
+            model: how the friction force is found. 'sinusoid' fits a
+                   sinusoid through the two stackings at each spacing
+                   (see get_sinusoids), 'path' follows the minimum
+                   energy path over the whole Gamma surface (see
+                   get_lateral_forces).
+        '''
+
+        F_N = self.get_normal_force(basin_dir) * 1.602
+
+        if model == 'sinusoid':
+            # The friction force b * amplitude * cos(b * x) peaks at
+            # x = 0.
+            amplitude, b = self.get_sinusoids()
+            F_f = b * amplitude * 1.602
+        elif model == 'path':
+            F_f = self.get_lateral_forces() * 1.602
+        else:
+            raise ValueError('Unknown friction model {}.'.format(model))
+
+        return {'F_N': list(F_N), 'F_f': list(F_f), 'mu': list(F_f / F_N)}
+
+
+def get_gamma_energies(directory='.', dataset=None):
+    """
+    Returns an (n_divs_x, n_divs_y) masked array of the Gamma surface
+    energies (eV/Angstrom^2) from directory/friction/lateral, with
+    the grid points that don't have an energy (yet) masked out.
+    directory is the material's directory (containing CONTCAR and
+    friction/), and is only scanned if no FrictionDataset is given.
+    """
+
+    dataset = dataset or FrictionDataset(directory)
+    return dataset.get_gamma_energies()
+
+
+def fill_gamma_energies(energies):
+    """
+    Returns a plain array of the masked energies from
+    get_gamma_energies, with the missing points filled in by periodic
+    interpolation from the rest (or by their mean, if there are too
+    few to interpolate from).
+    """
+
+    if not np.ma.is_masked(energies):
+        return np.ma.getdata(energies).copy()
+
+    n_divs_x, n_divs_y = energies.shape
+    known = dict([('{}x{}'.format(x, y), energies[x, y])
+                  for x, y in zip(*np.where(~np.ma.getmaskarray(energies)))])
+    filled = energies.filled(energies.mean())
+    if len(known) > 3:
+        surface = interpolate_gamma_surface(known, n_divs_x, n_divs_y)
+        mask = np.ma.getmaskarray(energies) & ~np.isnan(surface)
+        filled[mask] = surface[mask]
+
+    return filled
+
+
+def plot_gamma_surface(fmt='pdf', directory='.', dataset=None):
     """
     Collect the energies along a 10x10 grid of static energy
     calculations to plot the Gamma surface between two layers of the 2D
-    material.
+    material. directory is the material's directory (containing
+    CONTCAR and friction/), and the plot is saved in
+    directory/friction/lateral, along with the energies themselves in
+    gamma_surface.npz ('energies', with missing points interpolated,
+    and 'mask', True where they were missing).
     """
 
-    lattice = Structure.from_file('CONTCAR').lattice
-    area = np.cross(lattice._matrix[0], lattice._matrix[1])[2]
+    dataset = dataset or FrictionDataset(directory)
+    energies = dataset.get_gamma_energies()
+    n_divs_x, n_divs_y = energies.shape
+    lateral_dir = dataset.lateral_dir
 
-    n_divs_x = int(math.ceil(lattice.a * 2.5))
-    n_divs_y = int(math.ceil(lattice.b * 2.5))
+    mask = np.ma.getmaskarray(energies)
+    if mask.any():
+        warnings.warn('{} did not converge.'.format(
+            ['{}x{}'.format(x, y) for x, y in zip(*np.where(mask))]))
+    energies = fill_gamma_energies(energies)
+    np.savez(os.path.join(lateral_dir, 'gamma_surface.npz'),
+             energies=energies, mask=mask)
+
+    # Repeat the first row and column on the far side of the cell, and
+    # plot all energies relative to the global minimum.
+    periodic = np.pad(energies, ((0, 1), (0, 1)), mode='wrap')
+    periodic -= periodic.min()
 
     ax = plt.figure(figsize=(n_divs_x * 1.2, n_divs_y * 1.2)).gca()
+    ax.imshow(periodic.T, cmap=plt.cm.jet, origin='lower',
+              interpolation='none', aspect='auto',
+              extent=(0, n_divs_x + 1, 0, n_divs_y + 1))
 
     ax.set_xlim(0, n_divs_x + 1)
     ax.set_ylim(0, n_divs_y + 1)
 
-    ENERGY_ARRAY = []
-
-    X_VALUES = range(n_divs_x)
-    Y_VALUES = range(n_divs_y)
-
-    os.chdir('friction/lateral')
-
-    not_converged = []
-    for x in X_VALUES:
-        ENERGY_ARRAY.append([])
-        for y in Y_VALUES:
-            dir = '{}x{}'.format(x, y)
-            os.chdir(dir)
-            try:
-                energy = Vasprun('vasprun.xml').final_energy / area
-                ENERGY_ARRAY[x].append(energy)
-            except:
-                not_converged.append('{}x{}'.format(x, y))
-                ENERGY_ARRAY[x].append(0)
-            os.chdir('../')
-        ENERGY_ARRAY[x].append(ENERGY_ARRAY[x][0])
-
-    ENERGY_ARRAY.append([])
-    ENERGY_ARRAY[n_divs_x] = ENERGY_ARRAY[0]
-
-    if not_converged:
-        warnings.warn('{} did not converge.'.format(not_converged))
-        for coords in not_converged:
-            ENERGY_ARRAY[
-                int(coords.split('x')[0])][int(coords.split('x')[1])] = energy
-
-    minima = []
-    maxima = []
-    for x in X_VALUES:
-        minima.append(min(ENERGY_ARRAY[x]))
-        maxima.append(max(ENERGY_ARRAY[x]))
-
-    abs_minimum = min(minima)
-    abs_maximum = max(maxima)
-
-    for x in range(n_divs_x + 1):
-        for y in range(n_divs_y + 1):
-
-            # Plot all energies relative to the global minimum.
-            scaled_energy = ENERGY_ARRAY[x][y] - abs_minimum
-            if '{}x{}'.format(x, y) in not_converged:
-                color_code = 'w'
-            else:
-                color_code = plt.cm.jet(
-                    scaled_energy / (abs_maximum - abs_minimum)
-                    )
-
-            ax.add_patch(plt.Rectangle((x, y), width=1, height=1,
-                                       facecolor=color_code,
-                                       linewidth=0))
-
     # Get rid of annoying ticks.
     ax.axes.get_yaxis().set_ticks([])
     ax.axes.get_xaxis().set_ticks([])
 
-    plt.savefig('gamma_surface.{}'.format(fmt), transparent=True)
-    os.chdir('../../')
+    # Save through the figure itself; plt.savefig would redraw the
+    # (potentially very large) figure on screen afterwards.
+    ax.figure.savefig(os.path.join(lateral_dir,
+                                   'gamma_surface.{}'.format(fmt)),
+                      transparent=True)
+    plt.close(ax.figure)
 
 
-def get_basin_and_peak_locations():
+def get_basin_and_peak_locations(directory='.', dataset=None):
     """
-    Find which directories inside `friction/lateral` represent
-    the minimum (basin) and maximum (peak) energy stacking
-    configurations. Returns a tuple of the form (basin, peak).
+    Find which directories inside `directory/friction/lateral`
+    represent the minimum (basin) and maximum (peak) energy stacking
+    configurations. Returns a tuple of the form (basin, peak). If the
+    grid was reduced by symmetry, only calculated directories are
+    returned.
     """
 
-    lattice = Structure.from_file('CONTCAR').lattice
+    dataset = dataset or FrictionDataset(directory)
+    return dataset.get_basin_and_peak()
+
 
-    n_divs_x = int(math.ceil(lattice.a * 2.5))
-    n_divs_y = int(math.ceil(lattice.b * 2.5))
+def plot_sliding_path(fmt='pdf', directory='.', dataset=None):
+    """
+    Plot the energy and lateral force along the minimum energy path
+    from the basin of the Gamma surface to its closest periodic image
+    (see FrictionDataset.get_sliding_path). The plot is saved in
+    directory/friction/lateral.
+    """
 
-    X_VALUES = range(n_divs_x)
-    Y_VALUES = range(n_divs_y)
+    dataset = dataset or FrictionDataset(directory)
+    surface, path = dataset.get_sliding_path()
+    distance, energy, force = get_path_profile(surface, path)
 
-    os.chdir('friction/lateral')
+    f, (ax1, ax2) = plt.subplots(2, figsize=(16, 16), sharex=True)
+    ax1.plot(distance, energy - energy[0], linewidth=8, color=plt.cm.jet(0))
+    ax2.plot(distance, force, linewidth=8, color=plt.cm.jet(0.9))
+    ax2.plot([distance[0], distance[-1]], [0, 0], '--', color='k')
+    ax2.set_xlim(distance[0], distance[-1])
 
-    abs_maximum = -10000
-    abs_minimum = 0
-    for x in X_VALUES:
-        for y in Y_VALUES:
-            dir = '{}x{}'.format(x, y)
-            os.chdir(dir)
-            try:
-                energy = Vasprun('vasprun.xml').final_energy
-                if energy < abs_minimum:
-                    basin = dir
-                    abs_minimum = energy
-                if energy > abs_maximum:
-                    peak = dir
-                    abs_maximum = energy
-            except:
-                pass
-            os.chdir('../')
-    os.chdir('../../')
+    ax1.set_yticklabels(ax1.get_yticks(), family='serif', fontsize=18)
+    ax2.set_xticklabels(ax2.get_xticks(), family='serif', fontsize=18)
+    ax2.set_yticklabels(ax2.get_yticks(), family='serif', fontsize=18)
+    ax1.set_ylabel(r'$\mathrm{E\/(eV)}$', family='serif', fontsize=24)
+    ax2.set_xlabel(r'$\mathrm{\Delta d\/(\AA)}$', family='serif', fontsize=24)
+    ax2.set_ylabel(r'$\mathrm{F_f\/(eV/\AA)}$', family='serif', fontsize=24)
 
-    return(basin, peak)
+    f.savefig(os.path.join(dataset.lateral_dir,
+                           'sliding_path.{}'.format(fmt)))
+    plt.close(f)
 
 
-def plot_friction_force(fmt='pdf'):
+def plot_friction_force(fmt='pdf', directory='.', dataset=None):
     """
     Plot the sinusoidal curve of delta E between basin and saddle
-    points for each normal spacing dz.
+    points for each normal spacing dz. The plot is saved in
+    directory/friction/normal.
     """
 
-    os.chdir('friction/normal')
+    dataset = dataset or FrictionDataset(directory)
+    spacings = dataset.spacings
+    amplitudes, bs = dataset.get_sinusoids()
 
     f, (ax1, ax2) = plt.subplots(2, figsize=(16, 16))
 
-    spacings = sorted([float(spc) for spc in os.listdir(os.getcwd()) if
-                       os.path.isdir(spc)])
-
     spc_range = spacings[-1] - spacings[0] + 0.1
 
-    for spacing in spacings:
-        os.chdir(str(spacing))
-        subdirectories = os.listdir(os.getcwd())
-
-        amplitude = abs(
-            Vasprun('{}/vasprun.xml'.format(subdirectories[0])).final_energy
-            - Vasprun('{}/vasprun.xml'.format(subdirectories[1])).final_energy
-            ) / 2
-
-        start_coords = Structure.from_file(
-            '{}/POSCAR'.format(subdirectories[0])
-            ).sites[-1].coords
-        end_coords = Structure.from_file(
-            '{}/POSCAR'.format(subdirectories[1])
-            ).sites[-1].coords
-        dist = np.sqrt(
-            (start_coords[0] - end_coords[0])**2
-            + (start_coords[1] - end_coords[1])**2)
-
-        b = (2 * np.pi) / (dist * 2)
-
-        x = np.arange(0, 4, 0.01)
-        sinx = [amplitude * np.sin(b * val) + amplitude for val in x]
-        cosx = [b * amplitude * np.cos(b * val)
-                if np.cos(b * val) > 0 else 0 for val in x]
+    x = np.arange(0, 4, 0.01)
+    for spacing, amplitude, b in zip(spacings, amplitudes, bs):
+        sinx = amplitude * np.sin(b * x) + amplitude
+        cosx = np.where(np.cos(b * x) > 0, b * amplitude * np.cos(b * x), 0)
 
         ax1.plot(x, sinx, linewidth=8,
                  color=plt.cm.jet(-(spacing - 4) / spc_range), label=spacing)
@@ -192,39 +619,32 @@ def plot_friction_force(fmt='pdf'):
         ax2.set_xlabel(r'$\mathrm{\Delta d\/(\AA)}$', family='serif',
             fontsize=24)
         ax2.set_ylabel(r'$\mathrm{F_f\/(eV/\AA)}$', family='serif', fontsize=24)
-        os.chdir('../')
 
     ax1.legend(loc='upper right')
     ax2.legend(loc='upper right')
-    plt.savefig('F_f.{}'.format(fmt))
-    os.chdir('../../')
+    f.savefig(os.path.join(dataset.normal_dir, 'F_f.{}'.format(fmt)))
+    plt.close(f)
 
 
-def plot_normal_force(basin_dir, fmt='pdf'):
+def plot_normal_force(basin_dir, fmt='pdf', directory='.', dataset=None):
     """
     Plot the LJ-like curve of the energy at the basin point
-    as a function of normal spacing dz.
+    as a function of normal spacing dz. The plot is saved in
+    directory/friction/normal.
     """
 
-    os.chdir('friction/normal')
-    spacings = [float(dir) for dir in os.listdir(os.getcwd()) if
-                os.path.isdir(dir)]
-    spacings.sort()
+    dataset = dataset or FrictionDataset(directory)
+    spacings = dataset.spacings
 
     fig = plt.figure(figsize=(16, 10))
     ax = fig.gca()
     ax2 = ax.twinx()
 
-    abs_E = [
-        Vasprun('{}/{}/vasprun.xml'.format(spacing, basin_dir)).final_energy
-        for spacing in spacings
-        ]
-    E = [energy - abs_E[-1] for energy in abs_E]
-
-    spline = interpolate.splrep(spacings, E, s=0)
-    xnew = np.arange(spacings[0], spacings[-1], 0.001)
-    ynew = interpolate.splev(xnew, spline, der=0)
-    ynew_slope = interpolate.splev(spacings, spline, der=1)
+    E = dataset.get_normal_energies(basin_dir)
+    curve = dataset.get_normal_curve(basin_dir)
+    normal_force = curve.get_force()
+    xnew = np.linspace(spacings[0], spacings[-1], 500)
+    ynew = curve.get_energy(xnew)
 
     ax.set_xlim(spacings[0], spacings[-1])
 
@@ -232,7 +652,7 @@ def plot_normal_force(basin_dir, fmt='pdf'):
     ax2.plot([spacings[0], spacings[-1]], [0, 0], '--', color=plt.cm.jet(0.9))
     E_z = ax.plot(xnew, ynew, color=plt.cm.jet(0),
                   linewidth=4, label=r'$\mathrm{E(z)}$')
-    F_N = ax2.plot(spacings, [-y for y in ynew_slope], color=plt.cm.jet(0.9),
+    F_N = ax2.plot(spacings, normal_force, color=plt.cm.jet(0.9),
                    linewidth=4, label=r'$\mathrm{F_N}$')
 
     ax.set_ylim(ax.get_ylim())
@@ -253,139 +673,96 @@ def plot_normal_force(basin_dir, fmt='pdf'):
     ax.plot(spacings, E, linewidth=0, marker='o', color=plt.cm.jet(0),
             markersize=10, markeredgecolor='none')
 
-    plt.savefig('F_N.{}'.format(fmt))
-
-    os.chdir('../../')
+    fig.savefig(os.path.join(dataset.normal_dir, 'F_N.{}'.format(fmt)))
+    plt.close(fig)
 
 
-def plot_mu_vs_F_N(basin_dir, fmt='pdf'):
+def plot_mu_vs_F_N(basin_dir, fmt='pdf', directory='.', dataset=None,
+                   model='sinusoid'):
     """
-    Plot friction coefficient 'mu' vs. F_Normal.
-    mu = F_friction / F_Normal
+    Plot friction coefficient 'mu' vs. F_Normal, saved in directory.
+    mu = F_friction / F_Normal. See FrictionDataset.get_mu_vs_F_N for
+    the friction models.
     """
 
-    fig = plt.figure(figsize=(16, 10))
-    ax = fig.gca()
-    ax2 = ax.twinx()
-
-    os.chdir('friction/normal')
-    spacings = [float(dir) for dir in os.listdir(os.getcwd()) if
-                os.path.isdir(dir)]
-    spacings.sort()
-
-    abs_E = [
-        Vasprun('{}/{}/vasprun.xml'.format(spacing, basin_dir)).final_energy
-        for spacing in spacings
-        ]
-    E = [energy - abs_E[-1] for energy in abs_E]
-
-    spline = interpolate.splrep(spacings, E, s=0)
-    xnew = np.arange(spacings[0], spacings[-1], 0.001)
-    ynew = interpolate.splev(xnew, spline, der=0)
-    ynew_slope = interpolate.splev(spacings, spline, der=1)
-    F_N = [-y * 1.602 for y in ynew_slope]
-
-    os.chdir('../../friction/normal')
-
-    F_f = []
-
-    for spacing in sorted([float(spc) for spc in os.listdir(os.getcwd()) if
-            os.path.isdir(spc)]):
-        os.chdir(str(spacing))
-        subdirectories = os.listdir(os.getcwd())
-
-        amplitude = abs(
-            Vasprun('{}/vasprun.xml'.format(subdirectories[0])).final_energy
-            - Vasprun('{}/vasprun.xml'.format(subdirectories[1])).final_energy
-            ) / 2
-
-        start_coords = Structure.from_file(
-            '{}/POSCAR'.format(subdirectories[0])
-            ).sites[-1].coords
-        end_coords = Structure.from_file(
-            '{}/POSCAR'.format(subdirectories[1])
-            ).sites[-1].coords
-        dist = np.sqrt(
-            (start_coords[0] - end_coords[0])**2
-            + (start_coords[1] - end_coords[1])**2)
-
-        b = (2 * np.pi) / (dist * 2)
-
-        x = np.arange(0, 4, 0.01)
-        sinx = [amplitude * np.sin(b * val) + amplitude for val in x]
-        cosx = [b * amplitude * np.cos(b * val)
-                if np.cos(b * val) > 0 else 0 for val in x]
-        F_f.append(max(cosx) * 1.602)
-        os.chdir('../')
-
-    os.chdir('../../')
-
-    mu = [f / N for f, N in zip(F_f, F_N)]
+    mu_vs_F_N = get_mu_vs_F_N(basin_dir, directory, dataset, model)
 
     ax = plt.figure().gca()
-    ax.plot(F_N, mu, linewidth=2, marker='o', markeredgecolor='none',
-            markersize=3, color=plt.cm.jet(0))
-    plt.savefig('mu_vs_F_N.{}'.format(fmt))
+    ax.plot(mu_vs_F_N['F_N'], mu_vs_F_N['mu'], linewidth=2, marker='o',
+            markeredgecolor='none', markersize=3, color=plt.cm.jet(0))
+    ax.figure.savefig(os.path.join(directory, 'mu_vs_F_N.{}'.format(fmt)))
+    plt.close(ax.figure)
 
 
-def get_mu_vs_F_N(basin_dir):
+def get_mu_vs_F_N(basin_dir, directory='.', dataset=None, model='sinusoid'):
     """
     Essentially the same function as plotting, but without the plot.
-    Returns {'F_N': F_N, 'mu': mu}. F_N is in units of nN.
+    Returns {'F_N': F_N, 'F_f': F_f, 'mu': mu}. The forces are in
+    units of nN.
     """
 
-    os.chdir('friction/normal')
-    spacings = [float(dir) for dir in os.listdir(os.getcwd()) if
-                os.path.isdir(dir)]
-    spacings.sort()
-
-    abs_E = [
-        Vasprun('{}/{}/vasprun.xml'.format(spacing, basin_dir)).final_energy
-        for spacing in spacings
-        ]
-    E = [energy - abs_E[-1] for energy in abs_E]
+    dataset = dataset or FrictionDataset(directory)
+    return dataset.get_mu_vs_F_N(basin_dir, model)
 
-    spline = interpolate.splrep(spacings, E, s=0)
-    xnew = np.arange(spacings[0], spacings[-1], 0.001)
-    ynew = interpolate.splev(xnew, spline, der=0)
-    ynew_slope = interpolate.splev(spacings, spline, der=1)
-    F_N = [-y * 1.602 for y in ynew_slope]
 
-    os.chdir('../../friction/normal')
+def _get_friction_rows(args):
+    directory, model = args
+    try:
+        dataset = FrictionDataset(directory)
+        basin = dataset.get_basin_and_peak()[0]
+        mu_vs_F_N = dataset.get_mu_vs_F_N(basin, model)
+        return [[directory, spacing, F_N, F_f, mu, ''] for spacing, F_N, F_f, mu
+                in zip(dataset.spacings, mu_vs_F_N['F_N'],
+                       mu_vs_F_N['F_f'], mu_vs_F_N['mu'])]
+    except Exception as error:
+        return [[directory, np.nan, np.nan, np.nan, np.nan,
+                 '{}: {}'.format(type(error).__name__, error)]]
 
-    F_f = []
 
-    for spacing in sorted([float(spc) for spc in os.listdir(os.getcwd()) if
-            os.path.isdir(spc)]):
-        os.chdir(str(spacing))
-        subdirectories = os.listdir(os.getcwd())
-
-        amplitude = abs(
-            Vasprun('{}/vasprun.xml'.format(subdirectories[0])).final_energy
-            - Vasprun('{}/vasprun.xml'.format(subdirectories[1])).final_energy
-            ) / 2
+def get_friction_table(directories, model='sinusoid', n_workers=8):
+    """
+    Screen the friction of many materials at once, each in its own
+    process out of a pool of n_workers. Returns a table as
+    {column: array}, with the columns in FRICTION_TABLE_COLUMNS and
+    one row per material and spacing. A material that can't be
+    analyzed gets a single row of NaNs with the reason in 'error'
+    (which is otherwise empty) instead of stopping the others.
+
+    args:
+        directories: the materials' directories (each containing
+                     CONTCAR and friction/).
+        model: passed on to FrictionDataset.get_mu_vs_F_N.
+    """
 
-        start_coords = Structure.from_file(
-            '{}/POSCAR'.format(subdirectories[0])
-            ).sites[-1].coords
-        end_coords = Structure.from_file(
-            '{}/POSCAR'.format(subdirectories[1])
-            ).sites[-1].coords
-        dist = np.sqrt(
-            (start_coords[0] - end_coords[0])**2
-            + (start_coords[1] - end_coords[1])**2)
+    directories = list(directories)
+    n_workers = max(1, min(n_workers, len(directories)))
+    pool = Pool(n_workers)
+    try:
+        results = pool.map(_get_friction_rows,
+                           [(directory, model) for directory in directories])
+    finally:
+        pool.close()
+        pool.join()
 
-        b = (2 * np.pi) / (dist * 2)
+    rows = [row for material_rows in results for row in material_rows]
+    columns = zip(*rows) if rows else [[]] * len(FRICTION_TABLE_COLUMNS)
+    table = dict(zip(FRICTION_TABLE_COLUMNS,
+                     [np.array(column) for column in columns]))
+    for name in ['spacing', 'F_N', 'F_f', 'mu']:
+        table[name] = table[name].astype(float)
 
-        x = np.arange(0, 4, 0.01)
-        sinx = [amplitude * np.sin(b * val) + amplitude for val in x]
-        cosx = [b * amplitude * np.cos(b * val)
-                if np.cos(b * val) > 0 else 0 for val in x]
-        F_f.append(max(cosx) * 1.602)
-        os.chdir('../')
+    return table
 
-    os.chdir('../../')
 
-    mu = [f / N for f, N in zip(F_f, F_N)]
+def write_friction_table(table, filename='friction.csv'):
+    """
+    Write a table from get_friction_table to a CSV file, one column per
+    entry in FRICTION_TABLE_COLUMNS.
+    """
 
-    return({'F_N': F_N, 'mu': mu})
+    with open(filename, 'w') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(FRICTION_TABLE_COLUMNS)
+        for row in zip(*[table[name] for name in FRICTION_TABLE_COLUMNS]):
+            writer.writerow([repr(float(value)) if isinstance(value, float)
+                             else value for value in row])
@@ -0,0 +1,214 @@
+"""
+A smooth, periodic model of the Gamma surface (a Fourier series fit to
+the whole grid) and the minimum energy path that one layer follows when
+it slides over the other, from which the maximum lateral (friction)
+force comes out analytically instead of from a sinusoid through two
+points.
+"""
+
+import numpy as np
+
+
+# Lattice translations (in fractional coordinates) tried as sliding
+# directions by get_sliding_path.
+SLIDING_TRANSLATIONS = [(1, 0), (0, 1), (1, 1), (1, -1)]
+
+
+class FourierSurface():
+
+    def __init__(self, energies, matrix, n_harmonics=None):
+        '''
+        Fit a Fourier series to a Gamma surface.
+
+        args:
+            energies: (n_divs_x, n_divs_y) array of energies (eV) on a
+                      regular grid of fractional shifts, without any
+                      missing points (see fill_gamma_energies).
+            matrix: 2x2 array whose rows are the in-plane lattice
+                    vectors a and b (Angstroms).
+            n_harmonics: highest harmonic kept along each lattice
+                         vector. By default every harmonic below the
+                         grid's Nyquist frequency is kept, so the series
+                         passes through (odd grids) or very nearly
+                         through (even grids) every grid point.
+        '''
+
+        energies = np.asarray(energies, dtype=float)
+        n_divs_x, n_divs_y = energies.shape
+        self._matrix = np.asarray(matrix, dtype=float)[:2, :2]
+        self._inv_matrix = np.linalg.inv(self._matrix)
+
+        k = np.fft.fftfreq(n_divs_x, 1.0 / n_divs_x)
+        l = np.fft.fftfreq(n_divs_y, 1.0 / n_divs_y)
+        coefficients = np.fft.fft2(energies) / energies.size
+        keep = np.outer(2 * np.abs(k) < n_divs_x, 2 * np.abs(l) < n_divs_y)
+        if n_harmonics is not None:
+            keep &= np.outer(np.abs(k) <= n_harmonics,
+                             np.abs(l) <= n_harmonics)
+        self._coefficients = np.where(keep, coefficients, 0)
+        self._k = k
+        self._l = l
+
+    def _get_phases(self, frac_coords):
+        frac_coords = np.atleast_2d(frac_coords)
+        return (np.exp(2j * np.pi * np.outer(frac_coords[:, 0], self._k)),
+                np.exp(2j * np.pi * np.outer(frac_coords[:, 1], self._l)))
+
+    def get_energy(self, frac_coords):
+        '''
+        Returns the energy (eV) at each of the fractional shifts in
+        frac_coords (an (n, 2) array).
+        '''
+
+        u, v = self._get_phases(frac_coords)
+        return np.einsum('nk,kl,nl->n', u, self._coefficients, v).real
+
+    def get_gradient(self, frac_coords):
+        '''
+        Returns the gradient of the energy with respect to the
+        cartesian in-plane shift (eV/Angstrom) at each of the
+        fractional shifts in frac_coords, as an (n, 2) array.
+        '''
+
+        u, v = self._get_phases(frac_coords)
+        du = np.einsum('nk,kl,nl->n', u * (2j * np.pi * self._k),
+                       self._coefficients, v).real
+        dv = np.einsum('nk,kl,nl->n', u, self._coefficients,
+                       v * (2j * np.pi * self._l)).real
+        return np.dot(np.column_stack([du, dv]), self._inv_matrix.T)
+
+    def get_curvature_bound(self):
+        '''
+        Returns an upper bound (eV/Angstrom^2) on the curvature of the
+        surface in any direction, which sets a step size that gradient
+        descent on it can always take safely.
+        '''
+
+        k, l = np.meshgrid(self._k, self._l, indexing='ij')
+        wavevectors = 2 * np.pi * np.dot(
+            np.column_stack([k.ravel(), l.ravel()]), self._inv_matrix.T)
+        return max(np.sum(np.abs(self._coefficients.ravel())
+                          * np.sum(wavevectors**2, axis=1)), 1e-12)
+
+    def to_cartesian(self, frac_coords):
+        return np.dot(frac_coords, self._matrix)
+
+    def to_fractional(self, cart_coords):
+        return np.dot(cart_coords, self._inv_matrix)
+
+
+def relax_shift(surface, frac_coords, max_steps=10000, tolerance=1e-6):
+    '''
+    Returns the local minimum of surface (a FourierSurface) reached by
+    steepest descent from the fractional shift frac_coords.
+    '''
+
+    step = 1 / surface.get_curvature_bound()
+    position = surface.to_cartesian(np.atleast_2d(frac_coords))
+    for i in range(max_steps):
+        displacement = -step * surface.get_gradient(
+            surface.to_fractional(position))
+        position += displacement
+        if np.abs(displacement).max() < tolerance:
+            break
+
+    return surface.to_fractional(position)[0]
+
+
+def _redistribute(images):
+    '''
+    Returns images (an (n, 2) array of cartesian positions) moved
+    along the path they trace so that they are equally spaced.
+    '''
+
+    lengths = np.hypot(*np.diff(images, axis=0).T)
+    arc = np.concatenate([[0], np.cumsum(lengths)])
+    even = np.linspace(0, arc[-1], len(images))
+    return np.column_stack([np.interp(even, arc, images[:, 0]),
+                            np.interp(even, arc, images[:, 1])])
+
+
+def get_minimum_energy_path(surface, start, translation, n_images=41,
+                            max_steps=10000, tolerance=1e-6):
+    '''
+    Returns the minimum energy path (an (n_images, 2) array of
+    fractional shifts) on surface from start to its periodic image
+    start + translation, found with the string method: all images
+    take a steepest descent step at once and are then spread out
+    evenly along the path again, until they stop moving. start should
+    be a minimum (see relax_shift).
+    '''
+
+    start = np.asarray(start, dtype=float)
+    end = start + np.asarray(translation, dtype=float)
+    step = 1 / surface.get_curvature_bound()
+
+    images = surface.to_cartesian(
+        start + np.linspace(0, 1, n_images)[:, np.newaxis] * (end - start))
+    for i in range(max_steps):
+        gradient = surface.get_gradient(surface.to_fractional(images))
+        gradient[[0, -1]] = 0
+        new_images = _redistribute(images - step * gradient)
+        converged = np.abs(new_images - images).max() < tolerance
+        images = new_images
+        if converged:
+            break
+
+    return surface.to_fractional(images)
+
+
+def get_path_profile(surface, path, n_points_per_image=10):
+    '''
+    Returns (distance, energy, force) along path (an (n, 2) array of
+    fractional shifts) on surface, sampled n_points_per_image times
+    between each pair of images: distance (Angstroms) slid from the
+    start, the energy (eV) and the lateral force (eV/Angstrom) needed
+    to keep sliding, dE/d(distance).
+    '''
+
+    images = surface.to_cartesian(path)
+    segments = np.diff(images, axis=0)
+    lengths = np.hypot(*segments.T)
+    tangents = segments / lengths[:, np.newaxis]
+
+    t = np.arange(n_points_per_image, dtype=float) / n_points_per_image
+    points = (images[:-1, np.newaxis] + t[:, np.newaxis]
+              * segments[:, np.newaxis]).reshape(-1, 2)
+    points = np.vstack([points, images[-1:]])
+    segment_index = np.minimum(np.arange(len(points)) // n_points_per_image,
+                               len(segments) - 1)
+
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    distance = np.append(
+        (starts[:, np.newaxis] + t * lengths[:, np.newaxis]).ravel(),
+        lengths.sum())
+
+    frac_points = surface.to_fractional(points)
+    force = np.sum(surface.get_gradient(frac_points)
+                   * tangents[segment_index], axis=1)
+
+    return distance, surface.get_energy(frac_points), force
+
+
+def get_sliding_path(surface, start, translations=SLIDING_TRANSLATIONS,
+                     n_images=41):
+    '''
+    Relax start (a fractional shift, usually the basin of the Gamma
+    surface) to the nearest minimum and return the minimum energy path
+    from it to whichever of its periodic images (start + each of
+    translations) can be reached over the lowest barrier.
+    '''
+
+    start = relax_shift(surface, start)
+    paths = [get_minimum_energy_path(surface, start, translation, n_images)
+             for translation in translations]
+    return min(paths, key=lambda path: surface.get_energy(path).max())
+
+
+def get_max_lateral_force(surface, path):
+    '''
+    Returns the largest force (eV/Angstrom) that has to be overcome
+    to slide along path (see get_sliding_path) on surface.
+    '''
+
+    return get_path_profile(surface, path)[2].max()
@@ -1,15 +1,22 @@
 import os
 
+import shutil
+
 import math
 
-import numpy as np
+import json
 
-from monty.serialization import loadfn
+import numpy as np
 
 import twod_materials.utils as utl
+from twod_materials.friction.analysis import (
+    GAMMA_MAP_FILENAME, GAMMA_REFINEMENT_FILENAME, read_gamma_map,
+    get_grid_indices, get_basin_and_peak, get_refinement_points,
+    is_refinement_converged)
 
 from pymatgen.core.structure import Structure
-from pymatgen.io.vasp.inputs import Incar
+from pymatgen.io.vasp.inputs import Incar, Poscar
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
 
 import twod_materials
 
@@ -23,168 +30,323 @@ if '/ufrc/' in os.getcwd():
 elif '/scratch/' in os.getcwd():
     HIPERGATOR = 1
 
-VASP = loadfn(os.path.join(os.path.expanduser('~'),
-                           'config.yaml'))['normal_binary']
 
+def get_gamma_coords(structure, n_sites_per_layer, n_divs_x, n_divs_y):
+    """
+    Returns (names, frac_coords) for every point of an n_divs_x by
+    n_divs_y grid of lateral shifts of the top layer of a bilayer
+    structure (whose first n_sites_per_layer sites are the bottom
+    layer). names are the grid points' directory names ('XxY'), and
+    frac_coords[i] is the shifted copy of structure.frac_coords for
+    names[i], all computed in one pass.
+    """
+
+    grid = np.mgrid[0:n_divs_x, 0:n_divs_y].reshape(2, -1).T
+    names = ['{}x{}'.format(x, y) for x, y in grid]
+
+    frac_coords = np.tile(structure.frac_coords, (len(grid), 1, 1))
+    frac_coords[:, n_sites_per_layer:, :2] += (
+        grid / np.array([float(n_divs_x), float(n_divs_y)]))[:, np.newaxis, :]
 
-def run_gamma_calculations(submit=True):
+    return names, frac_coords
+
+
+def get_gamma_map(structure, n_divs_x, n_divs_y, symprec=0.1):
     """
-    Setup a 2D grid of static energy calculations to plot the Gamma
-    surface between two layers of the 2D material.
+    Returns {grid point: representative grid point} for an n_divs_x by
+    n_divs_y grid of lateral shifts of the top layer of a bilayer of
+    structure (a single layer).
+
+    Applying any symmetry operation of the layer that leaves z alone
+    to the whole bilayer keeps the bottom layer in place and turns a
+    shift s of the top layer into R.s, so the two shifts have the same
+    energy. Every operation that maps the grid onto itself is used,
+    and each grid point is represented by the first point of its orbit
+    (in the order the grid is set up), so '0x0' always represents
+    itself.
     """
 
-    if not os.path.isdir('friction'):
-        os.mkdir('friction')
-    os.chdir('friction')
+    n_divs = np.array([n_divs_x, n_divs_y])
+    grid = np.mgrid[0:n_divs_x, 0:n_divs_y].reshape(2, -1).T
+    names = ['{}x{}'.format(x, y) for x, y in grid]
+
+    images = []
+    for op in SpacegroupAnalyzer(
+            structure, symprec).get_symmetry_operations(cartesian=False):
+        rotation = np.round(op.rotation_matrix).astype(int)
+        if rotation[2][2] != 1 or rotation[:2, 2].any() or \
+                rotation[2, :2].any():
+            continue
+        image = (grid / n_divs.astype(float)).dot(rotation[:2, :2].T) * n_divs
+        if np.allclose(image, np.round(image), atol=1e-6):
+            images.append(np.round(image).astype(int) % n_divs)
+
+    gamma_map = {}
+    for i, name in enumerate(names):
+        if name not in gamma_map:
+            for image in images:
+                gamma_map.setdefault('{}x{}'.format(*image[i]), name)
+
+    return gamma_map
 
-    if not os.path.isdir('lateral'):
-        os.mkdir('lateral')
-    os.chdir('lateral')
 
-    os.system('cp ../../CONTCAR POSCAR')
+def run_gamma_calculations(submit=True, directory='.', use_symmetry=False,
+                           stride=1):
+    """
+    Setup a 2D grid of static energy calculations to plot the Gamma
+    surface between two layers of the 2D material. directory should
+    contain the relaxed material's CONTCAR, INCAR and KPOINTS, and the
+    grid is set up in directory/friction/lateral.
+
+    The INCAR, KPOINTS, POTCAR and vdw_kernel.bindat are identical for
+    every grid point, so they're written once to friction/lateral and
+    linked into each grid point's directory.
+
+    With use_symmetry=True, only one grid point from each set of
+    symmetry-equivalent shifts (see get_gamma_map) is calculated, and
+    the mapping is saved to friction/lateral/gamma_map.json for the
+    functions in friction.analysis to fill in the rest of the grid.
+
+    With stride > 1, only every stride-th grid point along each axis is
+    calculated to begin with, and refine_gamma_calculations() adds
+    points where they're needed.
+    """
+
+    friction_dir = os.path.join(directory, 'friction')
+    if not os.path.isdir(friction_dir):
+        os.mkdir(friction_dir)
+
+    lateral_dir = os.path.join(friction_dir, 'lateral')
+    if not os.path.isdir(lateral_dir):
+        os.mkdir(lateral_dir)
 
     # Pad the bottom layer with 20 Angstroms of vacuum.
-    utl.add_vacuum(20 - utl.get_spacing(), 0.8)
-    structure = Structure.from_file('POSCAR')
+    structure = utl.set_structure_vacuum(
+        Poscar.from_file(os.path.join(directory, 'CONTCAR')).structure,
+        20, 0.8)
     n_sites_per_layer = structure.num_sites
 
     n_divs_x = int(math.ceil(structure.lattice.a * 2.5))
     n_divs_y = int(math.ceil(structure.lattice.b * 2.5))
 
-    # Get the thickness of the material.
-    max_height = max([site.coords[2] for site in structure.sites])
-    min_height = min([site.coords[2] for site in structure.sites])
-    thickness = max_height - min_height
-
-    # Make a new layer.
-    new_sites = []
-    for site in structure.sites:
-        new_sites.append((site.specie,
-                          [site.coords[0], site.coords[1],
-                           site.coords[2] + thickness + 3.5]))
-
-    for site in new_sites:
-        structure.append(site[0], site[1], coords_are_cartesian=True)
-
-    structure.to('POSCAR', 'POSCAR')
-
-    for x in range(n_divs_x):
-        for y in range(n_divs_y):
-            dir = '{}x{}'.format(x, y)
-
-            if not os.path.isdir(dir):
-                os.mkdir(dir)
-
-            # Copy input files
-            os.chdir(dir)
-            os.system('cp ../../../INCAR .')
-            os.system('cp ../../../KPOINTS .')
-            os.system('cp ../POSCAR .')
-            os.system('cp {} .'.format(KERNEL_PATH))
-
-            utl.write_potcar()
-            incar_dict = Incar.from_file('INCAR').as_dict()
-            incar_dict.update({'NSW': 0, 'LAECHG': False, 'LCHARG': False,
-                               'LWAVE': False})
-            incar_dict.pop('NPAR', None)
-            Incar.from_dict(incar_dict).write_file('INCAR')
-
-            # Shift the top layer
-            poscar_lines = open('POSCAR').readlines()
-            with open('POSCAR', 'w') as poscar:
-                for line in poscar_lines[:8 + n_sites_per_layer]:
-                    poscar.write(line)
-                for line in poscar_lines[8 + n_sites_per_layer:]:
-                    split_line = line.split()
-                    new_coords = [
-                        float(split_line[0]) + float(x)/float(n_divs_x),
-                        float(split_line[1]) + float(y)/float(n_divs_y),
-                        float(split_line[2])]
-                    poscar.write(' '.join([str(i) for i in new_coords])
-                                 + '\n')
+    gamma_map_file = os.path.join(lateral_dir, GAMMA_MAP_FILENAME)
+    if use_symmetry:
+        gamma_map = get_gamma_map(structure, n_divs_x, n_divs_y)
+        with open(gamma_map_file, 'w') as f:
+            json.dump(gamma_map, f, indent=1, sort_keys=True)
+    elif os.path.exists(gamma_map_file):
+        os.remove(gamma_map_file)
+
+    # Make a new layer 3.5 Angstroms above the top of the material.
+    cart_coords = structure.cart_coords
+    thickness = cart_coords[:, 2].max() - cart_coords[:, 2].min()
+    structure = Structure(
+        structure.lattice, structure.species * 2,
+        np.vstack([cart_coords, cart_coords + [0, 0, thickness + 3.5]]),
+        coords_are_cartesian=True)
+
+    # Shared input files
+    utl.write_structure(structure, os.path.join(lateral_dir, 'POSCAR'))
+    shutil.copy(os.path.join(directory, 'KPOINTS'), lateral_dir)
+    utl.write_potcar(directory=lateral_dir)
+    incar_dict = Incar.from_file(os.path.join(directory, 'INCAR')).as_dict()
+    incar_dict.update({'NSW': 0, 'LAECHG': False, 'LCHARG': False,
+                       'LWAVE': False})
+    incar_dict.pop('NPAR', None)
+    Incar.from_dict(incar_dict).write_file(os.path.join(lateral_dir, 'INCAR'))
+
+    names = ['{}x{}'.format(x, y) for x in range(0, n_divs_x, stride)
+             for y in range(0, n_divs_y, stride)]
+    if use_symmetry:
+        names = sorted(set(gamma_map[name] for name in names),
+                       key=get_grid_indices)
+    refinement_file = os.path.join(lateral_dir, GAMMA_REFINEMENT_FILENAME)
+    if os.path.exists(refinement_file):
+        os.remove(refinement_file)
+
+    _setup_gamma_points(names, lateral_dir, submit)
+
+
+def _setup_gamma_points(names, lateral_dir, submit=True):
+    """
+    Set up the calculations for the grid points in names, using the
+    bilayer POSCAR and shared input files in lateral_dir.
+    """
 
-            if HIPERGATOR == 1:
-                utl.write_pbs_runjob(dir, 1, 4, '400mb', '1:00:00', VASP)
-                submission_command = 'qsub runjob'
+    structure = Structure.from_file(os.path.join(lateral_dir, 'POSCAR'))
+    n_divs_x = int(math.ceil(structure.lattice.a * 2.5))
+    n_divs_y = int(math.ceil(structure.lattice.b * 2.5))
+    all_names, frac_coords = get_gamma_coords(
+        structure, structure.num_sites // 2, n_divs_x, n_divs_y)
+    shared_files = [os.path.join(lateral_dir, filename)
+                    for filename in ['INCAR', 'KPOINTS', 'POTCAR']]
+    shared_files.append(KERNEL_PATH)
 
-            elif HIPERGATOR == 2:
-                utl.write_slurm_runjob(dir, 4, '400mb', '1:00:00', VASP)
-                submission_command = 'sbatch runjob'
+    vasp = utl.get_config_value('normal_binary')
+    for dir in names:
+        grid_dir = os.path.join(lateral_dir, dir)
+        if not os.path.isdir(grid_dir):
+            os.mkdir(grid_dir)
 
-            if submit:
-                os.system(submission_command)
+        for path in shared_files:
+            utl.link_file(path, os.path.join(grid_dir,
+                                             os.path.basename(path)))
+
+        # Shift the top layer
+        utl.write_structure(structure, os.path.join(grid_dir, 'POSCAR'),
+                            frac_coords=frac_coords[all_names.index(dir)])
+
+        if HIPERGATOR == 1:
+            utl.write_pbs_runjob(dir, 1, 4, '400mb', '1:00:00', vasp,
+                                 grid_dir)
+            submission_command = 'qsub runjob'
+
+        elif HIPERGATOR == 2:
+            utl.write_slurm_runjob(dir, 4, '400mb', '1:00:00', vasp,
+                                   grid_dir)
+            submission_command = 'sbatch runjob'
+
+        if submit:
+            utl.submit_runjob(submission_command, grid_dir)
+
+
+def refine_gamma_calculations(submit=True, directory='.', tolerance=0.001):
+    """
+    Adaptively add points to a Gamma surface grid set up with
+    run_gamma_calculations(stride=...) in directory/friction/lateral.
+
+    Once every calculation set up so far has finished, the surface is
+    interpolated from them and new calculations are set up around its
+    basin and peak and where it's steepest (see
+    friction.analysis.get_refinement_points). Call this repeatedly
+    (e.g. from a CampaignMonitor stage); refinement stops once the
+    calculated basin and peak energies change by less than tolerance
+    (eV) from one round to the next.
+
+    Returns the list of grid points that were set up, which is empty
+    once refinement is finished, or None if calculations from the last
+    round are still running.
+    """
+
+    lateral_dir = os.path.join(directory, 'friction', 'lateral')
+    lattice = Structure.from_file(os.path.join(lateral_dir, 'POSCAR')).lattice
+    n_divs_x = int(math.ceil(lattice.a * 2.5))
+    n_divs_y = int(math.ceil(lattice.b * 2.5))
+    gamma_map = read_gamma_map(lateral_dir, n_divs_x, n_divs_y)
+
+    calculated = [dir for dir in set(gamma_map.values())
+                  if os.path.isdir(os.path.join(lateral_dir, dir))]
+    scan = utl.scan_directories([os.path.join(lateral_dir, dir)
+                                 for dir in calculated])
+    if any(result['final_energy'] is None for result in scan.values()):
+        return None
+
+    energies = dict(
+        [(name, scan[os.path.join(lateral_dir, dir)]['final_energy'])
+         for name, dir in gamma_map.items() if dir in calculated])
+
+    refinement_file = os.path.join(lateral_dir, GAMMA_REFINEMENT_FILENAME)
+    history = []
+    if os.path.exists(refinement_file):
+        with open(refinement_file) as f:
+            history = json.load(f)
+    if not history or history[-1][4] != len(energies):
+        history.append(get_basin_and_peak(energies))
+        with open(refinement_file, 'w') as f:
+            json.dump(history, f)
+
+    if is_refinement_converged(history, tolerance):
+        return []
+
+    new_points = sorted(
+        set(gamma_map[name] for name in get_refinement_points(
+            energies, n_divs_x, n_divs_y)) - set(calculated),
+        key=get_grid_indices)
+    _setup_gamma_points(new_points, lateral_dir, submit)
+
+    return new_points
+
+
+def get_normal_coords(structure, spacings):
+    """
+    Returns an (n_spacings, n_sites, 3) array of the fractional
+    coordinates of a bilayer structure (whose second half of sites is
+    the top layer) with the top layer moved up or down so that the gap
+    between the layers is each of spacings (Angstroms), all computed in
+    one pass.
+    """
+
+    cart_coords = structure.cart_coords
+    n_sites_per_layer = structure.num_sites // 2
+    gap = cart_coords[n_sites_per_layer:, 2].min() - \
+        cart_coords[:n_sites_per_layer, 2].max()
 
-            os.chdir('../')
+    all_coords = np.tile(cart_coords, (len(spacings), 1, 1))
+    all_coords[:, n_sites_per_layer:, 2] += (
+        np.asarray(spacings, dtype=float) - gap)[:, np.newaxis]
 
-    os.chdir('../../')
+    return structure.lattice.get_fractional_coords(
+        all_coords.reshape(-1, 3)).reshape(all_coords.shape)
 
 
 def run_normal_force_calculations(basin_and_saddle_dirs,
                                   spacings=np.arange(1.5, 4.25, 0.25),
-                                  submit=True):
+                                  submit=True, directory='.'):
     """
     Set up and run static calculations of the basin directory
     and saddle directory (specified as a tuple) at specified
     interlayer spacings (by default, between 1.5 and 4 Angstroms)
-    to get f_N and f_F.
+    to get f_N and f_F. The calculations are set up in
+    directory/friction/normal.
     ex.
         run_normal_force_calculations(('0x0', '3x6'))
     or
         run_normal_force_calculations(get_basin_and_peak_locations())
-    """
-
-    spacings = [str(spc) for spc in spacings]
-
-    os.chdir('friction')
-    if not os.path.isdir('normal'):
-        os.mkdir('normal')
-    os.chdir('normal')
-
-    for spacing in spacings:
-        if not os.path.isdir(spacing):
-            os.mkdir(spacing)
-
-        for subdirectory in basin_and_saddle_dirs:
-
-            os.system('cp -r ../lateral/{} {}/'.format(subdirectory, spacing))
 
-            os.chdir('{}/{}'.format(spacing, subdirectory))
-            structure = Structure.from_file('POSCAR')
-            n_sites = len(structure.sites)
-            top_layer = structure.sites[n_sites / 2:]
-            bottom_of_top_layer = min(
-                [z_coord for z_coord in [site.coords[2] for site in top_layer]])
-
-            remove_indices = range(n_sites / 2, n_sites)
-
-            structure.remove_sites(remove_indices)
-            max_height = max([site.coords[2] for site in structure.sites])
-
-            for site in top_layer:
-                structure.append(
-                    site.specie,
-                    [site.coords[0],
-                     site.coords[1],
-                     site.coords[2] - bottom_of_top_layer
-                     + max_height + float(spacing)],
-                     coords_are_cartesian=True
-                    )
+    Each stacking's POSCAR is read once and the POSCARs for every
+    spacing are written from it directly. The other input files are
+    the same at every spacing, so they're linked from the stacking's
+    directory in friction/lateral instead of copied.
+    """
 
-            structure.to('POSCAR', 'POSCAR')
+    lateral_dir = os.path.join(directory, 'friction', 'lateral')
+    normal_dir = os.path.join(directory, 'friction', 'normal')
+    if not os.path.isdir(normal_dir):
+        os.mkdir(normal_dir)
+
+    vasp = utl.get_config_value('normal_binary')
+    for subdirectory in basin_and_saddle_dirs:
+        stacking_dir = os.path.join(lateral_dir, subdirectory)
+        structure = Poscar.from_file(
+            os.path.join(stacking_dir, 'POSCAR')).structure
+        all_frac_coords = get_normal_coords(structure, spacings)
+        shared_files = [os.path.join(stacking_dir, filename) for filename
+                        in ['INCAR', 'KPOINTS', 'POTCAR', 'vdw_kernel.bindat']
+                        if os.path.exists(os.path.join(stacking_dir,
+                                                       filename))]
+
+        for spacing, frac_coords in zip(spacings, all_frac_coords):
+            spacing = str(spacing)
+            spacing_dir = os.path.join(normal_dir, spacing, subdirectory)
+            if not os.path.isdir(spacing_dir):
+                os.makedirs(spacing_dir)
+
+            for path in shared_files:
+                utl.link_file(path, os.path.join(spacing_dir,
+                                                 os.path.basename(path)))
+            utl.write_structure(structure,
+                                os.path.join(spacing_dir, 'POSCAR'),
+                                frac_coords=frac_coords)
 
             if HIPERGATOR == 1:
                 utl.write_pbs_runjob('{}_{}'.format(subdirectory, spacing), 1,
-                    4, '400mb', '1:00:00', VASP)
+                    4, '400mb', '1:00:00', vasp, spacing_dir)
                 submission_command = 'qsub runjob'
 
             elif HIPERGATOR == 2:
                 utl.write_slurm_runjob('{}_{}'.format(subdirectory, spacing), 4,
-                    '400mb', '1:00:00', VASP)
+                    '400mb', '1:00:00', vasp, spacing_dir)
                 submission_command = 'sbatch runjob'
 
             if submit:
-                os.system(submission_command)
-
-            os.chdir('../../')
-
-    os.chdir('../../')
+                utl.submit_runjob(submission_command, spacing_dir)
@@ -0,0 +1,279 @@
+import unittest
+
+import os
+
+import math
+
+import json
+
+import shutil
+
+import tempfile
+
+import numpy as np
+
+from scipy import interpolate
+
+from monty.json import MontyEncoder
+
+import matplotlib.pyplot as plt
+
+import twod_materials
+import twod_materials.friction.analysis as fa
+from twod_materials.utils import (set_structure_vacuum, get_fingerprint,
+                                  CACHE_FILENAME)
+from twod_materials.friction.startup import get_gamma_map, get_normal_coords
+from twod_materials.friction.sliding import (FourierSurface, get_sliding_path,
+                                             get_max_lateral_force)
+from twod_materials.friction.analysis import (sample_gamma_surface,
+                                              interpolate_gamma_surface,
+                                              fill_gamma_energies,
+                                              NormalEnergyCurve,
+                                              FrictionDataset,
+                                              get_basin_and_peak_locations,
+                                              get_mu_vs_F_N,
+                                              plot_friction_force,
+                                              plot_normal_force,
+                                              plot_mu_vs_F_N,
+                                              get_friction_table,
+                                              write_friction_table,
+                                              FRICTION_TABLE_COLUMNS)
+
+from pymatgen.core.structure import Structure
+
+
+PACKAGE_PATH = os.path.dirname(twod_materials.__file__)
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_get_gamma_map_for_BiTeCl(self):
+        structure = set_structure_vacuum(Structure.from_file(os.path.join(
+            PACKAGE_PATH, 'stability/tests/BiTeCl/POSCAR')), 20)
+        n_divs = int(math.ceil(structure.lattice.a * 2.5))
+        gamma_map = get_gamma_map(structure, n_divs, n_divs)
+        self.assertEqual(len(gamma_map), n_divs ** 2)
+        self.assertEqual(len(set(gamma_map.values())), 26)
+        self.assertEqual(gamma_map['0x0'], '0x0')
+        # Representatives represent themselves.
+        for representative in gamma_map.values():
+            self.assertEqual(gamma_map[representative], representative)
+
+    def test_get_normal_coords_sets_the_gap(self):
+        layer = Structure.from_file(os.path.join(
+            PACKAGE_PATH, 'stability/tests/BiTeCl/POSCAR'))
+        bilayer = Structure(layer.lattice, layer.species * 2, np.vstack(
+            [layer.cart_coords, layer.cart_coords + [0, 0, 5]]),
+                            coords_are_cartesian=True)
+        all_frac_coords = get_normal_coords(bilayer, [1.5, 3.0])
+        self.assertEqual(all_frac_coords.shape, (2, 6, 3))
+        for spacing, frac_coords in zip([1.5, 3.0], all_frac_coords):
+            z = bilayer.lattice.get_cartesian_coords(frac_coords)[:, 2]
+            self.assertAlmostEqual(z[3:].min() - z[:3].max(), spacing)
+            self.assertTrue(np.allclose(frac_coords[:3],
+                                        bilayer.frac_coords[:3]))
+
+
+def synthetic_gamma_surface(x, y):
+    return np.cos(2 * np.pi * (x - 0.3)) + 0.5 * np.cos(2 * np.pi * (y - 0.6)) \
+        + 0.3 * np.cos(2 * np.pi * (x + y))
+
+
+class AnalysisTest(unittest.TestCase):
+
+    def test_interpolate_gamma_surface_keeps_known_points(self):
+        energies = dict([('{}x{}'.format(x, y),
+                          synthetic_gamma_surface(x / 8.0, y / 8.0))
+                         for x in range(0, 8, 2) for y in range(0, 8, 2)])
+        surface = interpolate_gamma_surface(energies, 8, 8)
+        self.assertEqual(surface.shape, (8, 8))
+        self.assertAlmostEqual(surface[2][4], energies['2x4'])
+
+    def test_fill_gamma_energies_interpolates_missing_points(self):
+        grid = np.mgrid[0:12, 0:12] / 12.0
+        energies = np.ma.masked_array(synthetic_gamma_surface(*grid))
+        energies[0, 5] = energies[6, 6] = np.ma.masked
+        filled = fill_gamma_energies(energies)
+        self.assertFalse(np.ma.is_masked(filled))
+        self.assertTrue(np.allclose(filled, synthetic_gamma_surface(*grid),
+                                    atol=0.05))
+
+    def test_sample_gamma_surface_finds_basin_and_peak(self):
+        energies, history = sample_gamma_surface(synthetic_gamma_surface,
+                                                 22, 22, stride=4)
+        self.assertEqual(history[-1][:2], ['17x0', '7x14'])
+        self.assertTrue(len(energies) < 22 * 22 / 2)
+
+    def test_normal_energy_curve_matches_splev(self):
+        spacings = np.arange(1.5, 4.25, 0.25)
+        energies = 5 * np.exp(-2 * spacings)
+        spline = interpolate.splrep(spacings, energies, s=0)
+        curve = NormalEnergyCurve(spacings, energies)
+        self.assertTrue(np.allclose(curve.get_energy(spacings), energies))
+        self.assertTrue(np.allclose(
+            curve.get_force(), -interpolate.splev(spacings, spline, der=1)))
+        self.assertTrue(curve.get_force() is curve.get_force())
+        self.assertTrue(np.allclose(
+            curve.get_energy([1.6, 3.3], der=2),
+            interpolate.splev([1.6, 3.3], spline, der=2)))
+
+
+class SlidingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = np.mgrid[0:12, 0:12] / 12.0
+        self.matrix = [[3.0, 0], [0, 3.0]]
+
+    def test_sliding_over_a_sinusoid_matches_the_sinusoid_model(self):
+        surface = FourierSurface(0.1 * np.cos(2 * np.pi * self.grid[0]),
+                                 self.matrix)
+        path = get_sliding_path(surface, [0.45, 0.1], [(1, 0)])
+        self.assertTrue(np.allclose(path[0], [0.5, 0.1]))
+        self.assertAlmostEqual(get_max_lateral_force(surface, path),
+                               2 * np.pi * 0.1 / 3.0, places=4)
+
+    def test_sliding_path_goes_around_the_peak(self):
+        surface = FourierSurface(-np.cos(2 * np.pi * self.grid[0])
+                                 - np.cos(2 * np.pi * self.grid[1]),
+                                 self.matrix)
+        energies = surface.get_energy(get_sliding_path(surface, [0.1, 0.05]))
+        self.assertAlmostEqual(energies.max() - energies.min(), 2, places=4)
+
+
+def write_fake_calculation(directory, structure, energy):
+    """
+    A finished calculation whose results are already in the
+    .twod_cache.json, so that they're never actually parsed.
+    """
+
+    os.makedirs(directory)
+    structure.to('POSCAR', os.path.join(directory, 'POSCAR'))
+    with open(os.path.join(directory, 'vasprun.xml'), 'w') as vasprun:
+        vasprun.write('<modeling>\n</modeling>\n')
+    data = {'converged': True, 'final_energy': energy,
+            'final_structure': structure}
+    with open(os.path.join(directory, CACHE_FILENAME), 'w') as cache:
+        json.dump({'vasprun': {'fingerprint': get_fingerprint(
+            os.path.join(directory, 'vasprun.xml')), 'data': data}},
+                  cache, cls=MontyEncoder)
+
+
+def make_friction_directory(directory, spacings):
+    """
+    Fill directory with the friction calculations of a made-up BiTeCl
+    bilayer: three points of the Gamma surface, and the basin (5x5)
+    and peak (3x5) at each of the spacings.
+    """
+
+    structure = Structure.from_file(os.path.join(
+        PACKAGE_PATH, 'stability/tests/BiTeCl/POSCAR'))
+    structure.to('POSCAR', os.path.join(directory, 'CONTCAR'))
+
+    lateral_dir = os.path.join(directory, 'friction', 'lateral')
+    for name, energy in [('0x0', -10.0), ('3x5', -9.5), ('5x5', -10.2)]:
+        write_fake_calculation(os.path.join(lateral_dir, name),
+                               structure, energy)
+
+    # The top layer (here just the last site) is 1 Angstrom further
+    # along x in the peak stacking.
+    shifted = structure.copy()
+    shifted.translate_sites([len(shifted) - 1], [1, 0, 0],
+                            frac_coords=False)
+    for spacing in spacings:
+        energy = -10.2 + 5 * np.exp(-2 * spacing)
+        spacing_dir = os.path.join(directory, 'friction', 'normal',
+                                   str(spacing))
+        write_fake_calculation(os.path.join(spacing_dir, '5x5'),
+                               structure, energy)
+        write_fake_calculation(os.path.join(spacing_dir, '3x5'),
+                               shifted, energy + 0.1)
+
+
+class FrictionDatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spacings = list(np.arange(1.5, 4.25, 0.25))
+        make_friction_directory(self.directory, self.spacings)
+        # Whichever backend pyplot was first imported with, plot
+        # without a display.
+        plt.switch_backend('Agg')
+
+        self.scans = []
+        self.scan_directories = fa.scan_directories
+
+        def scan_directories(directories, *args):
+            self.scans.append(list(directories))
+            return self.scan_directories(directories, *args)
+
+        fa.scan_directories = scan_directories
+
+    def tearDown(self):
+        fa.scan_directories = self.scan_directories
+        shutil.rmtree(self.directory)
+
+    def test_friction_dataset_is_scanned_once(self):
+        dataset = FrictionDataset(self.directory)
+        self.assertEqual(dataset.spacings, self.spacings)
+        self.assertEqual(dataset.stackings, ['3x5', '5x5'])
+        self.assertEqual(dataset.get_gamma_energies().count(), 3)
+
+        basin, peak = get_basin_and_peak_locations(dataset=dataset)
+        self.assertEqual((basin, peak), ('5x5', '3x5'))
+        mu_vs_F_N = get_mu_vs_F_N(basin, dataset=dataset)
+        plot_friction_force(directory=self.directory, dataset=dataset)
+        plot_normal_force(basin, directory=self.directory, dataset=dataset)
+        plot_mu_vs_F_N(basin, directory=self.directory, dataset=dataset)
+        self.assertEqual(plt.get_fignums(), [])
+
+        self.assertEqual(len(self.scans), 1)
+        self.assertEqual(len(self.scans[0]), 121 + 2 * len(self.spacings))
+        # F_f = pi * amplitude, and F_N roughly -dE/dz.
+        F_N = np.array(mu_vs_F_N['F_N'])
+        self.assertTrue(np.allclose(
+            F_N, 1.602 * 10 * np.exp(-2 * np.array(self.spacings)),
+            rtol=0.05))
+        self.assertTrue(np.allclose(np.array(mu_vs_F_N['mu']) * F_N,
+                                    np.pi * 0.05 * 1.602))
+
+    def test_get_lateral_forces_scales_the_path_by_basin_and_peak(self):
+        dataset = FrictionDataset(self.directory)
+        # Basin 5x5 and peak 3x5 are 0.7 eV apart on the Gamma surface,
+        # and 0.1 eV apart at every spacing.
+        self.assertTrue(np.allclose(
+            dataset.get_lateral_forces(),
+            get_max_lateral_force(*dataset.get_sliding_path()) * 0.1 / 0.7))
+
+        dataset.lateral_energies['3x5'] = None  # the peak is now 0x0
+        self.assertRaisesRegexp(ValueError, 'No normal force calculations',
+                                dataset.get_lateral_forces)
+
+        for dir in dataset.representatives:
+            dataset.lateral_energies[dir] = -10.0
+        self.assertRaisesRegexp(ValueError, 'flat',
+                                dataset.get_lateral_forces)
+
+    def test_get_friction_table_isolates_failures(self):
+        missing = os.path.join(self.directory, 'missing')
+        table = get_friction_table([self.directory, missing], n_workers=2)
+        self.assertEqual(sorted(table), sorted(FRICTION_TABLE_COLUMNS))
+        self.assertEqual(len(table['material']), len(self.spacings) + 1)
+
+        rows = table['material'] == self.directory
+        self.assertTrue(np.allclose(table['spacing'][rows], self.spacings))
+        self.assertTrue(np.allclose(table['mu'][rows],
+                                    table['F_f'][rows] / table['F_N'][rows]))
+        self.assertTrue(all(error == '' for error in table['error'][rows]))
+        self.assertTrue(np.isnan(table['mu'][~rows]).all())
+        self.assertTrue(table['error'][~rows][0].startswith('ValueError'))
+
+        filename = os.path.join(self.directory, 'friction.csv')
+        write_friction_table(table, filename)
+        with open(filename) as csv_file:
+            lines = csv_file.read().splitlines()
+        self.assertEqual(lines[0], ','.join(FRICTION_TABLE_COLUMNS))
+        self.assertEqual(len(lines), len(self.spacings) + 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
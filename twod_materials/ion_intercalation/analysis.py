@@ -3,11 +3,10 @@ import os
 import numpy as np
 from scipy.spatial import ConvexHull
 
-from twod_materials.utils import is_converged
+from twod_materials.utils import is_converged, get_vasprun_data
 
 from pymatgen.core.structure import Structure
 from pymatgen.core.composition import Composition
-from pymatgen.io.vasp.outputs import Vasprun
 
 import matplotlib
 matplotlib.use('Agg')
@@ -16,10 +15,12 @@ import matplotlib.pyplot as plt
 import operator
 
 
-def plot_ion_hull_and_voltages(ion='Li', fmt='pdf'):
+def plot_ion_hull_and_voltages(ion='Li', fmt='pdf', directory='.'):
     """
     Plots the phase diagram between the pure material and pure ion,
     Connecting the points on the convex hull of the phase diagram.
+    directory holds the pure material's calculation, and each of its
+    subdirectories a calculation with intercalated ions.
     """
 
     # Calculated with the relax_3d() function in
@@ -27,8 +28,9 @@ def plot_ion_hull_and_voltages(ion='Li', fmt='pdf'):
     # parameters, you need to recalculate these values!
     ion_ev_fu = {'Li': -1.7540797, 'Mg': -1.31976062, 'Al': -3.19134607}
 
-    energy = Vasprun('vasprun.xml').final_energy
-    composition = Structure.from_file('POSCAR').composition
+    energy = get_vasprun_data(directory)['final_energy']
+    composition = Structure.from_file(
+        os.path.join(directory, 'POSCAR')).composition
 
     # Get the formula (with single-digit integers preceded by a '_').
     twod_material = list(composition.reduced_formula)
@@ -43,12 +45,13 @@ def plot_ion_hull_and_voltages(ion='Li', fmt='pdf'):
     twod_ev_fu = energy / composition.get_reduced_composition_and_factor()[1]
 
     data = [(0, 0, 0, twod_ev_fu)]  # (at% ion, n_ions, E_F, abs_energy)
-    for directory in [
-            dir for dir in os.listdir(os.getcwd()) if os.path.isdir(dir)]:
-        if is_converged(directory):
-            os.chdir(directory)
-            energy = Vasprun('vasprun.xml').final_energy
-            composition = Structure.from_file('POSCAR').composition
+    for ion_dir in [
+            os.path.join(directory, dir) for dir in os.listdir(directory)
+            if os.path.isdir(os.path.join(directory, dir))]:
+        if is_converged(ion_dir):
+            energy = get_vasprun_data(ion_dir)['final_energy']
+            composition = Structure.from_file(
+                os.path.join(ion_dir, 'POSCAR')).composition
             ion_fraction = composition.get_atomic_fraction(ion)
 
             no_ion_comp_dict = composition.as_dict()
@@ -65,8 +68,6 @@ def plot_ion_hull_and_voltages(ion='Li', fmt='pdf'):
             )
 
             data.append((ion_fraction, n_ions, E_F, energy / n_twod_fu))
-
-            os.chdir('../')
     data.append((1, 1, 0, ion_ev_fu[ion]))  # Pure ion
 
     sorted_data = sorted(data, key=operator.itemgetter(0))
@@ -139,4 +140,5 @@ def plot_ion_hull_and_voltages(ion='Li', fmt='pdf'):
     elif ion == 'Al':
         ax2.set_ylabel(r'$\mathrm{Potential\/vs.\/Al/Al^{3+}\/(V)}$', size=28)
 
-    plt.savefig('{}_hull.{}'.format(ion, fmt), transparent=True)
+    plt.savefig(os.path.join(directory, '{}_hull.{}'.format(ion, fmt)),
+                transparent=True)
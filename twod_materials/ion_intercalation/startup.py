@@ -1,3 +1,5 @@
+import os
+
 from pymatgen.core.structure import Structure
 from pymatgen.core.periodic_table import Element
 from pymatgen.analysis.defects.point_defects import (
@@ -22,7 +24,7 @@ elif '/scratch/' in os.getcwd():
 
 @requires(zeo_found, 'get_voronoi_nodes requires Zeo++ cython extension to be '
           'installed. Please contact developers of Zeo++ to obtain it.')
-def inject_ions(ion, atomic_fraction):
+def inject_ions(ion, atomic_fraction, filename='POSCAR'):
     """
     Adds ions to a percentage of interstitial sites into the POSCAR
     that results in an at% less than or equal to the specified
@@ -32,10 +34,11 @@ def inject_ions(ion, atomic_fraction):
     args:
           specie (str): name of ion to intercalate
           atomic_fraction (int): < 1.0
+          filename (str): path to the POSCAR of the host structure
     """
 
     specie = Element(ion)
-    structure = Structure.from_file('POSCAR')
+    structure = Structure.from_file(filename)
 
     # If the structure isn't big enough to accomodate such a small
     # atomic fraction, multiply it in the x direction.
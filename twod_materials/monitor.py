@@ -0,0 +1,125 @@
+"""
+Watch a campaign of VASP calculations and run the analysis that
+depends on them as soon as (and only once) its inputs have converged.
+"""
+
+import os
+
+import time
+
+from twod_materials.utils import get_fingerprint, get_convergence
+
+
+class CampaignMonitor():
+
+    def __init__(self, interval=360):
+        '''
+        args:
+            interval: seconds between checks in run(). Directories
+                      whose vasprun.xml hasn't changed since the last
+                      check are skipped, so short intervals are cheap.
+        '''
+
+        self._interval = interval
+        self._directories = {}
+        self._stages = []
+
+    def watch(self, directories):
+        '''
+        Start tracking the convergence of each directory in
+        directories.
+        '''
+
+        for directory in directories:
+            if directory not in self._directories:
+                self._directories[directory] = {
+                    'fingerprint': None, 'converged': False,
+                    'reason': None}
+
+    def add_stage(self, name, directories, action):
+        '''
+        Register an analysis stage. action() is called (with no
+        arguments) by update() the first time every directory in
+        directories has converged, and never again afterwards.
+        '''
+
+        self.watch(directories)
+        self._stages.append({'name': name, 'directories': list(directories),
+                             'action': action, 'done': False})
+
+    def update(self):
+        '''
+        Re-check every directory whose vasprun.xml has appeared or
+        changed since the last update, then run any stage whose
+        directories have all converged. Returns the list of
+        directories whose state was re-checked.
+        '''
+
+        changed = []
+        for directory, state in self._directories.items():
+            try:
+                fingerprint = get_fingerprint(
+                    os.path.join(directory, 'vasprun.xml'))
+            except OSError:
+                fingerprint = None
+            if state['reason'] is not None and \
+                    fingerprint == state['fingerprint']:
+                continue
+            state['fingerprint'] = fingerprint
+            state['converged'], state['reason'] = get_convergence(directory)
+            changed.append(directory)
+
+        for stage in self._stages:
+            if not stage['done'] and all(
+                    self._directories[directory]['converged']
+                    for directory in stage['directories']):
+                stage['action']()
+                stage['done'] = True
+
+        return changed
+
+    def summary(self):
+        '''
+        Returns {'converged': n, 'total': n, 'reasons': {reason: n},
+        'stages': {name: done}} for the current state of the campaign.
+        '''
+
+        reasons = {}
+        for state in self._directories.values():
+            reasons[state['reason']] = reasons.get(state['reason'], 0) + 1
+
+        return {'converged': len([state for state in
+                                  self._directories.values()
+                                  if state['converged']]),
+                'total': len(self._directories),
+                'reasons': reasons,
+                'stages': dict([(stage['name'], stage['done'])
+                                for stage in self._stages])}
+
+    def is_finished(self):
+        '''
+        True once every stage has run (or, with no stages, once every
+        watched directory has converged).
+        '''
+
+        if self._stages:
+            return all(stage['done'] for stage in self._stages)
+        return all(state['converged']
+                   for state in self._directories.values())
+
+    def run(self):
+        '''
+        Call update() every interval seconds, printing a progress line
+        each time, until the campaign is finished.
+        '''
+
+        while True:
+            self.update()
+            summary = self.summary()
+            print('>> {}/{} directories converged, {}/{} stages done'.format(
+                summary['converged'], summary['total'],
+                len([s for s in summary['stages'].values() if s]),
+                len(summary['stages'])))
+            if self.is_finished():
+                break
+            time.sleep(self._interval)
@@ -8,7 +8,6 @@ import os
 from monty.serialization import loadfn
 
 from pymatgen.core.structure import Structure
-from pymatgen.io.vasp.outputs import Vasprun
 from pymatgen.core.ion import Ion
 from pymatgen import Element
 from pymatgen.analysis.pourbaix.entry import PourbaixEntry, IonEntry
@@ -23,6 +22,7 @@ import matplotlib.pyplot as plt
 from matplotlib.patches import Polygon
 
 import twod_materials
+from twod_materials.utils import get_vasprun_data
 
 
 PACKAGE_PATH = twod_materials.__file__.replace('__init__.pyc', '')
@@ -47,10 +47,14 @@ def contains_entry(entry_list, entry):
             return True
 
 
-def plot_pourbaix_diagram(metastability=0.0, ion_concentration=1e-6, fmt='pdf'):
+def plot_pourbaix_diagram(metastability=0.0, ion_concentration=1e-6, fmt='pdf',
+                          directory='.'):
     """
     args:
 
+      directory: where the 2D material's POSCAR and vasprun.xml are,
+                 and where the plot will be saved.
+
       metastability: desired metastable tolerance energy (meV/atom).
                      <=200 is generally a sensible range to use.
 
@@ -59,8 +63,9 @@ def plot_pourbaix_diagram(metastability=0.0, ion_concentration=1e-6, fmt='pdf'):
     """
 
     # Create a ComputedEntry object for the 2D material.
-    composition = Structure.from_file('POSCAR').composition
-    energy = Vasprun('vasprun.xml').final_energy
+    composition = Structure.from_file(
+        os.path.join(directory, 'POSCAR')).composition
+    energy = get_vasprun_data(directory)['final_energy']
 
     cmpd = ComputedEntry(composition, energy)
 
@@ -163,13 +168,13 @@ def plot_pourbaix_diagram(metastability=0.0, ion_concentration=1e-6, fmt='pdf'):
         plot.suptitle('Metastable Tolerance ='
                       ' {} meV/atom'.format(metastability),
                       fontsize=20)
-        plot.savefig('{}_{}.{}'.format(
-            composition.reduced_formula, ion_concentration, fmt),
+        plot.savefig(os.path.join(directory, '{}_{}.{}'.format(
+            composition.reduced_formula, ion_concentration, fmt)),
             transparent=True)
     else:
-        plot.savefig('{}_{}.{}'.format(composition.reduced_formula,
-                                        ion_concentration, fmt),
-                     transparent=True)
+        plot.savefig(os.path.join(directory, '{}_{}.{}'.format(
+            composition.reduced_formula, ion_concentration, fmt)),
+            transparent=True)
 
     plot.close()
 
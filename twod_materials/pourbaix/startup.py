@@ -3,26 +3,12 @@ import os
 import yaml
 
 from pymatgen.io.vasp.inputs import Kpoints, Incar
+from pymatgen.core.structure import Structure
 import twod_materials.utils as utl
-from pymatgen.matproj.rest import MPRester
 
 from monty.serialization import loadfn
 
 
-try:
-    MPR = MPRester(
-        loadfn(os.path.join(os.path.expanduser('~'), 'config.yaml'))['mp_api']
-        )
-except IOError:
-    try:
-        MPR = MPRester(
-            os.environ['MP_API']
-            )
-    except KeyError:
-        raise ValueError('No Materials Project API key found. Please check'
-                         ' that your ~/config.yaml contains the field'
-                         ' mp_api: your_api_key')
-
 if '/ufrc/' in os.getcwd():
     HIPERGATOR = 2
 elif '/scratch/' in os.getcwd():
@@ -61,7 +47,7 @@ class Calibrator():
         self._binary = binary
         self._config = loadfn('/home/mashton/cal_config.yaml')
 
-    def prepare(self, submit=False):
+    def prepare(self, submit=False, directory='.'):
         '''
         This function will set up calculation directories to calibrate
         the ion corrections to match a specified framework of INCAR
@@ -71,96 +57,69 @@ class Calibrator():
 
             submit (bool): whether or not to call qsub within each
                            directory.
+
+            directory: where to create the calculation directories.
         '''
 
         for elt in self._potcar_dict:
 
             # Set up reference directory for the pure element.
-            if not os.path.isdir(elt):
-                os.mkdir(elt)
-            os.chdir(elt)
-
-            # Poscar
-            s = MPR.get_structure_by_material_id(
-                self._config['Mpids'][elt]['self']
-                )
-            s.to('POSCAR', 'POSCAR')
-            plines = open('POSCAR').readlines()
-            elements = plines[5].split()
-
-            # Kpoints
-            kp = Kpoints.automatic_density(s, self._n_kpts_per_atom)
-            kp.write_file('KPOINTS')
-
-            # Incar
-            incar = Incar.from_dict(self._incar_dict)
-            incar.write_file('INCAR')
-
-            # Potcar
-            utl.write_potcar([self._potcar_dict[el] for el in elements])
-
-            # Runjob
-
-            if HIPERGATOR == 1:
-                utl.write_pbs_runjob('{}_cal'.format(elt), self._ncores,
-                                     self._nprocs, self._pmem, self._walltime,
-                                     self._binary)
-                submission_command = 'qsub runjob'
-
-            elif HIPERGATOR == 2:
-                utl.write_slurm_runjob('{}_cal'.format(elt), self._nprocs,
-                                       self._pmem, self._walltime,
-                                       self._binary)
-                submission_command = 'sbatch runjob'
-
-            if submit:
-                os.system(submission_command)
+            elt_dir = os.path.join(directory, elt)
+            if not os.path.isdir(elt_dir):
+                os.mkdir(elt_dir)
+            self._setup_calculation(
+                self._config['Mpids'][elt]['self'], '{}_cal'.format(elt),
+                elt_dir, submit)
 
             # Set up reference oxide compound subdirectory.
             if elt not in ['O', 'S', 'F', 'Cl', 'Br', 'I']:
-                if not os.path.isdir('ref'):
-                    os.mkdir('ref')
-                os.chdir('ref')
-
-                # Poscar
-                s = MPR.get_structure_by_material_id(
-                    self._config['Mpids'][elt]['ref']
-                    )
-                s.to('POSCAR', 'POSCAR')
-                plines = open('POSCAR').readlines()
-                elements = plines[5].split()
+                ref_dir = os.path.join(elt_dir, 'ref')
+                if not os.path.isdir(ref_dir):
+                    os.mkdir(ref_dir)
+                self._setup_calculation(
+                    self._config['Mpids'][elt]['ref'], '{}_cal'.format(elt),
+                    ref_dir, submit)
+
+    def _setup_calculation(self, mpid, name, directory, submit):
+        '''
+        Write the input files for the Materials Project structure mpid
+        into directory, and submit it if submit is True.
+        '''
 
-                # Kpoints
-                kp = Kpoints.automatic_density(s, self._n_kpts_per_atom)
-                kp.write_file('KPOINTS')
+        # Poscar
+        s = utl.get_mp_client().get_structure_by_material_id(mpid)
+        s.to('POSCAR', os.path.join(directory, 'POSCAR'))
+        plines = open(os.path.join(directory, 'POSCAR')).readlines()
+        elements = plines[5].split()
 
-                # Incar
-                incar = Incar.from_dict(self._incar_dict)
-                incar.write_file('INCAR')
+        # Kpoints
+        kp = Kpoints.automatic_density(s, self._n_kpts_per_atom)
+        kp.write_file(os.path.join(directory, 'KPOINTS'))
 
-                # Potcar
-                utl.write_potcar([self._potcar_dict[el] for el in elements])
+        # Incar
+        incar = Incar.from_dict(self._incar_dict)
+        incar.write_file(os.path.join(directory, 'INCAR'))
 
-                # Runjob
-                if HIPERGATOR == 1:
-                    utl.write_pbs_runjob('{}_cal'.format(elt), self._ncores,
-                                         self._nprocs, self._pmem,
-                                         self._walltime, self._binary)
-                    submission_command = 'qsub runjob'
+        # Potcar
+        utl.write_potcar(types=[self._potcar_dict[el] for el in elements],
+                         directory=directory)
 
-                elif HIPERGATOR == 2:
-                    utl.write_slurm_runjob('{}_cal'.format(elt), self._nprocs,
-                                           self._pmem, self._walltime,
-                                           self._binary)
-                    submission_command = 'sbatch runjob'
+        # Runjob
+        if HIPERGATOR == 1:
+            utl.write_pbs_runjob(name, self._ncores, self._nprocs,
+                                 self._pmem, self._walltime, self._binary,
+                                 directory)
+            submission_command = 'qsub runjob'
 
-                if submit:
-                    os.system(submission_command)
+        elif HIPERGATOR == 2:
+            utl.write_slurm_runjob(name, self._nprocs, self._pmem,
+                                   self._walltime, self._binary, directory)
+            submission_command = 'sbatch runjob'
 
-                os.chdir('../')
-            os.chdir('../')
+        if submit:
+            utl.submit_runjob(submission_command, directory)
 
-    def get_corrections(self, parent_dir=os.getcwd(), write_yaml=False,
+    def get_corrections(self, parent_dir='.', write_yaml=False,
                         oxide_corr=0.708):
         '''
         This function returns a dict object, with elements as keys
@@ -172,14 +131,13 @@ class Calibrator():
 
             write_yaml (bool): whether or not to write the corrections
                                to ion_corrections.yaml and the mu0
-                               values to end_members.yaml.
+                               values to end_members.yaml (in
+                               parent_dir).
         '''
 
         mu0 = dict()
         corrections = dict()
 
-        os.chdir(parent_dir)
-
         special_cases = ['O', 'S', 'F', 'Cl', 'Br', 'I']
 
         elts = [elt for elt in self._potcar_dict if elt not in special_cases]
@@ -187,37 +145,35 @@ class Calibrator():
         # Add entropic correction for special elements (S * 298K)
         specials = [elt for elt in self._potcar_dict if elt in special_cases]
         for elt in specials:
-            os.chdir(elt)
             print elt
             mu0[elt] = (
-                round(utl.get_toten() / utl.get_n_formula_units()
+                round(_get_energy_per_fu(os.path.join(parent_dir, elt))
                       + self._config['OtherCorrections'][elt], 3)
                 )
-            os.chdir(parent_dir)
 
         # Oxide correction from Materials Project
         mu0['O'] += oxide_corr
 
         for elt in elts:
-            os.chdir(elt)
-
-            mu0[elt] = round(utl.get_toten() / utl.get_n_formula_units(), 3)
+            mu0[elt] = round(
+                _get_energy_per_fu(os.path.join(parent_dir, elt)), 3)
 
             # Nitrogen needs both kinds of corrections
             if elt == 'N':
                 mu0[elt] -= 0.296
 
-            os.chdir(parent_dir)
-
         for elt in elts:
             print elt
-            os.chdir('{}/ref'.format(elt))
+            ref_dir = os.path.join(parent_dir, elt, 'ref')
 
             fH_exp = self._config['Experimental_fH'][elt]
             try:
-                fH_dft = utl.get_toten() / utl.get_n_formula_units()
+                fH_dft = _get_energy_per_fu(ref_dir)
+                n_formula_units = Structure.from_file(
+                    os.path.join(ref_dir, 'POSCAR')
+                    ).composition.get_reduced_composition_and_factor()[1]
 
-                plines = open('POSCAR').readlines()
+                plines = open(os.path.join(ref_dir, 'POSCAR')).readlines()
                 elements = plines[5].split()
                 stoichiometries = plines[6].split()
                 comp_as_dict = {}
@@ -227,25 +183,37 @@ class Calibrator():
                     comp_as_dict[element] += int(stoichiometries[i])
 
                 n_elt_per_fu = (
-                    int(comp_as_dict[elt]) / utl.get_n_formula_units()
+                    int(comp_as_dict[elt]) / n_formula_units
                     )
                 for el in comp_as_dict:
                     fH_dft -= (
                         mu0[el] * int(comp_as_dict[el])
-                        / utl.get_n_formula_units()
+                        / n_formula_units
                         )
 
                 corrections[elt] = round((fH_dft - fH_exp) / n_elt_per_fu, 3)
 
-            except UnboundLocalError:
+            except (IOError, OSError):
                 corrections[elt] = '0 # Not finished"'
 
-            os.chdir(parent_dir)
-
         if write_yaml:
-            with open('ion_corrections.yaml', 'w') as icy:
+            with open(os.path.join(parent_dir, 'ion_corrections.yaml'),
+                      'w') as icy:
                 icy.write(yaml.dump(corrections, default_flow_style=False))
-            with open('end_members.yaml', 'w') as emy:
+            with open(os.path.join(parent_dir, 'end_members.yaml'),
+                      'w') as emy:
                 emy.write(yaml.dump(mu0, default_flow_style=False))
 
         return corrections
+
+
+def _get_energy_per_fu(directory):
+    '''
+    Final energy of the calculation in directory per formula unit of
+    its POSCAR.
+    '''
+
+    n_formula_units = Structure.from_file(
+        os.path.join(directory, 'POSCAR')
+        ).composition.get_reduced_composition_and_factor()[1]
+    return utl.get_vasprun_data(directory)['final_energy'] / n_formula_units
@@ -1,109 +1,202 @@
 import os
 
+import json
+
 import operator
 
+import time
+
+import tempfile
+
 from pymatgen.phasediagram.pdanalyzer import PDAnalyzer
 from pymatgen.phasediagram.pdmaker import PhaseDiagram
 from pymatgen.core.structure import Structure
-from pymatgen.io.vasp.outputs import Vasprun
 from pymatgen.entries.computed_entries import ComputedEntry
-from pymatgen.matproj.rest import MPRester
 
-from monty.serialization import loadfn
+from monty.json import MontyEncoder, MontyDecoder
 
-from twod_materials.utils import is_converged
+from twod_materials.utils import (get_vasprun_data, scan_directories,
+                                  get_mp_client)
 
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
 
 
-try:
-    MPR = MPRester(
-        loadfn(os.path.join(os.path.expanduser('~'), 'config.yaml'))['mp_api']
-        )
-except IOError:
-    try:
-        MPR = MPRester(
-            os.environ['MP_API']
-            )
-    except KeyError:
-        raise ValueError('No Materials Project API key found. Please check'
-                         ' that your ~/config.yaml contains the field'
-                         ' mp_api: your_api_key')
+# Materials Project entries are cached here, one file per chemical
+# system, and refetched once they're older than ENTRY_CACHE_TTL seconds.
+ENTRY_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.twod_materials',
+                               'mp_entries')
+ENTRY_CACHE_TTL = 30 * 24 * 3600
 
 
-def get_competing_phases(directories):
+def get_entries_in_chemsys(elements, mpr=None, offline=False,
+                           cache_dir=None, ttl=None):
     """
-    Collect the species to which the 2D materials might decompose to.
-    Since a lot of 2D materials with similar compositions will have the
-    same competing phases, duplicates aren't counted.
+    Same as MPRester.get_entries_in_chemsys, but each chemical system
+    (e.g. Bi-Cl-Te, in whatever order the elements are given) is only
+    fetched once and then served from cache_dir (ENTRY_CACHE_DIR by
+    default) until it's older than ttl seconds (ENTRY_CACHE_TTL by
+    default).
+
+    args:
+        mpr: MPRester (or anything with a get_entries_in_chemsys
+            method) to fetch missing entries with. Defaults to
+            get_mp_client().
+        offline (bool): never contact the Materials Project; serve
+            everything from the cache regardless of its age, and raise
+            a ValueError for chemical systems that aren't cached.
     """
 
-    total_competing_phases = []
+    cache_dir = cache_dir or ENTRY_CACHE_DIR
+    ttl = ENTRY_CACHE_TTL if ttl is None else ttl
+    chemsys = '-'.join(sorted(set(elements)))
+    cache_path = os.path.join(cache_dir, '{}.json'.format(chemsys))
+
+    if os.path.exists(cache_path) and (
+            offline or time.time() - os.path.getmtime(cache_path) < ttl):
+        with open(cache_path) as cache_file:
+            return json.load(cache_file, cls=MontyDecoder)
+
+    if offline:
+        raise ValueError('No cached Materials Project entries for {} in {}.'
+                         .format(chemsys, cache_dir))
+
+    mpr = mpr or get_mp_client()
+    entries = mpr.get_entries_in_chemsys(sorted(set(elements)))
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Another worker may have just made it.
+            if not os.path.isdir(cache_dir):
+                raise
+
+    # Write to a temporary file first so that a half-written cache is
+    # never read by another process.
+    fd, tmp_path = tempfile.mkstemp(prefix=chemsys, suffix='.tmp',
+                                    dir=cache_dir)
+    with os.fdopen(fd, 'w') as cache_file:
+        json.dump(entries, cache_file, cls=MontyEncoder)
+    os.rename(tmp_path, cache_path)
+
+    return entries
+
 
+def clear_entry_cache(chemsys=None, cache_dir=None):
+    """
+    Delete the cached entries for one chemical system (a list of
+    elements), or for all of them if chemsys is None.
+    """
+
+    cache_dir = cache_dir or ENTRY_CACHE_DIR
+    if chemsys is None:
+        filenames = [fn for fn in os.listdir(cache_dir)
+                     if fn.endswith('.json')] \
+            if os.path.isdir(cache_dir) else []
+    else:
+        filenames = ['{}.json'.format('-'.join(sorted(set(chemsys))))]
+
+    for filename in filenames:
+        if os.path.exists(os.path.join(cache_dir, filename)):
+            os.remove(os.path.join(cache_dir, filename))
+
+
+def get_2d_entries(directories):
+    """
+    Returns {chemsys: [(directory, ComputedEntry), ...]} for the 2D
+    materials in directories, so that the convex hull of each chemical
+    system (a sorted tuple of element symbols) only has to be built
+    once no matter how many materials share it. Unfinished
+    calculations get an energy of 100 eV.
+    """
+
+    groups = {}
     for directory in directories:
-        os.chdir(directory)
-        composition = Structure.from_file('POSCAR').composition
+        composition = Structure.from_file(
+            os.path.join(directory, 'POSCAR')).composition
         try:
-            energy = Vasprun('vasprun.xml').final_energy
+            energy = get_vasprun_data(directory)['final_energy']
         except:
             energy = 100
-        my_entry = ComputedEntry(composition, energy)  # 2D material
-        entries = MPR.get_entries_in_chemsys(
-            [elt.symbol for elt in composition]
-            )
-
-        entries.append(my_entry)  # 2D material
-
-        pda = PDAnalyzer(PhaseDiagram(entries))
-        decomp = pda.get_decomp_and_e_above_hull(my_entry, allow_negative=True)
-        competing_phases = [
-            (entry.composition.reduced_formula,
-             entry.entry_id) for entry in decomp[0]
-            ]
+        chemsys = tuple(sorted(elt.symbol for elt in composition))
+        groups.setdefault(chemsys, []).append(
+            (directory, ComputedEntry(composition, energy)))
+
+    return groups
 
-        # Keep a running list of all unique competing phases, since in
-        # high throughput 2D searches there is usually some overlap in
-        # competing phases for different materials.
-        for specie in competing_phases:
+
+def get_decomps_and_e_above_hull(entries, reference_entries):
+    """
+    Build the phase diagram of reference_entries once and return
+    [(decomposition, e_above_hull), ...] for each entry in entries,
+    which don't have to be (and usually aren't) on that hull. Entries
+    below the hull get a negative e_above_hull.
+    """
+
+    pda = PDAnalyzer(PhaseDiagram(reference_entries))
+    return [pda.get_decomp_and_e_above_hull(entry, allow_negative=True)
+            for entry in entries]
+
+
+def get_competing_phases(directories, mpr=None, offline=False):
+    """
+    Collect the species to which the 2D materials might decompose to.
+    Since a lot of 2D materials with similar compositions will have the
+    same competing phases, duplicates aren't counted. mpr and offline
+    are passed on to get_entries_in_chemsys.
+    """
+
+    decomps = {}
+    for chemsys, group in get_2d_entries(directories).items():
+        results = get_decomps_and_e_above_hull(
+            [entry for directory, entry in group],
+            get_entries_in_chemsys(chemsys, mpr, offline))
+        for (directory, entry), (decomp, e_above_hull) in zip(group, results):
+            decomps[directory] = decomp
+
+    # Keep a running list of all unique competing phases, since in
+    # high throughput 2D searches there is usually some overlap in
+    # competing phases for different materials.
+    total_competing_phases = []
+    for directory in directories:
+        for entry in decomps[directory]:
+            specie = (entry.composition.reduced_formula, entry.entry_id)
             if specie not in total_competing_phases:
                 total_competing_phases.append(specie)
-        os.chdir('../')
 
     return total_competing_phases
 
 
-def get_hull_distances(directories):
+def get_hull_distances(directories, competitors_dir='all_competitors',
+                       mpr=None, offline=False):
+    """
+    Returns {formula: hull distance (eV/atom)} for the 2D materials in
+    directories. Competing phases that have been relaxed with
+    relax_competing_species() are looked for in competitors_dir. mpr
+    and offline are passed on to get_entries_in_chemsys.
+    """
 
     hull_distances = {}
     finished_competitors = {}
 
     # Determine which competing phases have been relaxed in the current
     # framework and store them in a dictionary ({formula: entry}).
-    if os.path.isdir('all_competitors'):
-        os.chdir('all_competitors')
-        for comp_dir in [
-            dir for dir in os.listdir(os.getcwd()) if os.path.isdir(dir) and
-            is_converged(dir)
-                ]:
-            vasprun = Vasprun('{}/vasprun.xml'.format(comp_dir))
-            composition = vasprun.final_structure.composition
-            energy = vasprun.final_energy
-            finished_competitors[comp_dir] = ComputedEntry(composition, energy)
-        os.chdir('../')
+    if os.path.isdir(competitors_dir):
+        comp_dirs = [
+            dir for dir in os.listdir(competitors_dir)
+            if os.path.isdir(os.path.join(competitors_dir, dir))
+            ]
+        scan = scan_directories(
+            [os.path.join(competitors_dir, dir) for dir in comp_dirs])
+        for comp_dir in comp_dirs:
+            result = scan[os.path.join(competitors_dir, comp_dir)]
+            if result['converged']:
+                finished_competitors[comp_dir] = ComputedEntry(
+                    result['composition'], result['final_energy'])
 
-    for directory in directories:
-        os.chdir(directory)
-        composition = Structure.from_file('POSCAR').composition
-        try:
-            energy = Vasprun('vasprun.xml').final_energy
-        except:
-            energy = 100
-        my_entry = ComputedEntry(composition, energy)  # 2D material
-        entries = MPR.get_entries_in_chemsys(
-            [elt.symbol for elt in composition]
-            )
+    for chemsys, group in get_2d_entries(directories).items():
+        entries = get_entries_in_chemsys(chemsys, mpr, offline)
 
         # If the energies of competing phases have been calculated in
         # the current framework, put them in the phase diagram instead
@@ -115,25 +208,30 @@ def get_hull_distances(directories):
             else:
                 entries[i] = ComputedEntry(entries[i].composition, 100)
 
-        entries.append(my_entry)  # 2D material
-
-        pda = PDAnalyzer(PhaseDiagram(entries))
-        decomp = pda.get_decomp_and_e_above_hull(my_entry, allow_negative=True)
-
-        hull_distances[composition.reduced_formula] = decomp[1]
-        os.chdir('../')
+        results = get_decomps_and_e_above_hull(
+            [entry for directory, entry in group], entries)
+        for (directory, entry), (decomp, e_above_hull) in zip(group, results):
+            hull_distances[entry.composition.reduced_formula] = e_above_hull
 
     return hull_distances
 
 
-def plot_hull_distances(hull_distances, fmt='pdf'):
+def plot_hull_distances(hull_distances, fmt='pdf', directory='.'):
     """
-    Create a bar graph of the formation energies of the 2D materials.
+    Create a bar graph of the formation energies of the 2D materials,
+    saved as directory/stability_plot.fmt.
     """
 
     hsize = 12 + (len(hull_distances) - 4) / 3
     ax = plt.figure(figsize=(hsize, 10)).gca()
-    ax.set_ylim(0, 700)
+
+    # Hull distances can be negative (below the hull), so fit the
+    # y-axis to the bars on both sides of 0.
+    energies = [1000 * hull_distance
+                for hull_distance in hull_distances.values()] + [0]
+    margin = 0.1 * (max(energies) - min(energies)) or 1
+    ax.set_ylim(min(energies) - (margin if min(energies) < 0 else 0),
+                max(energies) + margin)
     ax.set_xlim(0, len(hull_distances))
 
     x_ticklabels = []
@@ -174,25 +272,17 @@ def plot_hull_distances(hull_distances, fmt='pdf'):
     ax.set_yticklabels(ax.get_yticks(), family='serif', size=20)
     ax.set_ylabel(r'$\mathrm{E_F\/(meV/atom)}$', size=40)
 
-    plt.savefig('stability_plot.{}'.format(fmt), transparent=True)
+    plt.savefig(os.path.join(directory, 'stability_plot.{}'.format(fmt)),
+                transparent=True)
 
 
-def all_converged(two_d, three_d):
+def all_converged(two_d, three_d, competitors_dir='all_competitors'):
     """
-    True if all two_d directories and three_d competing_phases have
-    converged, otherwise false.
+    True if all two_d directories and three_d competing_phases (in
+    competitors_dir) have converged, otherwise false.
     """
 
-    finished_2d, finished_3d = [], []
-    for directory in two_d:
-        if is_converged(directory):
-            finished_2d.append(directory)
-    for directory in three_d:
-        if is_converged('all_competitors/{}'.format(directory[0])):
-            finished_3d.append(directory[0])
-    if len(finished_2d + finished_3d) == len(
-            two_d + three_d):
-        all_converged = True
-    else:
-        all_converged = False
-    return all_converged
+    scan = scan_directories(
+        list(two_d) + [os.path.join(competitors_dir, directory[0])
+                       for directory in three_d], energies=False)
+    return all(result['converged'] for result in scan.values())
@@ -1,13 +1,12 @@
 import os
 
+import shutil
+
 import twod_materials.utils as utl
 
-from pymatgen.matproj.rest import MPRester
 from pymatgen.core.structure import Structure
 from pymatgen.io.vasp.inputs import Kpoints, Incar
 
-from monty.serialization import loadfn
-
 import twod_materials
 
 
@@ -29,134 +28,122 @@ if '/ufrc/' in os.getcwd():
 elif '/scratch/' in os.getcwd():
     HIPERGATOR = 1
 
-try:
-    MPR = MPRester(
-        loadfn(os.path.join(os.path.expanduser('~'), 'config.yaml'))['mp_api']
-        )
-    VASP = loadfn(os.path.join(os.path.expanduser('~'),
-                               'config.yaml'))['normal_binary']
-    VASP_2D = loadfn(os.path.join(os.path.expanduser('~'),
-                                  'config.yaml'))['twod_binary']
-except IOError:
-    try:
-        MPR = MPRester(
-            os.environ['MP_API']
-            )
-    except KeyError:
-        raise ValueError('No config.yaml file found. Please check'
-                         ' that your config.yaml is in your home directory'
-                         ' and contains the field'
-                         ' mp_api: your_api_key')
-
-
-def relax(submit=True, force_overwrite=False):
+
+def relax(submit=True, force_overwrite=False, directory='.'):
     """
     Should be run before pretty much anything else, in order to get the
     right energy of the 2D material.
     """
 
-    if force_overwrite or not utl.is_converged(os.getcwd()):
-        directory = os.getcwd().split('/')[-1]
+    if force_overwrite or not utl.is_converged(directory):
+        name = os.path.basename(os.path.abspath(directory))
+        poscar = os.path.join(directory, 'POSCAR')
+        kpoints = os.path.join(directory, 'KPOINTS')
         # Ensure 20A interlayer vacuum
-        utl.add_vacuum(20 - utl.get_spacing(), 0.9)
+        utl.set_vacuum(20, 0.9, poscar)
         # vdw_kernel.bindat file required for VDW calculations.
-        os.system('cp {} .'.format(KERNEL_PATH))
+        shutil.copy(KERNEL_PATH, directory)
         # KPOINTS
-        Kpoints.automatic_density(Structure.from_file('POSCAR'),
-                                  1000).write_file('KPOINTS')
-        kpts_lines = open('KPOINTS').readlines()
-        with open('KPOINTS', 'w') as kpts:
+        Kpoints.automatic_density(Structure.from_file(poscar),
+                                  1000).write_file(kpoints)
+        kpts_lines = open(kpoints).readlines()
+        with open(kpoints, 'w') as kpts:
             for line in kpts_lines[:3]:
                 kpts.write(line)
             kpts.write(kpts_lines[3].split()[0] + ' '
                        + kpts_lines[3].split()[1] + ' 1')
         # INCAR
-        Incar.from_dict(INCAR_DICT).write_file('INCAR')
+        Incar.from_dict(INCAR_DICT).write_file(
+            os.path.join(directory, 'INCAR'))
         # POTCAR
-        utl.write_potcar()
+        utl.write_potcar(directory=directory)
         # Submission script
+        vasp = utl.get_config_value('twod_binary')
         if HIPERGATOR == 1:
-            utl.write_pbs_runjob(directory, 1, 16, '800mb', '6:00:00',
-                                 VASP_2D)
+            utl.write_pbs_runjob(name, 1, 16, '800mb', '6:00:00',
+                                 vasp, directory)
             submission_command = 'qsub runjob'
 
         elif HIPERGATOR == 2:
-            utl.write_slurm_runjob(directory, 16, '800mb', '6:00:00',
-                                   VASP_2D)
+            utl.write_slurm_runjob(name, 16, '800mb', '6:00:00',
+                                   vasp, directory)
             submission_command = 'sbatch runjob'
 
         if submit:
-            os.system(submission_command)
+            utl.submit_runjob(submission_command, directory)
 
 
 def relax_competing_species(competing_species, submit=True,
-                            force_overwrite=False):
+                            force_overwrite=False, directory='.'):
     """
     After obtaining the competing species, relax them with the same
     input parameters as the 2D materials in order to ensure
-    compatibility.
+    compatibility. They are set up in directory/all_competitors.
     """
 
-    if not os.path.isdir('all_competitors'):
-        os.mkdir('all_competitors')
-    os.chdir('all_competitors')
+    competitors_dir = os.path.join(directory, 'all_competitors')
+    if not os.path.isdir(competitors_dir):
+        os.mkdir(competitors_dir)
 
     for specie in competing_species:
-        if not os.path.isdir(specie[0]):
-            os.mkdir(specie[0])
-        directory = os.path.join(os.getcwd(), specie[0])
-        if force_overwrite or not utl.is_converged(directory):
-            os.chdir(specie[0])
-            os.system('cp {} .'.format(KERNEL_PATH))
-            structure = MPR.get_structure_by_material_id(specie[1])
-            structure.to('POSCAR', 'POSCAR')
-            Kpoints.automatic_density(structure, 1000).write_file('KPOINTS')
-            Incar.from_dict(INCAR_DICT).write_file('INCAR')
-            utl.write_potcar()
+        specie_dir = os.path.join(competitors_dir, specie[0])
+        if not os.path.isdir(specie_dir):
+            os.mkdir(specie_dir)
+        if force_overwrite or not utl.is_converged(specie_dir):
+            shutil.copy(KERNEL_PATH, specie_dir)
+            structure = utl.get_mp_client().get_structure_by_material_id(
+                specie[1])
+            structure.to('POSCAR', os.path.join(specie_dir, 'POSCAR'))
+            Kpoints.automatic_density(structure, 1000).write_file(
+                os.path.join(specie_dir, 'KPOINTS'))
+            Incar.from_dict(INCAR_DICT).write_file(
+                os.path.join(specie_dir, 'INCAR'))
+            utl.write_potcar(directory=specie_dir)
+            vasp = utl.get_config_value('normal_binary')
             if HIPERGATOR == 1:
                 utl.write_pbs_runjob('{}_3d'.format(specie[0]), 1, 8, '600mb',
-                                     '6:00:00', VASP)
+                                     '6:00:00', vasp, specie_dir)
                 submission_command = 'qsub runjob'
 
             elif HIPERGATOR == 2:
                 utl.write_slurm_runjob('{}_3d'.format(specie[0]), 8, '600mb',
-                                       '6:00:00', VASP)
+                                       '6:00:00', vasp, specie_dir)
                 submission_command = 'sbatch runjob'
 
             if submit:
-                os.system(submission_command)
-
-            os.chdir('../')
-    os.chdir('../')
+                utl.submit_runjob(submission_command, specie_dir)
 
 
-def relax_3d(submit=True, force_overwrite=False):
+def relax_3d(submit=True, force_overwrite=False, directory='.'):
     """
     Standard relaxation for a single directory of a bulk material.
     """
 
-    if force_overwrite or not utl.is_converged(os.getcwd()):
-        directory = os.getcwd().split('/')[-1]
+    if force_overwrite or not utl.is_converged(directory):
+        name = os.path.basename(os.path.abspath(directory))
 
         # vdw_kernel.bindat file required for VDW calculations.
-        os.system('cp {} .'.format(KERNEL_PATH))
+        shutil.copy(KERNEL_PATH, directory)
         # KPOINTS
-        Kpoints.automatic_density(Structure.from_file('POSCAR'),
-                                  1000).write_file('KPOINTS')
+        Kpoints.automatic_density(
+            Structure.from_file(os.path.join(directory, 'POSCAR')),
+            1000).write_file(os.path.join(directory, 'KPOINTS'))
         # INCAR
-        Incar.from_dict(INCAR_DICT).write_file('INCAR')
+        Incar.from_dict(INCAR_DICT).write_file(
+            os.path.join(directory, 'INCAR'))
         # POTCAR
-        utl.write_potcar()
+        utl.write_potcar(directory=directory)
         # Submission script
+        vasp = utl.get_config_value('normal_binary')
         if HIPERGATOR == 1:
-            utl.write_pbs_runjob('{}_3d'.format(directory), 1, 8, '600mb',
-                                 '6:00:00', VASP)
+            utl.write_pbs_runjob('{}_3d'.format(name), 1, 8, '600mb',
+                                 '6:00:00', vasp, directory)
             submission_command = 'qsub runjob'
 
         elif HIPERGATOR == 2:
-            utl.write_slurm_runjob('{}_3d'.format(directory), 8, '600mb',
-                                   '6:00:00', VASP)
+            utl.write_slurm_runjob('{}_3d'.format(name), 8, '600mb',
+                                   '6:00:00', vasp, directory)
             submission_command = 'sbatch runjob'
 
         if submit:
-            os.system(submission_command)
+            utl.submit_runjob(submission_command, directory)
@@ -2,8 +2,19 @@ import unittest
 
 import os
 
+import shutil
+
+import tempfile
+
+from pymatgen.entries.computed_entries import ComputedEntry
+
+import matplotlib.pyplot as plt
+
+from twod_materials.stability import analysis
 from twod_materials.stability.analysis import (get_competing_phases,
-                                               get_hull_distances)
+                                               get_hull_distances,
+                                               get_entries_in_chemsys,
+                                               clear_entry_cache)
 
 
 ROOT = os.getcwd()
@@ -21,6 +32,83 @@ class AnalysisTest(unittest.TestCase):
         competing_phases = get_competing_phases(['BiTeCl'])
         self.assertEqual(competing_phases, [(u'BiTeCl', u'mp-28944')])
 
+    def test_plot_hull_distances_shows_negative_distances(self):
+        directory = tempfile.mkdtemp()
+        plt.switch_backend('Agg')
+        try:
+            analysis.plot_hull_distances({'BiTeCl': -0.05, 'MoS2': 0.3},
+                                         'png', directory)
+            ymin, ymax = plt.gca().get_ylim()
+            self.assertLess(ymin, -50)
+            self.assertGreater(ymax, 300)
+            self.assertTrue(os.path.exists(os.path.join(
+                directory, 'stability_plot.png')))
+        finally:
+            plt.close('all')
+            shutil.rmtree(directory)
+
+
+class FakeMPRester():
+
+    def __init__(self):
+        self.queries = []
+
+    def get_entries_in_chemsys(self, elements):
+        self.queries.append(elements)
+        return [ComputedEntry(elt, -1.0) for elt in elements]
+
+
+class EntryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.mpr = FakeMPRester()
+        self.default_cache_dir = analysis.ENTRY_CACHE_DIR
+        analysis.ENTRY_CACHE_DIR = self.cache_dir
+
+    def tearDown(self):
+        analysis.ENTRY_CACHE_DIR = self.default_cache_dir
+        shutil.rmtree(self.cache_dir)
+
+    def test_each_chemsys_is_fetched_once(self):
+        for elements in [['Bi', 'Te', 'Cl'], ['Cl', 'Bi', 'Te'], ['Te', 'Bi']]:
+            get_entries_in_chemsys(elements, self.mpr,
+                                   cache_dir=self.cache_dir)
+        self.assertEqual(self.mpr.queries, [['Bi', 'Cl', 'Te'], ['Bi', 'Te']])
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         ['Bi-Cl-Te.json', 'Bi-Te.json'])
+        entries = get_entries_in_chemsys(['Te', 'Bi'], self.mpr,
+                                         cache_dir=self.cache_dir)
+        self.assertEqual(sorted(entry.composition.reduced_formula
+                                for entry in entries), ['Bi', 'Te'])
+
+    def test_expired_and_cleared_entries_are_refetched(self):
+        get_entries_in_chemsys(['Bi', 'Te'], self.mpr,
+                               cache_dir=self.cache_dir)
+        get_entries_in_chemsys(['Bi', 'Te'], self.mpr,
+                               cache_dir=self.cache_dir, ttl=-1)
+        clear_entry_cache(['Te', 'Bi'], cache_dir=self.cache_dir)
+        get_entries_in_chemsys(['Bi', 'Te'], self.mpr,
+                               cache_dir=self.cache_dir)
+        self.assertEqual(len(self.mpr.queries), 3)
+
+    def test_offline_mode_only_uses_the_cache(self):
+        self.assertRaises(ValueError, get_entries_in_chemsys, ['Bi', 'Te'],
+                          self.mpr, True, self.cache_dir)
+        get_entries_in_chemsys(['Bi', 'Te'], self.mpr,
+                               cache_dir=self.cache_dir)
+        get_entries_in_chemsys(['Bi', 'Te'], self.mpr, True, self.cache_dir,
+                               ttl=-1)
+        self.assertEqual(len(self.mpr.queries), 1)
+
+    def test_materials_in_the_same_chemsys_share_one_query(self):
+        competing_phases = get_competing_phases(
+            ['BiTeCl', 'BiTeCl'], self.mpr)
+        self.assertEqual(self.mpr.queries, [['Bi', 'Cl', 'Te']])
+        self.assertEqual(sorted(competing_phases),
+                         [(u'Bi', None), (u'Cl2', None), (u'Te', None)])
+
+
 if __name__ == '__main__':
     unittest.main()
     os.chdir(ROOT)
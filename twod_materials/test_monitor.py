@@ -0,0 +1,88 @@
+import unittest
+
+import os
+
+import shutil
+
+import tempfile
+
+import twod_materials.monitor as monitor
+from twod_materials.monitor import CampaignMonitor
+
+
+class CampaignMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.run_dirs = [os.path.join(self.directory, name)
+                         for name in ['a', 'b']]
+        for run_dir in self.run_dirs:
+            os.mkdir(run_dir)
+
+        # Record which directories are checked, and call a run converged
+        # if its vasprun.xml says so.
+        self.checked = []
+        self.get_convergence = monitor.get_convergence
+
+        def get_convergence(directory):
+            self.checked.append(directory)
+            try:
+                with open(os.path.join(directory, 'vasprun.xml')) as f:
+                    converged = f.read() == 'converged'
+            except IOError:
+                return (False, 'no vasprun.xml')
+            return (converged, 'converged' if converged else 'running')
+
+        monitor.get_convergence = get_convergence
+
+    def tearDown(self):
+        monitor.get_convergence = self.get_convergence
+        shutil.rmtree(self.directory)
+
+    def write_vasprun(self, run_dir, text):
+        with open(os.path.join(run_dir, 'vasprun.xml'), 'w') as f:
+            f.write(text)
+
+    def test_only_changed_directories_are_rechecked(self):
+        a, b = self.run_dirs
+        campaign = CampaignMonitor()
+        campaign.watch(self.run_dirs)
+        self.write_vasprun(a, 'running')
+
+        self.assertEqual(sorted(campaign.update()), [a, b])
+        self.assertEqual(campaign.update(), [])
+        self.assertEqual(sorted(self.checked), [a, b])
+
+        self.write_vasprun(b, 'converged')
+        self.assertEqual(campaign.update(), [b])
+        self.assertEqual(campaign.update(), [])
+        self.assertEqual(len(self.checked), 3)
+        self.assertEqual(campaign.summary()['reasons'],
+                         {'running': 1, 'converged': 1})
+
+    def test_each_stage_runs_exactly_once(self):
+        a, b = self.run_dirs
+        runs = []
+        campaign = CampaignMonitor()
+        campaign.add_stage('a', [a], lambda: runs.append('a'))
+        campaign.add_stage('ab', [a, b], lambda: runs.append('ab'))
+
+        campaign.update()
+        self.assertEqual(runs, [])
+
+        self.write_vasprun(a, 'converged')
+        campaign.update()
+        campaign.update()
+        self.assertEqual(runs, ['a'])
+        self.assertFalse(campaign.is_finished())
+
+        self.write_vasprun(b, 'converged')
+        for i in range(3):
+            campaign.update()
+        self.assertEqual(runs, ['a', 'ab'])
+        self.assertTrue(campaign.is_finished())
+        self.assertEqual(campaign.summary()['stages'], {'a': True, 'ab': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,11 +2,23 @@ import unittest
 
 import os
 
+import shutil
+
+import tempfile
+
 from monty.serialization import loadfn
 
 from pymatgen.matproj.rest import MPRester
+from pymatgen.core.structure import Structure
+from pymatgen.io.vasp.outputs import Vasprun
 
-from twod_materials.utils import is_converged, add_vacuum, get_spacing
+import twod_materials.utils as utl
+from twod_materials.utils import (is_converged, add_vacuum, get_spacing,
+                                  parse_qstat, parse_squeue, get_status,
+                                  get_structure_spacing, set_structure_vacuum,
+                                  write_potcar, scan_directories,
+                                  get_convergence, get_cached_result,
+                                  get_vasprun_data, CACHE_FILENAME)
 
 
 PACKAGE_PATH = os.path.join(os.getcwd(), 'twod_materials')
@@ -35,6 +47,57 @@ except IOError:
                          ' that your ~/config.yaml contains the field'
                          ' mp_api: your_api_key')
 
+QSTAT_OUTPUT = '''Job Id: 1001.moab.ufhpc
+    Job_Name = WSe2
+    Job_Owner = mashton@submit1.ufhpc
+    job_state = R
+    Output_Path = submit1.ufhpc:/scratch/lfs/mashton/WSe2/test.ou
+\tt
+    Variable_List = PBS_O_QUEUE=submit,PBS_O_HOME=/home/mashton,
+\tPBS_O_WORKDIR=/scratch/lfs/mashton/WSe2,PBS_O_HOST=submit1.ufhpc
+
+Job Id: 1002.moab.ufhpc
+    Job_Name = MoS2
+    Job_Owner = mashton@submit1.ufhpc
+    job_state = Q
+    Output_Path = submit1.ufhpc:/scratch/lfs/mashton/MoS2/test.out
+
+Job Id: 1003.moab.ufhpc
+    Job_Name = other
+    Job_Owner = someone@submit1.ufhpc
+    job_state = R
+    Output_Path = submit1.ufhpc:/scratch/lfs/someone/other/test.out
+'''
+SQUEUE_OUTPUT = '''2001 R /ufrc/hennig/mashton/WSe2
+2002 PD /ufrc/hennig/mashton/MoS2/
+2003 CD /ufrc/hennig/mashton/My Dir
+'''
+
+
+def write_vasprun(directory, n_electronic_steps, nsw=3, nelm=4,
+                  complete=True):
+    """
+    Writes a minimal vasprun.xml with one calculation (ionic step) for
+    each entry of n_electronic_steps, holding that many scsteps.
+    """
+
+    lines = ['<?xml version="1.0" encoding="ISO-8859-1"?>', '<modeling>',
+             ' <parameters>',
+             '  <separator name="ionic" >',
+             '   <i type="int" name="NSW">    {}</i>'.format(nsw),
+             '  </separator>',
+             '  <separator name="electronic" >',
+             '   <i type="int" name="NELM">    {}</i>'.format(nelm),
+             '  </separator>',
+             ' </parameters>']
+    for n in n_electronic_steps:
+        lines += [' <calculation>'] + ['  <scstep>', '  </scstep>'] * n \
+            + [' </calculation>']
+    if complete:
+        lines.append('</modeling>')
+    with open(os.path.join(directory, 'vasprun.xml'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
 
 class UtilsTest(unittest.TestCase):
 
@@ -59,6 +122,196 @@ class UtilsTest(unittest.TestCase):
         self.assertTrue(14.9 < get_spacing() < 15.1)
         os.system('rm POSCAR')
 
+    def test_set_structure_vacuum_with_wrapped_atoms(self):
+        structure = Structure.from_file(os.path.join(
+            PACKAGE_PATH, 'stability/tests/BiTeCl/POSCAR'))
+        frac_coords = structure.frac_coords
+        frac_coords[:, 2] -= 0.05  # Cl is now at the top of the cell
+        structure = Structure(structure.lattice, structure.species,
+                              frac_coords)
+        padded = set_structure_vacuum(structure, 20)
+        self.assertAlmostEqual(get_structure_spacing(padded), 20)
+        self.assertAlmostEqual(min(padded.frac_coords[:, 2]), 0)
+        self.assertAlmostEqual(get_structure_spacing(structure), 15)
+
+    def test_write_potcar_falls_back_and_links(self):
+        pot_path = tempfile.mkdtemp()
+        directory = tempfile.mkdtemp()
+        try:
+            for symbol in ['Bi_pv', 'Te', 'Cl']:
+                os.mkdir(os.path.join(pot_path, symbol))
+                with open(os.path.join(pot_path, symbol, 'POTCAR'), 'w') as f:
+                    f.write('{}\n'.format(symbol))
+            for grid_dir in ['0x0', '0x1']:
+                os.mkdir(os.path.join(directory, grid_dir))
+                shutil.copy(os.path.join(PACKAGE_PATH,
+                                         'stability/tests/BiTeCl/POSCAR'),
+                            os.path.join(directory, grid_dir))
+                write_potcar(pot_path, directory=os.path.join(
+                    directory, grid_dir), link=True)
+            potcars = [os.path.join(directory, grid_dir, 'POTCAR')
+                       for grid_dir in ['0x0', '0x1']]
+            self.assertEqual(open(potcars[1]).read(), 'Cl\nTe\nBi_pv\n')
+            self.assertTrue(os.path.samefile(*potcars))
+        finally:
+            shutil.rmtree(pot_path)
+            shutil.rmtree(directory)
+
+    def test_get_cached_result_is_reused_until_the_file_changes(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'OUTCAR')
+        parsed = []
+
+        def parser(path):
+            parsed.append(path)
+            with open(path) as f:
+                return len(f.read())
+
+        try:
+            with open(filename, 'w') as f:
+                f.write('energy')
+            for i in range(2):
+                self.assertEqual(get_cached_result(directory, 'OUTCAR',
+                                                   'length', parser), 6)
+            self.assertEqual(len(parsed), 1)
+            self.assertTrue(os.path.exists(os.path.join(directory,
+                                                        CACHE_FILENAME)))
+
+            # Same size, new mtime.
+            os.utime(filename, (0, 0))
+            get_cached_result(directory, 'OUTCAR', 'length', parser)
+            self.assertEqual(len(parsed), 2)
+
+            # New size.
+            with open(filename, 'a') as f:
+                f.write('!')
+            os.utime(filename, (0, 0))
+            self.assertEqual(get_cached_result(directory, 'OUTCAR',
+                                               'length', parser), 7)
+            self.assertEqual(len(parsed), 3)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_get_vasprun_data_is_cached(self):
+        directory = tempfile.mkdtemp()
+        shutil.copy(os.path.join(PACKAGE_PATH,
+                                 'stability/tests/BiTeCl/vasprun.xml'),
+                    directory)
+        parse_vasprun = utl._parse_vasprun
+        parsed = []
+
+        def counting_parse_vasprun(filename):
+            parsed.append(filename)
+            return parse_vasprun(filename)
+
+        utl._parse_vasprun = counting_parse_vasprun
+        try:
+            data = get_vasprun_data(directory)
+            cached = get_vasprun_data(directory)
+            self.assertEqual(len(parsed), 1)
+            self.assertAlmostEqual(cached['final_energy'],
+                                   data['final_energy'])
+            self.assertEqual(cached['final_structure'],
+                             data['final_structure'])
+        finally:
+            utl._parse_vasprun = parse_vasprun
+            shutil.rmtree(directory)
+
+    def test_get_convergence_reasons(self):
+        directory = tempfile.mkdtemp()
+        runs = [('converged', ([3, 2], {}), (True, utl.CONVERGED)),
+                ('nsw', ([3, 2, 2], {}), (False, utl.NSW_EXHAUSTED)),
+                ('nelm', ([3, 4], {}), (False, utl.EDIFF_NOT_REACHED)),
+                ('truncated', ([3, 2], {'complete': False}),
+                 (False, utl.TRUNCATED)),
+                ('missing', None, (False, utl.NO_OUTPUT))]
+        try:
+            for name, args, reason in runs:
+                run_dir = os.path.join(directory, name)
+                os.mkdir(run_dir)
+                if args is not None:
+                    write_vasprun(run_dir, args[0], **args[1])
+                self.assertEqual(get_convergence(run_dir), reason)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_scan_directories_with_broken_runs(self):
+        directory = tempfile.mkdtemp()
+        vasprun = os.path.join(PACKAGE_PATH,
+                               'stability/tests/BiTeCl/vasprun.xml')
+        with open(vasprun) as f:
+            text = f.read()
+        try:
+            for name, contents in [('converged', text),
+                                   ('truncated', text[:len(text) // 2]),
+                                   ('bad_xml', '<modeling><i></modeling>'),
+                                   ('missing', None)]:
+                os.mkdir(os.path.join(directory, name))
+                if contents is not None:
+                    with open(os.path.join(directory, name, 'vasprun.xml'),
+                              'w') as f:
+                        f.write(contents)
+            names = ['converged', 'truncated', 'bad_xml', 'missing']
+            paths = [os.path.join(directory, name) for name in names]
+
+            for processes in [False, True]:
+                scan = scan_directories(paths, 2, processes)
+                self.assertEqual(sorted(scan), sorted(paths))
+                converged = scan[paths[0]]
+                self.assertTrue(converged['converged'])
+                self.assertAlmostEqual(converged['final_energy'],
+                                       Vasprun(vasprun).final_energy)
+                self.assertEqual(converged['composition'].reduced_formula,
+                                 'BiTeCl')
+                for path in paths[1:]:
+                    self.assertEqual(scan[path], {'converged': False,
+                                                  'final_energy': None,
+                                                  'composition': None})
+
+            scan = scan_directories(paths, energies=False)
+            self.assertTrue(scan[paths[0]]['converged'])
+            self.assertIsNone(scan[paths[0]]['final_energy'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_parse_qstat_with_canned_output(self):
+        job_states = parse_qstat(QSTAT_OUTPUT, username='mashton')
+        self.assertEqual(job_states,
+                         {'/scratch/lfs/mashton/WSe2': 'R',
+                          '/scratch/lfs/mashton/MoS2': 'Q'})
+        self.assertEqual(get_status('/scratch/lfs/mashton/WSe2/',
+                                    job_states), 'R')
+        self.assertIsNone(get_status('/scratch/lfs/mashton/Ti2CO2',
+                                     job_states))
+
+    def test_parse_squeue_with_canned_output(self):
+        job_states = parse_squeue(SQUEUE_OUTPUT)
+        self.assertEqual(job_states,
+                         {'/ufrc/hennig/mashton/WSe2': 'R',
+                          '/ufrc/hennig/mashton/MoS2': 'Q',
+                          '/ufrc/hennig/mashton/My Dir': 'C'})
+
+    def test_get_config_is_read_once_with_environment_overrides(self):
+        config_path, utl.CONFIG_PATH = utl.CONFIG_PATH, '/nonexistent.yaml'
+        binary = os.environ.get('VASP_NORMAL_BINARY')
+        utl._CONFIG = None
+        try:
+            os.environ['VASP_NORMAL_BINARY'] = '/bin/vasp'
+            self.assertEqual(utl.get_config_value('normal_binary'),
+                             '/bin/vasp')
+            os.environ['VASP_NORMAL_BINARY'] = '/bin/other_vasp'
+            self.assertEqual(utl.get_config_value('normal_binary'),
+                             '/bin/vasp')
+            self.assertRaises(ValueError, utl.get_config_value,
+                              'twod_binary')
+        finally:
+            utl.CONFIG_PATH = config_path
+            utl._CONFIG = None
+            if binary is None:
+                del os.environ['VASP_NORMAL_BINARY']
+            else:
+                os.environ['VASP_NORMAL_BINARY'] = binary
+
 
 if __name__ == '__main__':
     unittest.main()
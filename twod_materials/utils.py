@@ -1,9 +1,32 @@
 import os
 
+import json
+
+import shutil
+
+import subprocess
+
+import tempfile
+
+from functools import partial
+
+from multiprocessing.pool import Pool, ThreadPool
+
+from distutils.spawn import find_executable
+
+import numpy as np
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
 from pymatgen.core.structure import Structure
+from pymatgen.io.vasp.inputs import Poscar
 from pymatgen.io.vasp.outputs import Vasprun
 
 from monty.serialization import loadfn
+from monty.json import MontyEncoder, MontyDecoder
 
 import twod_materials
 
@@ -11,21 +34,222 @@ import twod_materials
 PACKAGE_PATH = twod_materials.__file__.replace('__init__.pyc', '')
 PACKAGE_PATH = PACKAGE_PATH.replace('__init__.py', '')
 
-try:
-    POTENTIAL_PATH = loadfn(
-        os.path.join(os.path.expanduser('~'), 'config.yaml'))['potentials']
-    USR = loadfn(os.path.join(os.path.expanduser('~'),
-                 'config.yaml'))['username']
+# Settings read from ~/config.yaml, and the environment variables that
+# override them.
+CONFIG_PATH = os.path.join(os.path.expanduser('~'), 'config.yaml')
+CONFIG_ENVIRON = {'potentials': 'VASP_PSP_DIR', 'username': 'USERNAME',
+                  'mp_api': 'MP_API', 'normal_binary': 'VASP_NORMAL_BINARY',
+                  'twod_binary': 'VASP_TWOD_BINARY'}
+
+_CONFIG = None
+_MP_CLIENT = None
+
+
+def get_config():
+    """
+    Returns the contents of ~/config.yaml as a dict, with any of the
+    CONFIG_ENVIRON environment variables that are set taking
+    precedence. The file is only read the first time this is called
+    in each process, so importing twod_materials never touches it.
+    """
+
+    global _CONFIG
+    if _CONFIG is None:
+        try:
+            config = loadfn(CONFIG_PATH) or {}
+        except IOError:
+            config = {}
+        for key, variable in CONFIG_ENVIRON.items():
+            if variable in os.environ:
+                config[key] = os.environ[variable]
+        _CONFIG = config
+
+    return _CONFIG
+
+
+def get_config_value(key):
+    """
+    Returns a single setting from get_config(), raising a ValueError
+    that says how to set it if it's missing.
+    """
 
-except IOError:
     try:
-        POTENTIAL_PATH = os.environ['VASP_PSP_DIR']
-        USR = os.environ['USERNAME']
+        return get_config()[key]
     except KeyError:
-        raise ValueError('No config.yaml file found. Please check'
-                         ' that your config.yaml is located in ~/ and'
-                         ' contains the field'
-                         ' potentials: /path/to/your/POTCAR/files/')
+        raise ValueError('No {0} found. Please check that your ~/config.yaml'
+                         ' contains the field {0}: ... or set the {1}'
+                         ' environment variable.'.format(
+                             key, CONFIG_ENVIRON.get(key, key.upper())))
+
+
+def get_mp_client():
+    """
+    Returns an MPRester built from the mp_api setting the first time
+    it's needed, and the same one from then on.
+    """
+
+    global _MP_CLIENT
+    if _MP_CLIENT is None:
+        from pymatgen.matproj.rest import MPRester
+        _MP_CLIENT = MPRester(get_config_value('mp_api'))
+
+    return _MP_CLIENT
+
+
+# Results parsed out of large output files are stored in this file,
+# next to the outputs themselves.
+CACHE_FILENAME = '.twod_cache.json'
+
+
+def get_fingerprint(filename):
+    """
+    Returns [path, size, mtime] for a file, which changes whenever the
+    file is rewritten.
+    """
+
+    stat = os.stat(filename)
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime]
+
+
+def get_cached_result(directory, filename, key, parser):
+    """
+    Returns parser('directory/filename'), reusing the result stored
+    under `key` in directory/.twod_cache.json if the file's path, size
+    and mtime haven't changed since it was parsed. Raises OSError if
+    the file doesn't exist.
+
+    args:
+        parser: function taking a filename and returning anything
+            that monty can serialize (floats, dicts, Structures...).
+    """
+
+    fingerprint = get_fingerprint(os.path.join(directory, filename))
+    cache_path = os.path.join(directory, CACHE_FILENAME)
+
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file, cls=MontyDecoder)
+    except (IOError, ValueError):
+        cache = {}
+
+    if key in cache and cache[key]['fingerprint'] == fingerprint:
+        return cache[key]['data']
+
+    data = parser(os.path.join(directory, filename))
+    cache[key] = {'fingerprint': fingerprint, 'data': data}
+
+    # Write to a temporary file first so that a half-written cache is
+    # never read by another process.
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=CACHE_FILENAME,
+                                        dir=directory)
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(cache, cache_file, cls=MontyEncoder)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        pass
+
+    return data
+
+
+def _parse_vasprun(filename):
+    vasprun = Vasprun(filename, parse_dos=False, parse_eigen=False)
+    return {'converged': vasprun.converged,
+            'final_energy': float(vasprun.final_energy),
+            'final_structure': vasprun.final_structure}
+
+
+def get_vasprun_data(directory):
+    """
+    Returns the parts of directory/vasprun.xml that the analysis
+    functions need, without re-parsing the (often huge) xml if it
+    hasn't changed since the last time:
+
+    {'converged': bool, 'final_energy': float (eV),
+     'final_structure': Structure}
+    """
+
+    return get_cached_result(directory, 'vasprun.xml', 'vasprun',
+                             _parse_vasprun)
+
+
+# Reasons returned by get_convergence().
+CONVERGED = 'converged'
+NO_OUTPUT = 'no vasprun.xml'
+TRUNCATED = 'truncated vasprun.xml'
+NSW_EXHAUSTED = 'NSW exhausted'
+EDIFF_NOT_REACHED = 'EDIFF not reached'
+
+
+def _is_complete(filename):
+    """
+    A finished vasprun.xml always ends by closing the root element,
+    so a running or killed job can be spotted from the last few bytes
+    without parsing anything.
+    """
+
+    with open(filename, 'rb') as vasprun:
+        vasprun.seek(0, os.SEEK_END)
+        vasprun.seek(max(vasprun.tell() - 256, 0))
+        return b'</modeling>' in vasprun.read()
+
+
+def _scan_convergence(filename):
+    """
+    Decides convergence the same way as Vasprun.converged, but by
+    streaming through vasprun.xml and only counting ionic and
+    electronic steps instead of building the whole Vasprun object.
+    """
+
+    if not _is_complete(filename):
+        return (False, TRUNCATED)
+
+    params = {}
+    in_parameters = False
+    n_ionic_steps, n_electronic_steps = 0, 0
+    try:
+        for event, elem in ET.iterparse(filename, events=('start', 'end')):
+            if elem.tag == 'parameters':
+                in_parameters = (event == 'start')
+            elif event == 'start':
+                if elem.tag == 'calculation':
+                    n_ionic_steps += 1
+                    n_electronic_steps = 0
+                elif elem.tag == 'scstep':
+                    n_electronic_steps += 1
+            elif in_parameters and elem.tag == 'i':
+                # Later sections (e.g. response functions) repeat some
+                # tags like NELM, but the first occurrence is the one
+                # VASP actually used.
+                name = elem.attrib.get('name')
+                if name in ('NSW', 'NELM') and name not in params:
+                    params[name] = int(elem.text)
+            elif elem.tag in ('calculation', 'scstep', 'dos',
+                              'eigenvalues', 'projected'):
+                elem.clear()
+    except ET.ParseError:
+        return (False, TRUNCATED)
+
+    if n_electronic_steps >= params.get('NELM', 60):
+        return (False, EDIFF_NOT_REACHED)
+    nsw = params.get('NSW', 0)
+    if nsw > 1 and n_ionic_steps >= nsw:
+        return (False, NSW_EXHAUSTED)
+    return (True, CONVERGED)
+
+
+def get_convergence(directory):
+    """
+    Returns a tuple of (converged, reason) for the calculation in a
+    directory, where reason is one of CONVERGED, NO_OUTPUT,
+    TRUNCATED, NSW_EXHAUSTED or EDIFF_NOT_REACHED.
+    """
+
+    try:
+        return tuple(get_cached_result(directory, 'vasprun.xml',
+                                       'convergence', _scan_convergence))
+    except (IOError, OSError):
+        return (False, NO_OUTPUT)
 
 
 def is_converged(directory):
@@ -33,17 +257,145 @@ def is_converged(directory):
     Check if a relaxation has converged.
     """
 
+    return get_convergence(directory)[0]
+
+
+def _scan_directory(directory, energies=True):
+    converged, reason = get_convergence(directory)
+    result = {'converged': converged, 'final_energy': None,
+              'composition': None}
+    if energies and reason not in (NO_OUTPUT, TRUNCATED):
+        try:
+            vasprun_data = get_vasprun_data(directory)
+        except (IOError, OSError, ET.ParseError):
+            return result
+        result['final_energy'] = vasprun_data['final_energy']
+        result['composition'] = vasprun_data['final_structure'].composition
+    return result
+
+
+def scan_directories(directories, n_workers=8, processes=False,
+                     energies=True):
+    """
+    Check the calculations in many directories at once, using a pool
+    of n_workers threads (on a parallel filesystem the time is mostly
+    spent waiting for files, not parsing them) or, with
+    processes=True, n_workers processes for when parsing is the
+    bottleneck. The current working directory is never changed.
+    Returns
+
+    {directory: {'converged': bool, 'final_energy': float or None,
+                 'composition': Composition or None}}
+
+    converged comes from get_convergence. final_energy and composition
+    are None if vasprun.xml is missing, truncated or unreadable, or if
+    energies=False, which skips parsing them when only convergence is
+    needed.
+    """
+
+    directories = list(directories)
+    n_workers = max(1, min(n_workers, len(directories)))
+    pool = Pool(n_workers) if processes else ThreadPool(n_workers)
     try:
-        if Vasprun('{}/vasprun.xml'.format(directory)).converged:
-            return True
-        else:
-            return False
+        results = pool.map(partial(_scan_directory, energies=energies),
+                           directories)
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict(zip(directories, results))
+
+
+# SLURM job states, translated to the PBS letters used by get_status.
+SLURM_STATES = {'PD': 'Q', 'R': 'R', 'CG': 'R', 'CF': 'Q', 'CD': 'C',
+                'CA': 'E', 'F': 'E', 'TO': 'E', 'NF': 'E', 'PR': 'E',
+                'BF': 'E', 'DL': 'E', 'OOM': 'E', 'S': 'H', 'ST': 'H',
+                'RH': 'Q', 'RQ': 'Q', 'RS': 'Q', 'RD': 'H', 'RF': 'Q',
+                'RV': 'R', 'SE': 'E', 'SI': 'R', 'SO': 'R'}
+
+
+def parse_qstat(output, username=None):
+    """
+    Parses the text of `qstat -f` (PBS/Torque) into a dictionary of
+    {working directory: job_state}. Only jobs owned by `username` are
+    included, unless username is None.
+
+    The working directory is taken from PBS_O_WORKDIR if it's there,
+    and otherwise from the directory of the job's Output_Path.
+    """
+
+    jobs = []
+    for line in output.splitlines():
+        if line.startswith('Job Id:'):
+            jobs.append({})
+            key = None
+        elif jobs and line.startswith('\t') and key:
+            # qstat wraps long values onto tab-indented lines.
+            jobs[-1][key] += line.strip()
+        elif jobs and ' = ' in line:
+            key, value = line.strip().split(' = ', 1)
+            jobs[-1][key] = value
+
+    job_states = {}
+    for job in jobs:
+        if username and \
+                job.get('Job_Owner', '').split('@')[0] != username:
+            continue
+        directory = None
+        for variable in job.get('Variable_List', '').split(','):
+            if variable.startswith('PBS_O_WORKDIR='):
+                directory = variable.split('=', 1)[1]
+        if directory is None and 'Output_Path' in job:
+            directory = os.path.dirname(job['Output_Path'].split(':')[-1])
+        if directory is not None and 'job_state' in job:
+            job_states[os.path.normpath(directory)] = job['job_state']
+
+    return job_states
+
+
+def parse_squeue(output):
+    """
+    Parses the text of `squeue -h -o '%i %t %Z'` (SLURM) into a
+    dictionary of {working directory: job_state}, with the SLURM
+    states translated to PBS letters.
+    """
+
+    job_states = {}
+    for line in output.splitlines():
+        split_line = line.split(None, 2)
+        if len(split_line) == 3:
+            job_states[os.path.normpath(split_line[2].strip())] = \
+                SLURM_STATES.get(split_line[1], split_line[1])
+
+    return job_states
+
+
+def get_job_states(scheduler=None):
+    """
+    Returns {working directory: job_state} for all of your jobs from
+    a single call to the scheduler. Pass the result to get_status()
+    to look up the state of any number of directories without
+    calling the scheduler again.
+
+    args:
+        scheduler: 'pbs' or 'slurm'. Defaults to 'slurm' if squeue is
+            on the PATH, otherwise 'pbs'.
+    """
+
+    if scheduler is None:
+        scheduler = 'slurm' if find_executable('squeue') else 'pbs'
 
-    except:
-        return False
+    username = get_config_value('username')
+    if scheduler == 'slurm':
+        output = subprocess.check_output(
+            ['squeue', '-h', '-u', username, '-o', '%i %t %Z'])
+        return parse_squeue(output.decode())
+    else:
+        output = subprocess.check_output(['qstat', '-f'])
+        return parse_qstat(output.decode(), username=username)
 
 
-def get_status(directory):
+def get_status(directory, job_states=None):
     """
     Return the state of job in a directory. Designed for use on
     HiperGator.
@@ -54,22 +406,88 @@ def get_status(directory):
     'E': error
     'H': hold
     'None': No job in this directory
+
+    args:
+        job_states: the output of get_job_states(). If it isn't
+            given, get_job_states() is called, which lists every job
+            in the scheduler's queue just to look up this one
+            directory. When checking many directories, call
+            get_job_states() once and pass its result to each call.
     """
 
-    os.system("qstat -f| grep -A 30 '{}' >> my_jobs.txt".format(USR))
-    lines = open('my_jobs.txt').readlines()
-    job_state = None
-    for i in range(len(lines)):
-        if 'Output_Path' in lines[i]:
-            joined_line = ''.join([lines[i].strip(), lines[i+1].strip()])
-            if directory in joined_line:
-                for j in range(i, 0, -1):
-                    if 'job_state' in lines[j]:
-                        job_state = lines[j].split('=')[1].strip()
-                        break
-    os.system('rm my_jobs.txt')
+    if job_states is None:
+        job_states = get_job_states()
 
-    return job_state
+    return job_states.get(os.path.normpath(os.path.abspath(directory)))
+
+
+def get_structure_spacing(structure, cutoff=0.95):
+    """
+    Returns the interlayer spacing (Angstroms along z) of a 2D
+    material's Structure. Atoms with fractional z above cutoff are
+    counted as being at the bottom of the cell.
+    """
+
+    z_coords = structure.frac_coords[:, 2]
+    z_coords = np.where(z_coords > cutoff, z_coords - 1, z_coords)
+
+    return ((1.0 + z_coords.min()) - z_coords.max()) \
+        * structure.lattice.matrix[2][2]
+
+
+def _wrap_z_coords(z_coords, cut):
+    """
+    Returns fractional z_coords shifted so that any atoms above cut (or
+    below 0) end up at the bottom of the cell, the lowest at 0.0.
+    """
+
+    wrapped = np.where(z_coords < 0.0, z_coords + 1.0, z_coords)
+    addables = wrapped[wrapped > cut]
+    add_factor = 1.0 - addables.min() if addables.size else 0.0
+
+    z_coords = z_coords + add_factor
+    return np.where(z_coords >= 1.0, z_coords - 1.0, z_coords)
+
+
+def wrap_structure_layers(structure, cut=0.9):
+    """
+    Returns a copy of structure shifted along c so that any atoms that
+    have drifted above cut (or below 0) end up at the bottom of the
+    cell, with the lowest of them at z = 0.0.
+    """
+
+    frac_coords = structure.frac_coords.copy()
+    frac_coords[:, 2] = _wrap_z_coords(frac_coords[:, 2], cut)
+
+    return Structure(structure.lattice, structure.species, frac_coords,
+                     site_properties=structure.site_properties)
+
+
+def add_structure_vacuum(structure, delta, cut=0.9):
+    """
+    Returns a copy of structure, wrapped as in wrap_structure_layers,
+    with its c-vector elongated by delta Angstroms along z. Cartesian
+    heights are unchanged, so all the new space is vacuum.
+    """
+
+    matrix = structure.lattice.matrix.copy()
+    scalar = (matrix[2][2] + delta) / matrix[2][2]
+    matrix[2][2] += delta
+    frac_coords = structure.frac_coords.copy()
+    frac_coords[:, 2] = _wrap_z_coords(frac_coords[:, 2], cut) / scalar
+
+    return Structure(matrix, structure.species, frac_coords,
+                     site_properties=structure.site_properties)
+
+
+def set_structure_vacuum(structure, vacuum, cut=0.9):
+    """
+    Returns a copy of structure with exactly vacuum Angstroms between
+    its layers.
+    """
+
+    return add_structure_vacuum(
+        structure, vacuum - get_structure_spacing(structure), cut)
 
 
 def get_spacing(filename='POSCAR', cutoff=0.95):
@@ -77,229 +495,240 @@ def get_spacing(filename='POSCAR', cutoff=0.95):
     Returns the interlayer spacing for a 2D material.
     """
 
-    structure = Structure.from_file('POSCAR')
+    return get_structure_spacing(Poscar.from_file(filename).structure,
+                                 cutoff)
+
+
+def write_structure(structure, filename='POSCAR', comment=None,
+                    frac_coords=None):
+    """
+    Writes structure to a POSCAR in direct coordinates, all at once.
+    Much faster than Poscar.write_file for large cells, since it
+    formats the coordinates as arrays instead of site by site.
+
+    args:
+        frac_coords: array of fractional coordinates to write instead
+            of structure's own, e.g. for writing many shifted copies of
+            one structure without building a Structure for each.
+    """
+
+    symbols = [site.specie.symbol for site in structure]
+    elements = [symbols[0]]
+    counts = [0]
+    for symbol in symbols:
+        if symbol == elements[-1]:
+            counts[-1] += 1
+        else:
+            elements.append(symbol)
+            counts.append(1)
+
+    if frac_coords is None:
+        frac_coords = structure.frac_coords
+
+    lines = [comment or structure.formula, '1.0']
+    lines += [' '.join('{:.10f}'.format(x) for x in row)
+              for row in structure.lattice.matrix]
+    lines += [' '.join(elements), ' '.join(str(n) for n in counts), 'direct']
+    coords = np.char.mod('%.10f', frac_coords)
+    lines += [' '.join(row) for row in coords]
+
+    with open(filename, 'w') as poscar:
+        poscar.write('\n'.join(lines) + '\n')
+
 
-    lines = open(filename).readlines()
-    c_axis = lines[4].split()
-    lattice_parameter = lines[1].split()
-    split_coords = [line.split() for line in lines[8:8+structure.num_sites]]
-    z_coords = list()
-    for coord in split_coords:
-        z_coord = float(coord[2])
-        if z_coord > cutoff:
-            z_coord -= 1
-        z_coords.append(z_coord)
-    max_height = max([z_height for z_height in z_coords])
-    min_height = min([z_height for z_height in z_coords])
-    spacing = ((1.0 + min_height) - max_height) * float(c_axis[2])\
-        * float(lattice_parameter[0])
+def link_file(source, destination):
+    """
+    Hardlinks source to destination, replacing anything already there.
+    Falls back to a symlink if that isn't possible (e.g. source is on
+    another filesystem), and to a copy if neither is.
+    """
+
+    if os.path.lexists(destination):
+        os.remove(destination)
 
-    return spacing
+    for link in ['link', 'symlink']:
+        try:
+            getattr(os, link)(os.path.abspath(source), destination)
+            return
+        except (AttributeError, OSError):
+            pass
+
+    shutil.copy(source, destination)
 
 
-def add_vacuum(delta, cut=0.9):
+def _transform_poscar(filename, transform, *args):
+    """
+    Reads filename, applies transform(structure, *args) to it and
+    writes the result back in a single write, keeping the comment line.
+    """
+
+    poscar = Poscar.from_file(filename)
+    write_structure(transform(poscar.structure, *args), filename,
+                    poscar.comment)
+
+
+def add_vacuum(delta, cut=0.9, filename='POSCAR'):
     '''
     Adds vacuum to a POSCAR.
 
     delta = vacuum thickness in Angstroms
     cut = height above which atoms will need to be fixed. Defaults to
     0.9.
+    filename = path to the POSCAR to modify.
     '''
 
-    # Fix the POSCAR to put bottom atoms (if they are accidentally above
-    # tolerance) at 0.0.
-    structure = Structure.from_file('POSCAR')
-    with open('POSCAR', 'r') as readcar:
-        poscar_lines = readcar.readlines()
-    n_atoms = structure.num_sites
-    atom_lines = []
-    for i in range(8, 8+n_atoms):
-        atom_lines.append(poscar_lines[i].split())
-    atom_line_2s = []
-    for atom_line in atom_lines:
-        atom_line_2s.append(float(atom_line[2]))
-    fixable = False
-    addables = []
-    for atom_line_2 in atom_line_2s:
-        if float(atom_line_2) > cut or\
-                (float(atom_line_2) < 0.0 and 1.0 + float(atom_line_2) > cut):
-            if float(atom_line_2) < 0.0 and 1.0 + float(atom_line_2) > cut:
-                atom_line_2 = float(atom_line_2) + 1.0
-            addables.append(atom_line_2)
-            fixable = True
-    if fixable:
-        add_factor = 1.0 - min(addables)
-    else:
-        add_factor = 0.0
-    new_atom_lines = []
-    for atom_line in atom_lines:
-        new_atom_line_2 = str(float(atom_line[2]) + add_factor)
-        if float(new_atom_line_2) >= 1.0:
-            new_atom_line_2 = str(float(new_atom_line_2) - 1.0)
-        new_atom_lines.append('{} {} {}'.format(atom_line[0], atom_line[1],
-                                                new_atom_line_2))
-    with open('POSCAR', 'w') as writecar:
-        for line in poscar_lines[0:8]:
-            writecar.write(line)
-        for new_atom_line in new_atom_lines:
-            writecar.write('{}\n'.format(new_atom_line))
-
-    # Open files and read in values from POSCAR
-    old_poscar = open('POSCAR', 'r')
-    new_poscar = open('new_POSCAR', 'w')
-    oldlines = old_poscar.readlines()
-    name = oldlines[0].split()[0]
-    lattice_constant = oldlines[1].strip()
-    a_lat_par = oldlines[2].split()
-    b_lat_par = oldlines[3].split()
-    c_lat_par = oldlines[4].split()
-    elements = oldlines[5].split()
-    stoichiometry = oldlines[6].split()
-    coordinate_type = oldlines[7].strip()
-    n_atoms = 0
-    for item in stoichiometry:
-        n_atoms += int(item)
-    final_atom_line = n_atoms + 8
-
-    # Elongate c-vector by delta
-
-    save = float(c_lat_par[2])
-    c_length = float(c_lat_par[2]) * float(lattice_constant)
-    c_length_plus_delta = c_length + float(delta)
-    c_lat_par[2] = c_length_plus_delta / float(lattice_constant)
-    scalar = c_lat_par[2] / save
-
-    # Create list of atom coordinates and adjust their z-coordinate on
-    # the fly
-
-    atoms = []
-    for i in range(8, final_atom_line):
-        atom = oldlines[i].split()
-        atom[2] = float(atom[2]) / scalar
-        atoms.append(atom)
-
-    # Write updated values to new_POSCAR, copy it to old_POSCAR, then
-    # close files and delete new_POSCAR
-
-    new_poscar.write('{}\n'.format(name))
-    new_poscar.write('{}\n'.format(lattice_constant))
-    for item in a_lat_par:
-        new_poscar.write('{} '.format(item))
-    new_poscar.write('\n')
-    for item in b_lat_par:
-        new_poscar.write('{} '.format(item))
-    new_poscar.write('\n')
-    for item in c_lat_par:
-        new_poscar.write('{} '.format(item))
-    new_poscar.write('\n')
-    for item in elements:
-        new_poscar.write('{} '.format(item))
-    new_poscar.write('\n')
-    for item in stoichiometry:
-        new_poscar.write('{} '.format(item))
-    new_poscar.write('\n')
-    new_poscar.write('{}\n'.format(coordinate_type))
-    for item in atoms:
-        new_poscar.write('{} {} {}\n'.format(item[0], item[1], item[2]))
-
-    new_poscar.close()
-    old_poscar.close()
-    os.remove('POSCAR')
-
-    new_poscar = open('new_POSCAR', 'r')
-    new_lines = new_poscar.readlines()
-    poscar = open('POSCAR', 'w')
-    for line in new_lines:
-        poscar.write(line)
-    old_poscar.close()
-    poscar.close()
-    new_poscar.close()
-    os.remove('new_POSCAR')
+    _transform_poscar(filename, add_structure_vacuum, delta, cut)
+
+
+def set_vacuum(vacuum, cut=0.9, filename='POSCAR'):
+    '''
+    Same as add_vacuum(vacuum - get_spacing(filename), cut, filename),
+    but only reads and writes the POSCAR once.
+    '''
+
+    _transform_poscar(filename, set_structure_vacuum, vacuum, cut)
+
+
+_POTCAR_SYMBOLS = None
+_POTCAR_INDEX = {}
+_POTCAR_RESOLVED = {}
+_POTCAR_BLOBS = {}
+_POTCAR_FILES = {}
+
+
+def get_potcar_index(pot_path):
+    """
+    Returns the set of potentials (e.g. 'Mo_pv') that have a POTCAR in
+    pot_path. The directory is only listed once per process.
+    """
+
+    if pot_path not in _POTCAR_INDEX:
+        _POTCAR_INDEX[pot_path] = set(
+            name for name in os.listdir(pot_path)
+            if os.path.isfile(os.path.join(pot_path, name, 'POTCAR')))
+
+    return _POTCAR_INDEX[pot_path]
+
+
+def resolve_potcar_symbols(elements, types='None', pot_path=None):
+    """
+    Returns a tuple of the potentials to use for elements, using the
+    default types from potcar_symbols.yaml if types is 'None'. If the
+    requested variation of an element doesn't exist in pot_path, the
+    _sv, _pv, _3 and plain versions are tried, in that order. Results
+    are memoized, so this only does any work once per element list.
+    """
+
+    global _POTCAR_SYMBOLS
+    if pot_path is None:
+        pot_path = get_config_value('potentials')
+    key = (pot_path, tuple(elements),
+           types if types == 'None' else tuple(types))
+
+    if key not in _POTCAR_RESOLVED:
+        if types == 'None':
+            if _POTCAR_SYMBOLS is None:
+                _POTCAR_SYMBOLS = loadfn(
+                    os.path.join(PACKAGE_PATH, 'potcar_symbols.yaml'))
+            types = [_POTCAR_SYMBOLS[elt].replace(elt, '').replace('_', '')
+                     for elt in elements]
+
+        available = get_potcar_index(pot_path)
+        symbols = []
+        for element, potcar_type in zip(elements, types):
+            requested = '{}_{}'.format(element, potcar_type) \
+                if potcar_type else element
+            if requested in available:
+                symbols.append(requested)
+                continue
+
+            # If specified pseudopotential doesn't exist, try other
+            # variations.
+            print('Potential file for {} does not exist. Looking for best'
+                  ' variation... '.format(requested))
+            for variation in ['_sv', '_pv', '_3', '']:
+                if element + variation in available:
+                    print('Found one! {} will work.'.format(
+                        element + variation))
+                    symbols.append(element + variation)
+                    break
+            else:
+                raise IOError('No pseudopotential found for {} in {}'.format(
+                    element, pot_path))
+
+        _POTCAR_RESOLVED[key] = tuple(symbols)
+
+    return _POTCAR_RESOLVED[key]
+
+
+def get_potcar_blob(symbols, pot_path=None):
+    """
+    Returns the concatenated contents of the POTCARs for symbols (as
+    returned by resolve_potcar_symbols), read from disk only once.
+    """
+
+    if pot_path is None:
+        pot_path = get_config_value('potentials')
+    key = (pot_path, tuple(symbols))
+
+    if key not in _POTCAR_BLOBS:
+        blob = []
+        for symbol in symbols:
+            with open(os.path.join(pot_path, symbol, 'POTCAR'), 'rb') as f:
+                blob.append(f.read())
+        _POTCAR_BLOBS[key] = b''.join(blob)
 
+    return _POTCAR_BLOBS[key]
 
-def write_potcar(pot_path=POTENTIAL_PATH, types='None'):
+
+def write_potcar(pot_path=None, types='None', directory='.', link=False):
     '''
     Writes a POTCAR file based on a list of types.
 
+    pot_path = directory of POTCARs, defaults to the potentials setting
+    in ~/config.yaml.
+
     types = list of same length as number of elements containing specifications
     for the kind of potential desired for each element. If no special potential
     is desired, just enter '', or leave types = 'None'.
     (['pv', '', '3'])
+    directory = where to find the POSCAR and write the POTCAR.
+    link = hardlink to the first POTCAR written (in this process) with
+    the same potentials instead of writing another copy.
     '''
-    poscar = open('POSCAR', 'r')
+    if pot_path is None:
+        pot_path = get_config_value('potentials')
+
+    poscar = open(os.path.join(directory, 'POSCAR'), 'r')
     lines = poscar.readlines()
     elements = lines[5].split()
     poscar.close()
 
-    potcar_symbols = loadfn(os.path.join(PACKAGE_PATH, 'potcar_symbols.yaml'))
+    key = (pot_path, resolve_potcar_symbols(elements, types, pot_path))
+    potcar = os.path.join(directory, 'POTCAR')
 
-    if types == 'None':
-        types = [potcar_symbols[elt].replace(elt, '').replace('_', '')
-                 for elt in elements]
-
-    potentials = []
-    for i in range(len(elements)):
-        if types[i] == '':
+    if link and key in _POTCAR_FILES:
+        if os.path.exists(potcar):
+            os.remove(potcar)
+        try:
+            os.link(_POTCAR_FILES[key], potcar)
+            return
+        except OSError:
             pass
-        else:
-            elements[i] += '_{}'.format(types[i])
 
-        # If specified pseudopotential doesn't exist, try other variations.
-        if os.path.exists('{}/{}/POTCAR'.format(pot_path, elements[i])):
-            pass
-        else:
-            print 'Potential file for {} does not exist. Looking for best'\
-                  'variation... '.format(elements[i])
-            if types[i] == 'regular':
-                length = 0
-            else:
-                length = len(types[i]) + 1
-                elements[i] = elements[i][:-length]
-            elements[i] += '_sv'
-            if os.path.exists('{}/{}/POTCAR'.format(
-                    pot_path, elements[i])):
-                print 'Found one! {} will work.'.format(elements[i])
-            else:
-                elements[i] = elements[i][:-3]
-                elements[i] += '_pv'
-                if os.path.exists('{}/{}/POTCAR'.format(
-                        pot_path, elements[i])):
-                    print 'Found one! {} will work.'.format(elements[i])
-                else:
-                    elements[i] = elements[i][:-3]
-                    elements[i] += '_3'
-                    if os.path.exists('{}/{}/POTCAR'.format(
-                            pot_path, elements[i])):
-                        print 'Found one! {} will work.'.format(elements[i])
-                    else:
-                        elements[i] = elements[i][:-2]
-                        if os.path.exists('{}/{}/POTCAR'.format(
-                                pot_path, elements[i])):
-                            print ('Found one! {} will '
-                                   'work.'.format(elements[i]))
-                        else:
-                            print ('No pseudopotential found'
-                                   ' for {}'.format(elements[i]))
-
-    # Create paths, open files, and write files to POTCAR for each potential.
-    for element in elements:
-        potentials.append('{}/{}/POTCAR'.format(pot_path, element))
-    outfile = open('POTCAR', 'w')
-    for potential in potentials:
-        infile = open(potential)
-        for line in infile:
-            outfile.write(line)
-        infile.close()
-    outfile.close()
-
-
-def write_pbs_runjob(name, nnodes, nprocessors, pmem, walltime, binary):
+    with open(potcar, 'wb') as outfile:
+        outfile.write(get_potcar_blob(key[1], pot_path))
+    _POTCAR_FILES[key] = os.path.abspath(potcar)
+
+
+def write_pbs_runjob(name, nnodes, nprocessors, pmem, walltime, binary,
+                     directory='.'):
     '''
     writes a runjob based on a name, nnodes, nprocessors, walltime, and
-    binary. Designed for runjobs on the Hennig group_list on HiperGator
-    1 (PBS).
+    binary into directory. Designed for runjobs on the Hennig
+    group_list on HiperGator 1 (PBS).
     '''
-    runjob = open('runjob', 'w')
+    runjob = open(os.path.join(directory, 'runjob'), 'w')
     runjob.write('#!/bin/sh\n')
     runjob.write('#PBS -N {}\n'.format(name))
     runjob.write('#PBS -o test.out\n')
@@ -315,13 +744,13 @@ def write_pbs_runjob(name, nnodes, nprocessors, pmem, walltime, binary):
     runjob.close()
 
 
-def write_slurm_runjob(name, ntasks, pmem, walltime, binary):
+def write_slurm_runjob(name, ntasks, pmem, walltime, binary, directory='.'):
     '''
     writes a runjob based on a name, nnodes, nprocessors, walltime, and
-    binary. Designed for runjobs on the Hennig group_list on HiperGator
-    1 (PBS).
+    binary into directory. Designed for runjobs on the Hennig
+    group_list on HiperGator 2 (SLURM).
     '''
-    runjob = open('runjob', 'w')
+    runjob = open(os.path.join(directory, 'runjob'), 'w')
     runjob.write('#!/bin/bash\n')
     runjob.write('#SBATCH --job-name={}\n'.format(name))
     runjob.write('#SBATCH -o out_%j.log\n')
@@ -337,3 +766,12 @@ def write_slurm_runjob(name, ntasks, pmem, walltime, binary):
     runjob.write('mpirun {} > job.log\n\n'.format(binary))
     runjob.write('echo \'Done.\'\n')
     runjob.close()
+
+
+def submit_runjob(submission_command, directory='.'):
+    '''
+    Runs submission_command (e.g. 'qsub runjob') from inside
+    directory, without changing the working directory of this
+    process.
+    '''
+    subprocess.call(submission_command, shell=True, cwd=directory)